@@ -277,6 +277,12 @@ export function getFontPreviewUrl(fontItem: FontItem): string {
     return fontItem.font_file_url
 }
 
+// 只包含指定文字的 WOFF2 子集（字符去重排序，相同字符集命中同一缓存）
+export function getFontSubsetUrl(fontItem: FontItem, text: string): string {
+    const chars = Array.from(new Set(Array.from(text))).sort().join('')
+    return `${API_BASE}/items/${fontItem.id}/subset?text=${encodeURIComponent(chars)}`
+}
+
 export function formatFileSize(bytes: number): string {
     if (bytes === 0) return '0 Bytes'
     const k = 1024
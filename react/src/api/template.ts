@@ -72,11 +72,23 @@ export async function getTemplates(filters?: TemplateSearchFilters): Promise<Tem
         })
     }
 
-    const response = await fetch(`${API_BASE}/items?${params.toString()}`)
-    if (!response.ok) {
-        throw new Error(`Failed to fetch templates: ${response.statusText}`)
-    }
-    return await response.json()
+    // 服务端按页返回，X-Next-Cursor 为空表示最后一页
+    const templates: TemplateItem[] = []
+    let cursor: string | null = null
+    do {
+        const pageParams = new URLSearchParams(params)
+        pageParams.set('limit', '200')
+        if (cursor) {
+            pageParams.set('cursor', cursor)
+        }
+        const response = await fetch(`${API_BASE}/items?${pageParams.toString()}`)
+        if (!response.ok) {
+            throw new Error(`Failed to fetch templates: ${response.statusText}`)
+        }
+        templates.push(...(await response.json()))
+        cursor = response.headers.get('X-Next-Cursor')
+    } while (cursor)
+    return templates
 }
 
 export async function getTemplateById(id: string): Promise<TemplateItem> {
@@ -297,11 +309,23 @@ export async function searchTemplates(query: string, filters?: TemplateSearchFil
         })
     }
 
-    const response = await fetch(`${API_BASE}/search?${params.toString()}`)
-    if (!response.ok) {
-        throw new Error(`Failed to search templates: ${response.statusText}`)
-    }
-    return await response.json()
+    // 与 getTemplates 相同，沿 X-Next-Cursor 取完所有页
+    const templates: TemplateItem[] = []
+    let cursor: string | null = null
+    do {
+        const pageParams = new URLSearchParams(params)
+        pageParams.set('limit', '200')
+        if (cursor) {
+            pageParams.set('cursor', cursor)
+        }
+        const response = await fetch(`${API_BASE}/search?${pageParams.toString()}`)
+        if (!response.ok) {
+            throw new Error(`Failed to search templates: ${response.statusText}`)
+        }
+        templates.push(...(await response.json()))
+        cursor = response.headers.get('X-Next-Cursor')
+    } while (cursor)
+    return templates
 }
 
 // 获取模板统计信息
@@ -24,7 +24,7 @@ import {
   DropdownMenuTrigger,
 } from '@/components/ui/dropdown-menu'
 import { ExcalidrawTextElement } from '@excalidraw/excalidraw/element/types'
-import { getFonts, type FontItem, toggleFontFavorite } from '@/api/font'
+import { getFonts, getFontSubsetUrl, type FontItem, toggleFontFavorite } from '@/api/font'
 import { FontUploadDialog } from '@/components/font/FontUploadDialog'
 import { toast } from 'sonner'
 
@@ -62,9 +62,13 @@ export function TextToolbar({ selectedElement }: TextToolbarProps) {
       const fonts = await getFonts()
       setCustomFonts(fonts)
 
-      // 预加载所有自定义字体
+      // 预加载自定义字体：只下载画布文字和字体名称用到的字符，选中字体时再加载完整字体
+      const sceneText = (excalidrawAPI?.getSceneElements() || [])
+        .filter((element) => element.type === 'text')
+        .map((element) => (element as ExcalidrawTextElement).text)
+        .join('')
       fonts.forEach((font) => {
-        const fontFace = new FontFace(font.font_family, `url(${font.font_file_url})`)
+        const fontFace = new FontFace(font.font_family, `url(${getFontSubsetUrl(font, sceneText + font.name)})`)
         fontFace.load().then(() => {
           document.fonts.add(fontFace)
         }).catch((error) => {
@@ -76,7 +80,7 @@ export function TextToolbar({ selectedElement }: TextToolbarProps) {
     } finally {
       setLoadingFonts(false)
     }
-  }, [])
+  }, [excalidrawAPI])
 
   // 初始化加载自定义字体
   useEffect(() => {
@@ -152,6 +152,8 @@ export function TemplateCard({
                                     )}
                                     <img
                                         src={template.thumbnail_url}
+                                        srcSet={template.thumbnail_srcset || undefined}
+                                        sizes="64px"
                                         alt={template.name}
                                         className={`w-full h-full object-contain transition-opacity duration-200 ${imageLoading ? 'opacity-0' : 'opacity-100'
                                             }`}
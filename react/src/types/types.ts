@@ -119,6 +119,7 @@ export interface TemplateItem {
   category_id: string
   type: 'psd_file' | 'psd_layer' | 'image' | 'text_style' | 'layer_group' | 'canvas_element'
   thumbnail_url?: string
+  thumbnail_srcset?: string | null
   preview_url?: string
   metadata: {
     // PSD文件模板
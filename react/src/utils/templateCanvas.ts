@@ -58,16 +58,29 @@ async function convertImageUrlToDataURL(imageUrl: string, retries: number = 3):
 async function createImageElement(
     excalidrawAPI: ExcalidrawImperativeAPI,
     imageUrl: string,
-    elementData: any
+    elementData: any,
+    stableFileId?: string
 ): Promise<any> {
     try {
         console.log('正在創建圖片元素:', imageUrl)
 
-        // 直接使用fetch獲取圖片
+        // 服務端給出的文件ID帶圖片版本，畫布中已有同一文件時直接複用，不再下載
+        if (stableFileId && excalidrawAPI.getFiles()[stableFileId]) {
+            return {
+                ...elementData,
+                type: 'image' as const,
+                fileId: stableFileId,
+                src: undefined,
+                alt: undefined,
+                crop: null
+            }
+        }
+
+        // 直接使用fetch獲取圖片（帶版本的URL內容不變，可以使用瀏覽器緩存）
         const response = await fetch(imageUrl, {
             mode: 'cors',
             credentials: 'omit',
-            cache: 'no-cache'
+            cache: stableFileId ? 'default' : 'no-cache'
         })
 
         if (!response.ok) {
@@ -89,7 +102,7 @@ async function createImageElement(
         })
 
         // 生成唯一的文件ID
-        const fileId = `template-image-${Date.now()}-${Math.random().toString(36).substr(2, 9)}` as any
+        const fileId = (stableFileId || `template-image-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`) as any
 
         // 创建Excalidraw文件数据
         const fileData = {
@@ -127,6 +140,20 @@ async function createImageElement(
     }
 }
 
+/** PSD模板中要插入画布的图层 */
+interface PSDCanvasLayer {
+    index: number
+    name: string
+    type: string
+    left: number
+    top: number
+    width: number
+    height: number
+    opacity: number
+    image_url: string
+    file_id?: string
+}
+
 /**
  * 处理PSD文件模板
  */
@@ -136,24 +163,44 @@ async function handlePSDFileTemplate(
     excalidrawAPI: ExcalidrawImperativeAPI
 ): Promise<void> {
     try {
-        // 获取PSD模板的图层信息
+        // 获取PSD模板的图层信息（elements 为服务端预计算的画布元素，只含可见且有位图的图层）
         const psdData = await getPSDTemplateLayers(template.id)
+        const canvasLayers: PSDCanvasLayer[] = psdData.elements
+            ? psdData.elements.map((element: any) => ({
+                index: element.layer_index,
+                name: element.name,
+                type: element.type,
+                left: element.x,
+                top: element.y,
+                width: element.width,
+                height: element.height,
+                opacity: element.opacity,
+                image_url: element.image_url,
+                file_id: element.file_id
+            }))
+            : (psdData.layers || [])
+                .filter((layer: any) => {
+                    if (!layer.visible || !layer.image_url) {
+                        console.log(`跳过图层 ${layer.name}: visible=${layer.visible}, image_url=${layer.image_url}`)
+                        return false
+                    }
+                    return true
+                })
+                .map((layer: any) => ({
+                    ...layer,
+                    // 旧接口返回PSD透明度（0-255），画布使用0-100
+                    opacity: Math.round(((layer.opacity ?? 255) * 100) / 255)
+                }))
 
-        if (!psdData.layers || psdData.layers.length === 0) {
+        if (canvasLayers.length === 0) {
             console.warn('PSD模板没有图层数据')
             return
         }
 
-        const elements = excalidrawAPI.getSceneElements()
         const newElements: any[] = []
 
         // 为每个图层创建Excalidraw元素
-        for (const layer of psdData.layers) {
-            if (!layer.visible || !layer.image_url) {
-                console.log(`跳过图层 ${layer.name}: visible=${layer.visible}, image_url=${layer.image_url}`)
-                continue
-            }
-
+        for (const layer of canvasLayers) {
             const elementId = `psd-template-${template.id}-layer-${layer.index}-${Date.now()}`
 
             // 计算图层位置（相对于PSD文件的位置）
@@ -181,7 +228,7 @@ async function handlePSDFileTemplate(
                     strokeWidth: 0,
                     strokeStyle: 'solid' as const,
                     roughness: 1,
-                    opacity: layer.opacity || 255,
+                    opacity: layer.opacity,
                     groupIds: [],
                     frameId: null,
                     roundness: null,
@@ -209,7 +256,7 @@ async function handlePSDFileTemplate(
                 }
 
                 // 使用新的图片创建方法
-                const imageElement = await createImageElement(excalidrawAPI, layer.image_url, elementData)
+                const imageElement = await createImageElement(excalidrawAPI, layer.image_url, elementData, layer.file_id)
                 newElements.push(imageElement)
             } catch (error) {
                 console.error(`创建图层 ${layer.name} 失败:`, error)
@@ -229,7 +276,7 @@ async function handlePSDFileTemplate(
                     strokeWidth: 2,
                     strokeStyle: 'solid' as const,
                     roughness: 1,
-                    opacity: layer.opacity || 255,
+                    opacity: layer.opacity,
                     groupIds: [],
                     frameId: null,
                     roundness: null,
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+PSD缩放接口压测
+对运行中的服务并发调用 /api/psd/resize/resize-by-id，统计端到端吞吐量和延迟分位数。
+配合 mock_layout_server.py（PSD_LAYOUT_PROVIDER=http）或 PSD_LAYOUT_PROVIDER=local 可完全离线运行。
+
+相同 (PSD, 尺寸, 选项) 的并发请求会被服务端合并，默认每个请求的目标宽度加上序号以避免合并，
+使用 --no-vary 可测量合并后的效果。
+
+用法:
+    python layout_load_test.py <file_id> --size 1080x1920 -n 200 -c 16 [--server http://127.0.0.1:57988]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+async def run(args):
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    url = args.server.rstrip("/") + "/api/psd/resize/resize-by-id"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = {}
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        async def one(index):
+            data = {
+                "file_id": args.file_id,
+                "target_width": str(width + (index if args.vary else 0)),
+                "target_height": str(height),
+                "stream": "true" if args.stream else "false",
+                "quality": args.quality,
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, data=data)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError as e:
+                    key = type(e).__name__
+                    if isinstance(e, httpx.HTTPStatusError):
+                        key = f"HTTP {e.response.status_code}"
+                    errors[key] = errors.get(key, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(args.requests)))
+        wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_seconds": wall,
+        "requests_per_second": len(latencies) / wall if wall > 0 else 0.0,
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PSD缩放接口压测")
+    parser.add_argument("file_id", help="已上传PSD的file_id")
+    parser.add_argument("--server", default="http://127.0.0.1:57988")
+    parser.add_argument("--size", default="1080x1920", help="目标尺寸 宽x高")
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="使用流式布局（边生成边渲染）")
+    parser.add_argument("--quality", default="balanced", help="重采样档位 quality / balanced / draft")
+    parser.add_argument("--no-vary", dest="vary", action="store_false", help="所有请求使用相同尺寸")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("-o", "--output", default=None, help="结果JSON保存路径")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
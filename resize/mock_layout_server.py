@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+PSD布局模拟服务（OpenAI兼容接口）
+在本地代替真实模型返回布局，用于离线压测缩放流水线的吞吐量和尾延迟：
+- 固定返回 --canned 指定的JSON，或从提示词中的图层表生成等比缩放居中的布局
+- 可配置基础延迟、抖动、慢请求比例和错误率
+- GET /stats 返回请求数、错误数和服务端延迟分位数
+
+用法:
+    python mock_layout_server.py --port 8765 --latency-ms 800 --jitter-ms 400 --error-rate 0.02
+    # 服务端使用: PSD_LAYOUT_PROVIDER=http PSD_LAYOUT_HTTP_URL=http://127.0.0.1:8765/v1
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+from itertools import count
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 提示词中的图层表格式
+TABLE_ROW_PATTERN = re.compile(r'^\s*(\d+)\s+\d+\s+.*\((-?\d+),\s*(-?\d+),\s*(-?\d+),\s*(-?\d+)\)')
+ORIGINAL_SIZE_PATTERN = re.compile(r'原始尺寸[^\d]{0,10}(\d+)\s*x\s*(\d+)')
+TARGET_SIZE_PATTERN = re.compile(r'目[標标]尺寸[^\d]{0,10}(\d+)\s*x\s*(\d+)')
+
+
+class MockStats:
+    """服务端统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.requests = 0
+            self.errors = 0
+            self.latencies = []
+
+    def record(self, seconds, failed):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(failed)
+            if not failed:
+                self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            values = sorted(self.latencies)
+            elapsed = time.time() - self.started_at
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed_seconds": elapsed,
+            "requests_per_second": self.requests / elapsed if elapsed > 0 else 0.0,
+            "latency_seconds": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": values[-1] if values else None,
+            },
+        }
+
+
+def extract_prompt(body):
+    """取出消息中的文本部分"""
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(texts)
+
+
+def parse_layers(prompt):
+    """解析提示词中第一个代码块里的图层表（CSV或对齐表格），返回 [(id, left, top, right, bottom)]"""
+    match = re.search(r'```[a-z]*\n(.*?)```', prompt, re.S)
+    if not match:
+        return []
+    block = match.group(1).strip()
+    layers = []
+    if block.startswith("id,"):
+        for row in csv.DictReader(io.StringIO(block)):
+            try:
+                layers.append(tuple(int(row[key]) for key in ("id", "left", "top", "right", "bottom")))
+            except (KeyError, TypeError, ValueError):
+                continue
+    else:
+        for line in block.splitlines():
+            row = TABLE_ROW_PATTERN.match(line)
+            if row:
+                layers.append(tuple(int(value) for value in row.groups()))
+    return layers
+
+
+def synthesize_layout(prompt):
+    """按原始位置等比缩放并居中生成布局，无法解析时返回空数组（由服务端按比例补全）"""
+    original = ORIGINAL_SIZE_PATTERN.search(prompt)
+    target = TARGET_SIZE_PATTERN.search(prompt)
+    layers = parse_layers(prompt)
+    if not (original and target and layers):
+        return "[]"
+    ow, oh = (int(value) for value in original.groups())
+    tw, th = (int(value) for value in target.groups())
+    scale = min(tw / ow, th / oh)
+    offset_x = (tw - ow * scale) / 2
+    offset_y = (th - oh * scale) / 2
+    items = []
+    for layer_id, left, top, right, bottom in layers:
+        items.append({
+            "id": layer_id,
+            "new_coords": {
+                "left": round(left * scale + offset_x),
+                "top": round(top * scale + offset_y),
+                "right": round(right * scale + offset_x),
+                "bottom": round(bottom * scale + offset_y),
+            },
+        })
+    return json.dumps(items, ensure_ascii=False)
+
+
+def create_app(args):
+    app = FastAPI(title="PSD Layout Mock Server")
+    stats = MockStats()
+    ids = count(1)
+    canned = None
+    if args.canned:
+        with open(args.canned, "r", encoding="utf-8") as f:
+            canned = f.read()
+
+    def sample_latency():
+        latency = args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)
+        if random.random() < args.slow_rate:
+            latency += args.slow_ms
+        return max(0.0, latency) / 1000
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        start = time.perf_counter()
+        body = await request.json()
+        completion_id = f"chatcmpl-mock-{next(ids)}"
+        model = body.get("model", "layout-mock")
+
+        await asyncio.sleep(sample_latency())
+        if random.random() < args.error_rate:
+            stats.record(time.perf_counter() - start, failed=True)
+            return JSONResponse(
+                status_code=args.error_status,
+                content={"error": {"message": "mock injected error", "type": "server_error"}}
+            )
+
+        text = canned if canned is not None else synthesize_layout(extract_prompt(body))
+
+        if not body.get("stream"):
+            stats.record(time.perf_counter() - start, failed=False)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(text) // 4, "total_tokens": len(text) // 4},
+            }
+
+        async def events():
+            def chunk(delta, finish_reason=None):
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            for offset in range(0, len(text), args.chunk_chars):
+                yield chunk({"content": text[offset:offset + args.chunk_chars]})
+                if args.chunk_delay_ms:
+                    await asyncio.sleep(args.chunk_delay_ms / 1000)
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+            stats.record(time.perf_counter() - start, failed=False)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.snapshot()
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        stats.reset()
+        return {"success": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PSD布局模拟服务（OpenAI兼容接口）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--canned", default=None, help="固定返回的布局JSON文件，不指定时根据提示词生成")
+    parser.add_argument("--latency-ms", type=float, default=500, help="基础延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="延迟的均匀抖动范围（毫秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="慢请求比例，用于模拟长尾")
+    parser.add_argument("--slow-ms", type=float, default=5000, help="慢请求额外延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的比例")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误的HTTP状态码（429/500/503等）")
+    parser.add_argument("--chunk-chars", type=int, default=64, help="流式输出每块的字符数")
+    parser.add_argument("--chunk-delay-ms", type=float, default=20, help="流式输出块间隔（毫秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（可复现延迟和错误序列）")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
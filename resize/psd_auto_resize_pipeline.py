@@ -11,9 +11,10 @@ import os
 import sys
 import json
 import re
+import time
 from pathlib import Path
-import google.generativeai as genai
-from google.generativeai import types
+from google import genai
+from google.genai import types
 
 # 导入现有的模块
 from psd_layer_info import get_psd_layers_info, draw_detection_boxes, print_layers_info
@@ -21,7 +22,8 @@ from resize_psd import resize_psd_with_new_positions
 
 
 class PSDAutoResizePipeline:
-    def __init__(self, psd_path, target_width, target_height, api_key=None):
+    def __init__(self, psd_path, target_width, target_height, api_key=None, output_dir=None, limiter=None,
+                 output_psd=False):
         """
         初始化PSD自动缩放流程
 
@@ -30,27 +32,39 @@ class PSDAutoResizePipeline:
             target_width: 目标宽度
             target_height: 目标高度
             api_key: Gemini API密钥（如果不提供，从环境变量读取）
+            output_dir: 输出目录（不提供时输出到PSD所在目录，文件名带时间戳）
+            limiter: 调用Gemini前需要占用的限流器（批处理时多个流程共享）
+            output_psd: 是否同时输出分层PSD（默认只输出PNG）
         """
         self.psd_path = Path(psd_path)
         self.target_width = target_width
         self.target_height = target_height
-        # self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        self.api_key = "AIzaSyBi***************"
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self.limiter = limiter
+        self.write_psd = output_psd
+        # 各阶段耗时（秒）
+        self.timings = {}
 
         if not self.api_key:
             raise ValueError("需要提供Gemini API密钥，通过参数或GEMINI_API_KEY环境变量")
 
         # 设置输出文件路径
         self.base_name = self.psd_path.stem
-        self.output_dir = self.psd_path.parent
-        # 文件名加上时间戳
-        import time
-        timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-        self.layer_info_json = self.output_dir / f"{self.base_name}_{timestamp}_layers_info.json"
-        self.detection_image = self.output_dir / f"{self.base_name}_{timestamp}_detection.png"
-        self.new_position_json = self.output_dir / f"{self.base_name}_{timestamp}_new_positions.json"
-        self.output_psd = self.output_dir / f"{self.base_name}_{timestamp}_resized.psd"
-        self.output_png = self.output_dir / f"{self.base_name}_{timestamp}_resized.png"
+        if output_dir:
+            # 指定输出目录时使用固定文件名，重复运行覆盖同一组文件
+            self.output_dir = Path(output_dir)
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            prefix = f"{self.base_name}_{target_width}x{target_height}"
+        else:
+            self.output_dir = self.psd_path.parent
+            # 文件名加上时间戳
+            timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+            prefix = f"{self.base_name}_{timestamp}"
+        self.layer_info_json = self.output_dir / f"{prefix}_layers_info.json"
+        self.detection_image = self.output_dir / f"{prefix}_detection.png"
+        self.new_position_json = self.output_dir / f"{prefix}_new_positions.json"
+        self.output_psd = self.output_dir / f"{prefix}_resized.psd"
+        self.output_png = self.output_dir / f"{prefix}_resized.png"
 
     def step1_extract_layer_info(self):
         """
@@ -104,9 +118,16 @@ class PSDAutoResizePipeline:
             image_data = f.read()
         image_base64 = base64.b64encode(image_data).decode('utf-8')
 
-        # 调用Gemini API
-        print("\n正在调用Gemini API...")
-        response_text = self._call_gemini_api(prompt, image_base64)
+        # 调用Gemini API（有限流器时先排队等待配额，等待时间单独记录）
+        if self.limiter is not None:
+            wait_start = time.perf_counter()
+            with self.limiter.slot():
+                self.timings["layout_wait"] = time.perf_counter() - wait_start
+                print("\n正在调用Gemini API...")
+                response_text = self._call_gemini_api(prompt, image_base64)
+        else:
+            print("\n正在调用Gemini API...")
+            response_text = self._call_gemini_api(prompt, image_base64)
 
         # 解析JSON响应
         new_positions = self._parse_gemini_response(response_text)
@@ -120,19 +141,20 @@ class PSDAutoResizePipeline:
 
     def step3_rebuild_psd(self):
         """
-        步骤3: 根据新位置重建PSD并渲染为PNG
+        步骤3: 根据新位置重建PSD并渲染为PNG，开启 output_psd 时同时输出分层PSD
         """
         print("\n" + "=" * 80)
-        print("步骤3: 重建并渲染为PNG")
+        print("步骤3: 重建并渲染为PNG" + ("和分层PSD" if self.write_psd else ""))
         print("=" * 80)
 
-        # 调用resize_psd_with_new_positions函数，输出 PNG 文件
+        # 调用resize_psd_with_new_positions函数，输出 PNG 文件；分层PSD复用同一次渲染的图层
         result_image = resize_psd_with_new_positions(
             str(self.psd_path),
             str(self.new_position_json),
             str(self.output_png),
             self.target_width,
-            self.target_height
+            self.target_height,
+            output_psd_path=str(self.output_psd) if self.write_psd else None
         )
 
         print(f"\n最终 PNG 文件已保存到: {self.output_png}")
@@ -149,14 +171,7 @@ class PSDAutoResizePipeline:
         print("=" * 80 + "\n")
 
         try:
-            # 步骤1: 提取图层信息
-            self.step1_extract_layer_info()
-
-            # 步骤2: 使用Gemini生成新位置
-            self.step2_generate_new_positions_with_gemini()
-
-            # 步骤3: 重建PSD
-            self.step3_rebuild_psd()
+            self.execute()
 
             print("\n" + "=" * 80)
             print("流程完成!")
@@ -164,6 +179,8 @@ class PSDAutoResizePipeline:
             print(f"\n生成的文件:")
             print(f"  - 新位置JSON: {self.new_position_json}")
             print(f"  - 输出PNG文件: {self.output_png}")
+            if self.write_psd:
+                print(f"  - 分层PSD文件: {self.output_psd}")
 
         except Exception as e:
             print(f"\n错误: {e}")
@@ -171,6 +188,24 @@ class PSDAutoResizePipeline:
             traceback.print_exc()
             sys.exit(1)
 
+    def execute(self):
+        """
+        依次执行三个步骤，失败时直接抛出异常（供批处理调用）
+
+        返回:
+            各阶段耗时 {extract, layout, layout_wait, render}，layout包含等待配额的时间
+        """
+        steps = [
+            ("extract", self.step1_extract_layer_info),
+            ("layout", self.step2_generate_new_positions_with_gemini),
+            ("render", self.step3_rebuild_psd),
+        ]
+        for stage, step in steps:
+            start = time.perf_counter()
+            step()
+            self.timings[stage] = time.perf_counter() - start
+        return self.timings
+
     def _format_layer_info_for_prompt(self):
         """格式化图层信息为prompt文本"""
         lines = []
@@ -345,19 +380,24 @@ class PSDAutoResizePipeline:
 
 def main():
     """主函数"""
-    if len(sys.argv) < 4:
-        print("使用方法: python psd_auto_resize_pipeline.py <PSD文件> <目标宽度> <目标高度> [API密钥]")
+    # --psd 可出现在任意位置，开启分层PSD输出
+    args = [arg for arg in sys.argv[1:] if arg != "--psd"]
+    output_psd = len(args) != len(sys.argv) - 1
+
+    if len(args) < 3:
+        print("使用方法: python psd_auto_resize_pipeline.py <PSD文件> <目标宽度> <目标高度> [API密钥] [--psd]")
         print("示例: python psd_auto_resize_pipeline.py input.psd 1200 628")
         print("\n注意: API密钥可以通过参数传递，或设置环境变量 GEMINI_API_KEY")
+        print("      --psd 同时输出分层PSD（默认只输出PNG）")
         sys.exit(1)
 
-    psd_path = sys.argv[1]
-    target_width = int(sys.argv[2])
-    target_height = int(sys.argv[3])
-    api_key = sys.argv[4] if len(sys.argv) > 4 else None
+    psd_path = args[0]
+    target_width = int(args[1])
+    target_height = int(args[2])
+    api_key = args[3] if len(args) > 3 else None
 
     # 创建并运行流程
-    pipeline = PSDAutoResizePipeline(psd_path, target_width, target_height, api_key)
+    pipeline = PSDAutoResizePipeline(psd_path, target_width, target_height, api_key, output_psd=output_psd)
     pipeline.run()
 
 
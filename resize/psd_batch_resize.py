@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+PSD批量自动缩放
+对 目录/清单中的PSD × 目标尺寸 逐个执行 PSDAutoResizePipeline：
+1. 固定大小的工作线程池并行处理，所有流程共享同一个Gemini限流器
+2. 每完成一个单元追加写入 batch_manifest.jsonl，中断后重新运行会跳过已完成的单元
+3. 结束时写出 batch_summary.json（吞吐量、各阶段耗时、失败列表）
+
+用法:
+    python psd_batch_resize.py <PSD目录或清单文件> -o <输出目录> [--sizes 1080x1920,1200x628] [-j 4] [--rpm 15]
+
+清单文件每行一个单元，支持:
+    {"psd": "a.psd", "width": 1080, "height": 1920}
+    {"psd": "b.psd", "sizes": ["1080x1920", "1200x628"]}
+    c.psd                      （纯路径，使用 --sizes）
+相对路径相对于清单文件所在目录
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+from psd_auto_resize_pipeline import PSDAutoResizePipeline
+
+MANIFEST_NAME = "batch_manifest.jsonl"
+SUMMARY_NAME = "batch_summary.json"
+STAGES = ("extract", "layout_wait", "layout", "render")
+
+
+class SharedRateLimiter:
+    """
+    线程间共享的Gemini限流器
+
+    每分钟请求数令牌桶 + 同时进行中的请求数上限
+    """
+
+    def __init__(self, rpm, max_concurrency):
+        self.capacity = max(1, rpm)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self):
+        """占用一个请求名额: with limiter.slot(): ..."""
+        self._semaphore.acquire()
+        try:
+            self._take_token()
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class _ThreadStdout:
+    """按线程分流的stdout，工作线程的输出写入各自单元的日志文件，避免并行时日志交错"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def redirect(self, log_file):
+        self._local.file = log_file
+
+    def write(self, text):
+        target = getattr(self._local, "file", None) or self.stream
+        return target.write(text)
+
+    def flush(self):
+        target = getattr(self._local, "file", None) or self.stream
+        target.flush()
+
+
+def parse_size(text):
+    """解析 1080x1920 格式的尺寸"""
+    try:
+        width, height = text.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的尺寸: {text}，应为 宽x高，例如 1080x1920")
+
+
+def unit_id(psd_path, width, height):
+    """单元ID: 文件名 + 路径哈希（区分不同目录的同名文件）+ 尺寸"""
+    digest = hashlib.sha1(str(Path(psd_path).resolve()).encode("utf-8")).hexdigest()[:8]
+    return f"{Path(psd_path).stem}_{digest}_{width}x{height}"
+
+
+def collect_units(source, sizes):
+    """从目录或清单文件收集 (psd路径, 宽, 高) 列表，按清单顺序去重"""
+    source = Path(source)
+    units = []
+
+    if source.is_dir():
+        if not sizes:
+            raise ValueError("输入为目录时必须通过 --sizes 指定目标尺寸")
+        for psd_path in sorted(source.glob("*.psd")):
+            units.extend((str(psd_path), width, height) for width, height in sizes)
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("{"):
+                    entry = json.loads(line)
+                    psd_path = entry["psd"]
+                    if "width" in entry and "height" in entry:
+                        entry_sizes = [(int(entry["width"]), int(entry["height"]))]
+                    elif "sizes" in entry:
+                        entry_sizes = [parse_size(size) for size in entry["sizes"]]
+                    else:
+                        entry_sizes = sizes
+                else:
+                    psd_path, entry_sizes = line, sizes
+                if not entry_sizes:
+                    raise ValueError(f"清单第{line_no}行没有目标尺寸，且未指定 --sizes")
+                psd_path = Path(psd_path)
+                if not psd_path.is_absolute():
+                    psd_path = source.parent / psd_path
+                units.extend((str(psd_path), width, height) for width, height in entry_sizes)
+
+    seen = set()
+    unique = []
+    for unit in units:
+        key = unit_id(*unit)
+        if key not in seen:
+            seen.add(key)
+            unique.append(unit)
+    return unique
+
+
+def load_completed(manifest_path):
+    """读取清单中已成功完成且输出文件仍存在的单元"""
+    completed = {}
+    if not manifest_path.exists():
+        return completed
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能留下写了一半的最后一行
+                continue
+            if record.get("status") == "done" and Path(record["outputs"]["png"]).exists():
+                completed[record["unit"]] = record
+            else:
+                completed.pop(record.get("unit"), None)
+    return completed
+
+
+class BatchRunner:
+    """批量执行器"""
+
+    def __init__(self, output_dir, workers, limiter, api_key=None, output_psd=False):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.output_dir / MANIFEST_NAME
+        self.workers = max(1, workers)
+        self.limiter = limiter
+        self.api_key = api_key
+        self.output_psd = output_psd
+        self._manifest_lock = threading.Lock()
+        self._stdout = _ThreadStdout(sys.stdout)
+
+    def _append_manifest(self, record):
+        with self._manifest_lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _run_unit(self, psd_path, width, height):
+        """执行单个单元，输出写入 <输出目录>/<单元ID>/"""
+        uid = unit_id(psd_path, width, height)
+        unit_dir = self.output_dir / uid
+        unit_dir.mkdir(parents=True, exist_ok=True)
+        record = {"unit": uid, "psd": psd_path, "width": width, "height": height}
+        start = time.perf_counter()
+
+        with open(unit_dir / "run.log", "w", encoding="utf-8") as log_file:
+            self._stdout.redirect(log_file)
+            try:
+                pipeline = PSDAutoResizePipeline(
+                    psd_path, width, height,
+                    api_key=self.api_key, output_dir=unit_dir, limiter=self.limiter,
+                    output_psd=self.output_psd
+                )
+                timings = pipeline.execute()
+                outputs = {
+                    "png": str(pipeline.output_png),
+                    "new_positions": str(pipeline.new_position_json),
+                }
+                if self.output_psd:
+                    outputs["psd"] = str(pipeline.output_psd)
+                record.update({"status": "done", "timings": timings, "outputs": outputs})
+            except Exception as e:
+                traceback.print_exc(file=log_file)
+                record.update({"status": "failed", "error": f"{type(e).__name__}: {e}", "timings": {}})
+            finally:
+                self._stdout.redirect(None)
+
+        record["seconds"] = time.perf_counter() - start
+        record["finished_at"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        self._append_manifest(record)
+        return record
+
+    def run(self, units):
+        """执行所有未完成的单元并写出汇总"""
+        completed = load_completed(self.manifest_path)
+        pending = [unit for unit in units if unit_id(*unit) not in completed]
+        skipped = len(units) - len(pending)
+        print(f"共 {len(units)} 个单元，已完成 {skipped} 个，本次执行 {len(pending)} 个（{self.workers} 个工作线程）")
+
+        records = []
+        interrupted = False
+        start = time.perf_counter()
+        real_stdout, sys.stdout = sys.stdout, self._stdout
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="psd-batch")
+        try:
+            futures = [executor.submit(self._run_unit, *unit) for unit in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                status = "完成" if record["status"] == "done" else f"失败: {record['error']}"
+                print(f"[{len(records)}/{len(pending)}] {record['unit']} {status} ({record['seconds']:.1f}秒)")
+        except KeyboardInterrupt:
+            # 未开始的单元直接取消，进行中的单元下次运行时重新执行
+            interrupted = True
+            print("\n已中断，等待进行中的单元结束...")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            sys.stdout = real_stdout
+
+        summary = self._summarize(records, len(units), skipped, time.perf_counter() - start, interrupted)
+        with open(self.output_dir / SUMMARY_NAME, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        print(f"\n成功 {summary['done']} 个，失败 {summary['failed']} 个，跳过 {skipped} 个，"
+              f"耗时 {summary['wall_seconds']:.1f}秒，吞吐 {summary['units_per_minute']:.2f} 个/分钟")
+        print(f"汇总已保存到: {self.output_dir / SUMMARY_NAME}")
+        return summary
+
+    @staticmethod
+    def _summarize(records, total, skipped, wall_seconds, interrupted):
+        done = [record for record in records if record["status"] == "done"]
+        stage_stats = {}
+        for stage in STAGES:
+            values = sorted(record["timings"][stage] for record in done if stage in record["timings"])
+            if not values:
+                continue
+            stage_stats[stage] = {
+                "total": sum(values),
+                "mean": statistics.mean(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+        return {
+            "total_units": total,
+            "skipped": skipped,
+            "done": len(done),
+            "failed": len(records) - len(done),
+            "interrupted": interrupted,
+            "wall_seconds": wall_seconds,
+            "units_per_minute": len(done) / wall_seconds * 60 if wall_seconds > 0 else 0.0,
+            "stages": stage_stats,
+            "failures": [
+                {"unit": record["unit"], "psd": record["psd"], "error": record["error"]}
+                for record in records if record["status"] != "done"
+            ],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PSD批量自动缩放")
+    parser.add_argument("source", help="PSD目录或清单文件（jsonl/每行一个路径）")
+    parser.add_argument("-o", "--output-dir", required=True, help="输出目录（同时保存断点续跑清单）")
+    parser.add_argument("--sizes", default="", help="目标尺寸，逗号分隔，例如 1080x1920,1200x628")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="并行处理的单元数")
+    parser.add_argument("--rpm", type=int, default=int(os.environ.get("GEMINI_RPM", 15)),
+                        help="Gemini每分钟请求数上限")
+    parser.add_argument("--gemini-concurrency", type=int,
+                        default=int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4)),
+                        help="同时进行中的Gemini请求数上限")
+    parser.add_argument("--api-key", default=None, help="Gemini API密钥（默认读取GEMINI_API_KEY环境变量）")
+    parser.add_argument("--psd", action="store_true", help="同时输出分层PSD（默认只输出PNG）")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    try:
+        units = collect_units(args.source, sizes)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    if not units:
+        print("没有找到需要处理的PSD")
+        sys.exit(1)
+
+    if not (args.api_key or os.environ.get("GEMINI_API_KEY")):
+        print("错误: 需要提供Gemini API密钥，通过 --api-key 或GEMINI_API_KEY环境变量")
+        sys.exit(1)
+
+    limiter = SharedRateLimiter(args.rpm, args.gemini_concurrency)
+    runner = BatchRunner(args.output_dir, args.workers, limiter, api_key=args.api_key, output_psd=args.psd)
+    summary = runner.run(units)
+    if summary["interrupted"]:
+        sys.exit(130)
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,13 @@
 from psd_tools import PSDImage
+from psd_tools.api.layers import PixelLayer
 from PIL import Image
 import json
 import sys
 
-def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path):
+def _load_new_positions(new_pos_json_path):
     """
-    根据新的位置信息对每个图层进行resize和repositioning
-
-    参数:
-        psd_file_path: 原始PSD文件路径
-        new_pos_json_path: 新位置JSON文件路径
-        output_path: 输出文件路径
+    读取新位置信息，返回 (ID到新位置的映射, 新位置列表, 推断的目标宽度, 推断的目标高度)
     """
-    # 读取PSD文件
-    psd = PSDImage.open(psd_file_path)
-
-    # 读取新位置信息
     with open(new_pos_json_path, 'r', encoding='utf-8') as f:
         new_positions = json.load(f)
 
@@ -52,15 +44,17 @@ def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path)
             target_width = max(target_width, new_coord['right'])
             target_height = max(target_height, new_coord['bottom'])
 
-    print(f"原始画布尺寸: {psd.width} x {psd.height}")
-    print(f"目标画布尺寸: {target_width} x {target_height}")
-    print(f"共有 {len(new_positions)} 个图层需要调整\n")
+    return pos_map, new_positions, target_width, target_height
 
-    # 创建新画布，使用动态获取的目标尺寸
-    new_canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
 
-    # 收集所有图层
+def _iter_resized_layers(psd, pos_map):
+    """
+    按合成顺序（自底向上）渲染并缩放每个图层
 
+    生成:
+        (图层ID, 图层, 缩放后的图像, left, top)
+    """
+    # 收集所有图层
     all_layers = []
     layer_id = 0
 
@@ -79,8 +73,6 @@ def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path)
 
     print(f"收集到 {len(all_layers)} 个图层\n")
 
-    # 处理每个图层
-    processed_count = 0
     for layer_id, layer in all_layers:
         if layer_id not in pos_map:
             continue
@@ -147,18 +139,58 @@ def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path)
             else:
                 print(f"ID {layer_id}: {layer.name} - 尺寸未变化，位置: ({new_left}, {new_top})")
 
-            # 粘贴到新画布上（使用alpha通道进行合成）
-            if layer_image.mode == 'RGBA':
-                new_canvas.alpha_composite(layer_image, (new_left, new_top))
-            else:
-                new_canvas.paste(layer_image, (new_left, new_top), layer_image)
-            processed_count += 1
+            yield layer_id, layer, layer_image, new_left, new_top
 
         except Exception as e:
             print(f"ID {layer_id}: {layer.name} - 处理失败: {e}")
 
+
+def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path,
+                                  target_width=None, target_height=None, output_psd_path=None):
+    """
+    根据新的位置信息对每个图层进行resize和repositioning
+
+    参数:
+        psd_file_path: 原始PSD文件路径
+        new_pos_json_path: 新位置JSON文件路径
+        output_path: 输出文件路径
+        target_width: 目标宽度（不提供时从背景图层或最大坐标推断）
+        target_height: 目标高度（同上）
+        output_psd_path: 同时输出分层PSD的路径（可选），直接复用为PNG渲染的图层
+    """
+    # 读取PSD文件
+    psd = PSDImage.open(psd_file_path)
+
+    # 读取新位置信息
+    pos_map, new_positions, inferred_width, inferred_height = _load_new_positions(new_pos_json_path)
+    target_width = target_width or inferred_width
+    target_height = target_height or inferred_height
+
+    print(f"原始画布尺寸: {psd.width} x {psd.height}")
+    print(f"目标画布尺寸: {target_width} x {target_height}")
+    print(f"共有 {len(new_positions)} 个图层需要调整\n")
+
+    # 创建新画布，使用动态获取的目标尺寸
+    new_canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
+    new_psd = PSDImage.new('RGBA', (target_width, target_height)) if output_psd_path else None
+
+    # 处理每个图层
+    processed_count = 0
+    for layer_id, layer, layer_image, new_left, new_top in _iter_resized_layers(psd, pos_map):
+        # 粘贴到新画布上（使用alpha通道进行合成）
+        if layer_image.mode == 'RGBA':
+            new_canvas.alpha_composite(layer_image, (new_left, new_top))
+        else:
+            new_canvas.paste(layer_image, (new_left, new_top), layer_image)
+        if new_psd is not None:
+            _append_psd_layer(new_psd, layer_id, layer, layer_image, new_left, new_top)
+        processed_count += 1
+
     print(f"\n成功处理 {processed_count} 个图层")
 
+    if new_psd is not None:
+        _write_psd(new_psd, output_psd_path, processed_count)
+
     # 保存为高质量PNG
     output_png = output_path.rsplit('.', 1)[0] + '.png'
     new_canvas.save(output_png, 'PNG', optimize=False, compress_level=0, dpi=(300, 300))
@@ -168,6 +200,45 @@ def resize_psd_with_new_positions(psd_file_path, new_pos_json_path, output_path)
 
     return new_canvas
 
+
+def save_resized_psd(psd_file_path, new_pos_json_path, output_psd_path,
+                     target_width=None, target_height=None):
+    """
+    根据新的位置信息只输出分层PSD，每个缩放后的图层保存为一个像素图层（图层组被展平）
+
+    参数与resize_psd_with_new_positions相同，output_psd_path为输出PSD路径。
+    同时需要PNG时应使用 resize_psd_with_new_positions 的 output_psd_path，避免重复渲染图层。
+    """
+    psd = PSDImage.open(psd_file_path)
+    pos_map, _, inferred_width, inferred_height = _load_new_positions(new_pos_json_path)
+    target_width = target_width or inferred_width
+    target_height = target_height or inferred_height
+
+    new_psd = PSDImage.new('RGBA', (target_width, target_height))
+    count = 0
+    for layer_id, layer, layer_image, new_left, new_top in _iter_resized_layers(psd, pos_map):
+        _append_psd_layer(new_psd, layer_id, layer, layer_image, new_left, new_top)
+        count += 1
+
+    _write_psd(new_psd, output_psd_path, count)
+    return new_psd
+
+
+def _append_psd_layer(new_psd, layer_id, layer, layer_image, new_left, new_top):
+    if layer_image.mode != 'RGBA':
+        layer_image = layer_image.convert('RGBA')
+    new_psd.append(PixelLayer.frompil(
+        layer_image, new_psd, layer.name or f"Layer {layer_id}", top=new_top, left=new_left
+    ))
+
+
+def _write_psd(new_psd, output_psd_path, count):
+    # psd-tools 只能在内存中构建完整的PSD后一次性写出
+    with open(output_psd_path, 'wb') as f:
+        new_psd.save(f)
+
+    print(f"\n分层PSD已保存到: {output_psd_path}（{count} 个图层）")
+
 # if __name__ == "__main__":
 #     if len(sys.argv) < 3:
 #         print("使用方法: python resize_psd.py <原始PSD文件> <新位置JSON文件> [输出文件名]")
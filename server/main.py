@@ -25,6 +25,11 @@ print('Importing config_service')
 from services.config_service import config_service
 print('Importing tool_service')
 from services.tool_service import tool_service
+from services.psd_resize_store import psd_resize_store
+from services.library_db_service import template_db, font_db
+from services.usage_counter_service import template_usage, font_usage
+from services.template_thumbnail_service import template_thumbnail_service
+from services.font_subset_service import font_subset_service
 
 async def initialize():
     print('Initializing config_service')
@@ -40,8 +45,18 @@ async def lifespan(app: FastAPI):
     # TODO: Check if there will be racing conditions when user send chat request but tools and models are not initialized yet.
     await initialize()
     await tool_service.initialize()
+    psd_resize_store.start_sweeper()
+    template_usage.start()
+    font_usage.start()
     yield
     # onshutdown
+    await psd_resize_store.stop_sweeper()
+    await template_usage.stop()
+    await font_usage.stop()
+    await template_db.dispose()
+    await font_db.dispose()
+    template_thumbnail_service.shutdown()
+    font_subset_service.shutdown()
 
 print('Creating FastAPI app')
 app = FastAPI(lifespan=lifespan)
@@ -53,6 +68,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -0,0 +1,51 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, JSON, ForeignKey, Index
+from sqlalchemy.orm import declarative_base, relationship
+from datetime import datetime
+import uuid
+
+# fonts.db 的表定义
+FontBase = declarative_base()
+
+class FontCategory(FontBase):
+    __tablename__ = "font_categories"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    icon = Column(String, nullable=True)
+    color = Column(String, nullable=True, default="#3b82f6")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class FontItem(FontBase):
+    __tablename__ = "font_items"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    font_family = Column(String, nullable=False)
+    font_file_name = Column(String, nullable=False)
+    font_file_path = Column(String, nullable=False)
+    font_file_url = Column(String, nullable=False)
+    font_format = Column(String, nullable=False)  # ttf, otf, woff, woff2
+    file_size = Column(Integer, nullable=False)
+    description = Column(Text, nullable=True)
+    category_id = Column(String, ForeignKey("font_categories.id"), nullable=True)
+    tags = Column(JSON, nullable=True, default=list)
+    usage_count = Column(Integer, default=0)
+    is_favorite = Column(Boolean, default=False)
+    is_public = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_by = Column(String, nullable=True)
+
+    # 字体元数据
+    font_metadata = Column(JSON, nullable=True)  # 存储字体信息如字重、样式等
+
+    # 关系（异步会话不支持懒加载，需要时用 selectinload）
+    category = relationship("FontCategory", backref="fonts")
+
+    # 统计接口的最常用 / 最近创建 Top-N
+    __table_args__ = (
+        Index("idx_font_items_usage", "usage_count"),
+        Index("idx_font_items_created", "created_at"),
+    )
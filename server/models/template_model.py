@@ -0,0 +1,65 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, JSON, ForeignKey, Index
+from sqlalchemy.orm import declarative_base, relationship
+from datetime import datetime
+import uuid
+
+# templates.db 的表定义，template_router 和 psd_router 共用
+TemplateBase = declarative_base()
+
+class TemplateCategory(TemplateBase):
+    __tablename__ = "template_categories"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    icon = Column(String, nullable=True)
+    color = Column(String, nullable=True, default="#3b82f6")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class TemplateItem(TemplateBase):
+    __tablename__ = "template_items"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    category_id = Column(String, ForeignKey("template_categories.id"), nullable=False)
+    type = Column(String, nullable=False)  # psd_layer, psd_file, image, text_style, layer_group, canvas_element
+    thumbnail_url = Column(String, nullable=True)
+    preview_url = Column(String, nullable=True)
+    template_metadata = Column(JSON, nullable=True)
+    tags = Column(JSON, nullable=True, default=list)
+    usage_count = Column(Integer, default=0)
+    is_favorite = Column(Boolean, default=False)
+    is_public = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_by = Column(String, nullable=True)
+
+    # 关系（异步会话不支持懒加载，需要时用 selectinload）
+    category = relationship("TemplateCategory", backref="templates")
+
+    # 列表按 (updated_at, id) 倒序分页，常用筛选列各带一个复合索引
+    __table_args__ = (
+        Index("idx_template_items_updated", "updated_at", "id"),
+        Index("idx_template_items_category_updated", "category_id", "updated_at", "id"),
+        Index("idx_template_items_type_updated", "type", "updated_at", "id"),
+        Index("idx_template_items_favorite_updated", "is_favorite", "updated_at", "id"),
+        Index("idx_template_items_created_by_updated", "created_by", "updated_at", "id"),
+        # 统计接口的最常用 / 最近创建 Top-N
+        Index("idx_template_items_usage", "usage_count"),
+        Index("idx_template_items_created", "created_at"),
+    )
+
+class TemplateCollection(TemplateBase):
+    __tablename__ = "template_collections"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    template_ids = Column(JSON, nullable=True, default=list)
+    thumbnail_url = Column(String, nullable=True)
+    is_public = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_by = Column(String, nullable=True)
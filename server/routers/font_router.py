@@ -1,62 +1,23 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, FileResponse
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, JSON, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict
 from datetime import datetime
 import json
 import os
 import uuid
 import shutil
-from fontTools.ttLib import TTFont
 import mimetypes
 
-# 数据库配置
-DATABASE_URL = "sqlite:///./user_data/fonts.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# 字体数据库模型
-class FontCategory(Base):
-    __tablename__ = "font_categories"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    icon = Column(String, nullable=True)
-    color = Column(String, nullable=True, default="#3b82f6")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-class FontItem(Base):
-    __tablename__ = "font_items"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    font_family = Column(String, nullable=False)
-    font_file_name = Column(String, nullable=False)
-    font_file_path = Column(String, nullable=False)
-    font_file_url = Column(String, nullable=False)
-    font_format = Column(String, nullable=False)  # ttf, otf, woff, woff2
-    file_size = Column(Integer, nullable=False)
-    description = Column(Text, nullable=True)
-    category_id = Column(String, ForeignKey("font_categories.id"), nullable=True)
-    tags = Column(JSON, nullable=True, default=list)
-    usage_count = Column(Integer, default=0)
-    is_favorite = Column(Boolean, default=False)
-    is_public = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_by = Column(String, nullable=True)
-    
-    # 字体元数据
-    font_metadata = Column(JSON, nullable=True)  # 存储字体信息如字重、样式等
-    
-    # 关系
-    category = relationship("FontCategory", backref="fonts")
+from models.font_model import FontCategory, FontItem
+from services.library_db_service import font_db
+from services.usage_counter_service import font_usage
+from services.font_metadata_service import get_font_metadata, font_importer
+from services.font_subset_service import font_subset_service, parse_codepoints, text_codepoints, InvalidCodepoints
+from services.psd_canvas_payload_service import psd_canvas_payloads
 
 # Pydantic模型
 class FontCategoryCreate(BaseModel):
@@ -85,16 +46,10 @@ class FontItemUpdate(BaseModel):
     tags: Optional[List[str]] = None
     is_public: Optional[bool] = None
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
-
 # 依赖注入
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with font_db.session() as db:
         yield db
-    finally:
-        db.close()
 
 # 字体文件上传目录
 FONT_UPLOAD_DIR = "user_data/font_uploads"
@@ -103,71 +58,6 @@ os.makedirs(FONT_UPLOAD_DIR, exist_ok=True)
 # 支持的字体格式
 SUPPORTED_FONT_FORMATS = {'.ttf', '.otf', '.woff', '.woff2'}
 
-def get_font_metadata(font_path: str) -> Dict[str, Any]:
-    """提取字体元数据"""
-    try:
-        font = TTFont(font_path)
-        name_table = font['name']
-        
-        metadata = {
-            'font_family': '',
-            'font_weight': 'normal',
-            'font_style': 'normal',
-            'font_stretch': 'normal',
-            'unicode_ranges': [],
-            'glyph_count': len(font.getGlyphSet()),
-            'version': '',
-            'copyright': '',
-            'vendor': ''
-        }
-        
-        # 提取字体名称信息
-        for record in name_table.names:
-            if record.nameID == 1:  # Font Family
-                metadata['font_family'] = record.toUnicode()
-            elif record.nameID == 2:  # Font Subfamily
-                metadata['font_style'] = record.toUnicode()
-            elif record.nameID == 5:  # Version
-                metadata['version'] = record.toUnicode()
-            elif record.nameID == 0:  # Copyright
-                metadata['copyright'] = record.toUnicode()
-            elif record.nameID == 8:  # Manufacturer
-                metadata['vendor'] = record.toUnicode()
-        
-        # 提取字重信息
-        if 'OS/2' in font:
-            os2_table = font['OS/2']
-            weight_class = os2_table.usWeightClass
-            weight_map = {
-                100: 'Thin',
-                200: 'Extra Light',
-                300: 'Light',
-                400: 'Normal',
-                500: 'Medium',
-                600: 'Semi Bold',
-                700: 'Bold',
-                800: 'Extra Bold',
-                900: 'Black'
-            }
-            metadata['font_weight'] = weight_map.get(weight_class, 'Normal')
-        
-        font.close()
-        return metadata
-        
-    except Exception as e:
-        print(f"Error extracting font metadata: {e}")
-        return {
-            'font_family': 'Unknown',
-            'font_weight': 'normal',
-            'font_style': 'normal',
-            'font_stretch': 'normal',
-            'unicode_ranges': [],
-            'glyph_count': 0,
-            'version': '',
-            'copyright': '',
-            'vendor': ''
-        }
-
 def save_font_file(file: UploadFile) -> Dict[str, str]:
     """保存字体文件并返回文件信息"""
     # 检查文件格式
@@ -212,9 +102,9 @@ router = APIRouter(prefix="/api/fonts", tags=["fonts"])
 
 # 分类管理
 @router.get("/categories")
-async def get_font_categories(db: Session = Depends(get_db)):
+async def get_font_categories(db: AsyncSession = Depends(get_db)):
     """获取所有字体分类"""
-    categories = db.query(FontCategory).all()
+    categories = (await db.execute(select(FontCategory))).scalars().all()
     return [{
         "id": cat.id,
         "name": cat.name,
@@ -226,12 +116,12 @@ async def get_font_categories(db: Session = Depends(get_db)):
     } for cat in categories]
 
 @router.post("/categories")
-async def create_font_category(category: FontCategoryCreate, db: Session = Depends(get_db)):
+async def create_font_category(category: FontCategoryCreate, db: AsyncSession = Depends(get_db)):
     """创建新字体分类"""
     db_category = FontCategory(**category.dict())
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     
     return {
         "id": db_category.id,
@@ -244,9 +134,9 @@ async def create_font_category(category: FontCategoryCreate, db: Session = Depen
     }
 
 @router.put("/categories/{category_id}")
-async def update_font_category(category_id: str, category: FontCategoryUpdate, db: Session = Depends(get_db)):
+async def update_font_category(category_id: str, category: FontCategoryUpdate, db: AsyncSession = Depends(get_db)):
     """更新字体分类"""
-    db_category = db.query(FontCategory).filter(FontCategory.id == category_id).first()
+    db_category = await db.get(FontCategory, category_id)
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
     
@@ -255,8 +145,8 @@ async def update_font_category(category_id: str, category: FontCategoryUpdate, d
         setattr(db_category, field, value)
     
     db_category.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     
     return {
         "id": db_category.id,
@@ -269,19 +159,21 @@ async def update_font_category(category_id: str, category: FontCategoryUpdate, d
     }
 
 @router.delete("/categories/{category_id}")
-async def delete_font_category(category_id: str, db: Session = Depends(get_db)):
+async def delete_font_category(category_id: str, db: AsyncSession = Depends(get_db)):
     """删除字体分类"""
-    db_category = db.query(FontCategory).filter(FontCategory.id == category_id).first()
+    db_category = await db.get(FontCategory, category_id)
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
     
     # 检查是否有字体使用此分类
-    fonts_count = db.query(FontItem).filter(FontItem.category_id == category_id).count()
+    fonts_count = await db.scalar(
+        select(func.count()).select_from(FontItem).where(FontItem.category_id == category_id)
+    )
     if fonts_count > 0:
         raise HTTPException(status_code=400, detail=f"Cannot delete category with {fonts_count} fonts")
     
-    db.delete(db_category)
-    db.commit()
+    await db.delete(db_category)
+    await db.commit()
     return {"message": "Category deleted successfully"}
 
 # 字体管理
@@ -292,21 +184,21 @@ async def get_fonts(
     is_favorite: Optional[bool] = Query(None),
     is_public: Optional[bool] = Query(None),
     created_by: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """获取字体列表"""
-    query = db.query(FontItem)
+    query = select(FontItem)
     
     if category_id:
-        query = query.filter(FontItem.category_id == category_id)
+        query = query.where(FontItem.category_id == category_id)
     if is_favorite is not None:
-        query = query.filter(FontItem.is_favorite == is_favorite)
+        query = query.where(FontItem.is_favorite == is_favorite)
     if is_public is not None:
-        query = query.filter(FontItem.is_public == is_public)
+        query = query.where(FontItem.is_public == is_public)
     if created_by:
-        query = query.filter(FontItem.created_by == created_by)
+        query = query.where(FontItem.created_by == created_by)
     
-    fonts = query.all()
+    fonts = (await db.execute(query)).scalars().all()
     return [{
         "id": font.id,
         "name": font.name,
@@ -318,7 +210,7 @@ async def get_fonts(
         "description": font.description,
         "category_id": font.category_id,
         "tags": font.tags or [],
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
         "is_favorite": font.is_favorite,
         "is_public": font.is_public,
         "font_metadata": font.font_metadata or {},
@@ -328,9 +220,9 @@ async def get_fonts(
     } for font in fonts]
 
 @router.get("/items/{font_id}")
-async def get_font(font_id: str, db: Session = Depends(get_db)):
+async def get_font(font_id: str, db: AsyncSession = Depends(get_db)):
     """获取单个字体"""
-    font = db.query(FontItem).filter(FontItem.id == font_id).first()
+    font = await db.get(FontItem, font_id)
     if not font:
         raise HTTPException(status_code=404, detail="Font not found")
     
@@ -345,7 +237,7 @@ async def get_font(font_id: str, db: Session = Depends(get_db)):
         "description": font.description,
         "category_id": font.category_id,
         "tags": font.tags or [],
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
         "is_favorite": font.is_favorite,
         "is_public": font.is_public,
         "font_metadata": font.font_metadata or {},
@@ -362,7 +254,7 @@ async def upload_font(
     category_id: str = Form(""),
     tags: str = Form("[]"),
     is_public: str = Form("false"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """上传字体文件"""
     try:
@@ -372,7 +264,7 @@ async def upload_font(
         raise HTTPException(status_code=400, detail="Invalid JSON format")
     
     # 保存字体文件
-    file_info = save_font_file(font_file)
+    file_info = await run_in_threadpool(save_font_file, font_file)
     
     # 创建字体记录
     font = FontItem(
@@ -391,8 +283,8 @@ async def upload_font(
     )
     
     db.add(font)
-    db.commit()
-    db.refresh(font)
+    await db.commit()
+    await db.refresh(font)
     
     return {
         "id": font.id,
@@ -405,7 +297,7 @@ async def upload_font(
         "description": font.description,
         "category_id": font.category_id,
         "tags": font.tags,
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
         "is_favorite": font.is_favorite,
         "is_public": font.is_public,
         "font_metadata": font.font_metadata,
@@ -422,10 +314,10 @@ async def update_font(
     category_id: Optional[str] = Form(None),
     tags: Optional[str] = Form(None),
     is_public: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """更新字体信息"""
-    font = db.query(FontItem).filter(FontItem.id == font_id).first()
+    font = await db.get(FontItem, font_id)
     if not font:
         raise HTTPException(status_code=404, detail="Font not found")
     
@@ -445,8 +337,8 @@ async def update_font(
         font.is_public = is_public.lower() == "true"
     
     font.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(font)
+    await db.commit()
+    await db.refresh(font)
     
     return {
         "id": font.id,
@@ -459,7 +351,7 @@ async def update_font(
         "description": font.description,
         "category_id": font.category_id,
         "tags": font.tags,
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
         "is_favorite": font.is_favorite,
         "is_public": font.is_public,
         "font_metadata": font.font_metadata,
@@ -469,9 +361,9 @@ async def update_font(
     }
 
 @router.delete("/items/{font_id}")
-async def delete_font(font_id: str, db: Session = Depends(get_db)):
+async def delete_font(font_id: str, db: AsyncSession = Depends(get_db)):
     """删除字体"""
-    font = db.query(FontItem).filter(FontItem.id == font_id).first()
+    font = await db.get(FontItem, font_id)
     if not font:
         raise HTTPException(status_code=404, detail="Font not found")
     
@@ -479,21 +371,21 @@ async def delete_font(font_id: str, db: Session = Depends(get_db)):
     if os.path.exists(font.font_file_path):
         os.remove(font.font_file_path)
     
-    db.delete(font)
-    db.commit()
+    await db.delete(font)
+    await db.commit()
     return {"message": "Font deleted successfully"}
 
 @router.post("/items/{font_id}/favorite")
-async def toggle_font_favorite(font_id: str, db: Session = Depends(get_db)):
+async def toggle_font_favorite(font_id: str, db: AsyncSession = Depends(get_db)):
     """切换字体收藏状态"""
-    font = db.query(FontItem).filter(FontItem.id == font_id).first()
+    font = await db.get(FontItem, font_id)
     if not font:
         raise HTTPException(status_code=404, detail="Font not found")
     
     font.is_favorite = not font.is_favorite
     font.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(font)
+    await db.commit()
+    await db.refresh(font)
     
     return {
         "id": font.id,
@@ -501,15 +393,14 @@ async def toggle_font_favorite(font_id: str, db: Session = Depends(get_db)):
     }
 
 @router.post("/items/{font_id}/usage")
-async def increment_font_usage(font_id: str, db: Session = Depends(get_db)):
+async def increment_font_usage(font_id: str, db: AsyncSession = Depends(get_db)):
     """增加字体使用次数"""
-    font = db.query(FontItem).filter(FontItem.id == font_id).first()
-    if not font:
+    exists = await db.scalar(select(FontItem.id).where(FontItem.id == font_id))
+    if not exists:
         raise HTTPException(status_code=404, detail="Font not found")
     
-    font.usage_count += 1
-    font.updated_at = datetime.utcnow()
-    db.commit()
+    # 计入缓冲，由后台批量写回
+    font_usage.add(font_id)
     
     return {"message": "Usage count incremented"}
 
@@ -520,14 +411,14 @@ async def search_fonts(
     tags: Optional[List[str]] = Query(None),
     is_favorite: Optional[bool] = Query(None),
     is_public: Optional[bool] = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """搜索字体"""
-    query = db.query(FontItem)
+    query = select(FontItem)
     
     # 文本搜索
     if q:
-        query = query.filter(
+        query = query.where(
             FontItem.name.contains(q) |
             FontItem.font_family.contains(q) |
             FontItem.description.contains(q)
@@ -535,13 +426,13 @@ async def search_fonts(
     
     # 其他筛选条件
     if category_id:
-        query = query.filter(FontItem.category_id == category_id)
+        query = query.where(FontItem.category_id == category_id)
     if is_favorite is not None:
-        query = query.filter(FontItem.is_favorite == is_favorite)
+        query = query.where(FontItem.is_favorite == is_favorite)
     if is_public is not None:
-        query = query.filter(FontItem.is_public == is_public)
+        query = query.where(FontItem.is_public == is_public)
     
-    fonts = query.all()
+    fonts = (await db.execute(query)).scalars().all()
     return [{
         "id": font.id,
         "name": font.name,
@@ -553,7 +444,7 @@ async def search_fonts(
         "description": font.description,
         "category_id": font.category_id,
         "tags": font.tags or [],
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
         "is_favorite": font.is_favorite,
         "is_public": font.is_public,
         "font_metadata": font.font_metadata or {},
@@ -563,22 +454,28 @@ async def search_fonts(
     } for font in fonts]
 
 @router.get("/stats")
-async def get_font_stats(db: Session = Depends(get_db)):
+async def get_font_stats(db: AsyncSession = Depends(get_db)):
     """获取字体统计信息"""
-    total_fonts = db.query(FontItem).count()
-    total_categories = db.query(FontCategory).count()
+    # 先写回缓冲中的使用次数，热门排行反映最新值
+    await font_usage.flush()
+    # 总数由触发器维护，Top-N 走 usage_count / created_at 索引
+    counters = await font_db.read_counters(db)
     
     # 最常用的字体
-    most_used = db.query(FontItem).order_by(FontItem.usage_count.desc()).limit(5).all()
+    most_used = (await db.execute(
+        select(FontItem).order_by(FontItem.usage_count.desc()).limit(5)
+    )).scalars().all()
     most_used_fonts = [{
         "id": font.id,
         "name": font.name,
         "font_family": font.font_family,
-        "usage_count": font.usage_count,
+        "usage_count": font_usage.count(font.id, font.usage_count),
     } for font in most_used]
     
     # 最近的字体
-    recent = db.query(FontItem).order_by(FontItem.created_at.desc()).limit(5).all()
+    recent = (await db.execute(
+        select(FontItem).order_by(FontItem.created_at.desc()).limit(5)
+    )).scalars().all()
     recent_fonts = [{
         "id": font.id,
         "name": font.name,
@@ -587,8 +484,8 @@ async def get_font_stats(db: Session = Depends(get_db)):
     } for font in recent]
     
     return {
-        "total_fonts": total_fonts,
-        "total_categories": total_categories,
+        "total_fonts": counters["total_fonts"],
+        "total_categories": counters["total_categories"],
         "most_used_fonts": most_used_fonts,
         "recent_fonts": recent_fonts,
     }
@@ -623,61 +520,110 @@ async def get_font_file(filename: str):
         }
     )
 
+# 字体子集
+@router.get("/items/{font_id}/subset")
+async def get_font_subset(
+    font_id: str,
+    text: Optional[str] = Query(None, description="需要包含的文字"),
+    codepoints: Optional[str] = Query(None, description="逗号分隔的码点，如 U+4E00,U+4E8C-4E8F"),
+    psd_file_id: Optional[str] = Query(None, description="使用该PSD文件文字图层中的文字"),
+    db: AsyncSession = Depends(get_db)
+):
+    """获取只包含指定字符的 WOFF2 字体子集，字符来源可组合"""
+    font = await db.get(FontItem, font_id)
+    if not font:
+        raise HTTPException(status_code=404, detail="Font not found")
+    
+    try:
+        requested = parse_codepoints(codepoints) if codepoints else set()
+    except InvalidCodepoints as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    requested |= text_codepoints([text])
+    
+    if psd_file_id:
+        payload = psd_canvas_payloads.cached(psd_file_id)
+        if payload is None:
+            payload = await run_in_threadpool(psd_canvas_payloads.get, psd_file_id)
+        if payload is None:
+            raise HTTPException(status_code=404, detail="PSD metadata not found")
+        # 文字内容未解析出时，图层名即为文字
+        requested |= text_codepoints(
+            layer.get('text_content') or layer.get('name')
+            for layer in payload['layers'] if layer.get('type') == 'text'
+        )
+    
+    if not os.path.exists(font.font_file_path):
+        raise HTTPException(status_code=404, detail="Font file not found")
+    
+    try:
+        subset_path = await font_subset_service.subset(font.font_file_path, requested)
+    except InvalidCodepoints as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error subsetting font: {str(e)}")
+    
+    return FileResponse(
+        subset_path,
+        media_type="font/woff2",
+        headers={
+            "Cache-Control": "public, max-age=31536000",  # 内容由字体和字符决定
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET",
+            "Access-Control-Allow-Headers": "*",
+        }
+    )
+
 # 批量导入现有字体
 @router.post("/import-existing")
-async def import_existing_fonts(db: Session = Depends(get_db)):
+async def import_existing_fonts(db: AsyncSession = Depends(get_db)):
     """导入fonts文件夹中的现有字体"""
     fonts_dir = "fonts"
     if not os.path.exists(fonts_dir):
         raise HTTPException(status_code=404, detail="Fonts directory not found")
     
+    # 一次查询已导入的文件名，代替逐个文件查询
+    existing_names = set((await db.execute(select(FontItem.font_file_name))).scalars().all())
+    filenames = [
+        filename for filename in sorted(os.listdir(fonts_dir))
+        if os.path.splitext(filename)[1].lower() in SUPPORTED_FONT_FORMATS and filename not in existing_names
+    ]
+    
+    font_dir = os.path.join(FONT_UPLOAD_DIR, "fonts")
+    os.makedirs(font_dir, exist_ok=True)
+    paths = [
+        (os.path.join(fonts_dir, filename), os.path.join(font_dir, f"{uuid.uuid4()}{os.path.splitext(filename)[1].lower()}"))
+        for filename in filenames
+    ]
+    
+    # 硬链接 + 元数据提取在进程池中并行执行
+    results = await run_in_threadpool(font_importer.import_files, paths)
+    
     imported_count = 0
     errors = []
-    
-    for filename in os.listdir(fonts_dir):
-        if any(filename.lower().endswith(ext) for ext in SUPPORTED_FONT_FORMATS):
-            try:
-                # 检查是否已经存在
-                existing_font = db.query(FontItem).filter(FontItem.font_file_name == filename).first()
-                if existing_font:
-                    continue
-                
-                file_path = os.path.join(fonts_dir, filename)
-                
-                # 创建模拟的UploadFile对象
-                class MockUploadFile:
-                    def __init__(self, file_path, filename):
-                        self.filename = filename
-                        self.file = open(file_path, 'rb')
-                
-                mock_file = MockUploadFile(file_path, filename)
-                
-                # 保存字体文件
-                file_info = save_font_file(mock_file)
-                mock_file.file.close()
-                
-                # 创建字体记录
-                font = FontItem(
-                    name=os.path.splitext(filename)[0],
-                    font_family=file_info['font_metadata']['font_family'],
-                    font_file_name=filename,
-                    font_file_path=file_info['file_path'],
-                    font_file_url=file_info['file_url'],
-                    font_format=file_info['font_format'],
-                    file_size=file_info['file_size'],
-                    description=f"从现有文件导入: {filename}",
-                    tags=["imported"],
-                    is_public=False,
-                    font_metadata=file_info['font_metadata'],
-                )
-                
-                db.add(font)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"导入 {filename} 失败: {str(e)}")
-    
-    db.commit()
+    fonts = []
+    for filename, (_, target_path), file_info in zip(filenames, paths, results):
+        if 'error' in file_info:
+            errors.append(f"导入 {filename} 失败: {file_info['error']}")
+            continue
+        
+        # 创建字体记录
+        fonts.append(FontItem(
+            name=os.path.splitext(filename)[0],
+            font_family=file_info['font_metadata']['font_family'],
+            font_file_name=filename,
+            font_file_path=target_path,
+            font_file_url=f"/api/fonts/files/{os.path.basename(target_path)}",
+            font_format=os.path.splitext(filename)[1].lower()[1:],
+            file_size=file_info['file_size'],
+            description=f"从现有文件导入: {filename}",
+            tags=["imported"],
+            is_public=False,
+            font_metadata=file_info['font_metadata'],
+        ))
+        imported_count += 1
+    
+    db.add_all(fonts)
+    await db.commit()
     
     return {
         "message": f"成功导入 {imported_count} 个字体",
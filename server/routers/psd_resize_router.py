@@ -4,19 +4,38 @@ PSD自動縮放API路由
 整合Gemini API進行智能圖層縮放
 """
 
+import asyncio
 import os
 import json
 import base64
+import hashlib
+import io
+import shutil
 import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Tuple
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import logging
+from PIL import Image
 
 from services.gemini_psd_resize_service import GeminiPSDResizeService
+from services.layout_providers import layout_engine_id
+from services.gemini_rate_limiter import gemini_rate_limiter
+from services.psd_resize_job_service import psd_resize_job_manager, ProgressReporter
 from utils.psd_layer_info import get_psd_layers_info, draw_detection_boxes
-from utils.resize_psd import resize_psd_with_new_positions
+from utils.resize_psd import resize_psd_with_new_positions, IncrementalLayerRenderer, save_output
+from utils.layout_validation import validate_layout
+from utils.proxy_render import render_proxy_preview
+from utils.incremental_render import LayerBitmapCache, rerender_dirty_regions
+from utils.resampling import RESAMPLING_TIERS, DEFAULT_RESAMPLING_TIER
+from services.psd_proxy_cache_service import psd_proxy_cache
+from services.psd_resize_store import psd_resize_store
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/psd/resize", tags=["PSD Resize"])
@@ -26,177 +45,714 @@ from services.config_service import FILES_DIR
 from common import DEFAULT_PORT
 PSD_DIR = os.path.join(FILES_DIR, "psd")
 
+# 輸出模式: flat（單張PNG）、layers（額外輸出每個圖層的PNG及放置信息）、psd（額外輸出分層PSD）
+OUTPUT_MODES = ("flat", "layers", "psd")
 
-@router.post("/auto-resize")
-async def auto_resize_psd(
-    psd_file: UploadFile = File(...),
-    target_width: int = Form(...),
-    target_height: int = Form(...),
-    api_key: Optional[str] = Form(None)
-):
+# 增量重渲染使用的縮放圖層位圖緩存
+layer_bitmap_cache = LayerBitmapCache()
+
+
+class SingleFlight:
     """
-    使用Gemini API自動縮放PSD文件
-    
+    相同請求的併發去重
+
+    同一個key同時只執行一次，後到的請求等待同一個任務的結果。
+    任務用shield保護，發起者斷開也不會取消其他等待者的任務。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Task] = {}
+
+    async def do(self,
+                 key: Any,
+                 factory: Callable[[], Awaitable[Any]],
+                 cleanup: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Args:
+            key: 去重鍵
+            factory: 實際執行工作的協程工廠（只有第一個請求會調用）
+            cleanup: 本請求的資源清理回調；執行者在任務結束後清理，等待者立即清理
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            if cleanup:
+                task.add_done_callback(lambda _: cleanup())
+        else:
+            logger.info(f"合併重複的縮放請求: {key}")
+            if cleanup:
+                cleanup()
+        return await asyncio.shield(task)
+
+    @property
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+
+resize_flights = SingleFlight()
+
+# PSD內容哈希緩存（LRU）: 路徑 -> ((大小, 修改時間), sha256)，文件變化時替換該路徑的記錄
+PSD_HASH_CACHE_SIZE = int(os.environ.get("PSD_HASH_CACHE_SIZE", 256))
+_psd_hash_cache: "OrderedDict[str, Tuple[Tuple[int, float], str]]" = OrderedDict()
+_psd_hash_lock = threading.Lock()
+
+
+def _hash_psd_file(psd_path: str) -> str:
+    """計算PSD內容的sha256（已上傳文件按大小和修改時間緩存）"""
+    stat = os.stat(psd_path)
+    version = (stat.st_size, stat.st_mtime)
+    with _psd_hash_lock:
+        cached = _psd_hash_cache.get(psd_path)
+        if cached is not None and cached[0] == version:
+            _psd_hash_cache.move_to_end(psd_path)
+            return cached[1]
+
+    sha256 = hashlib.sha256()
+    with open(psd_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    if psd_path.startswith(PSD_DIR):
+        with _psd_hash_lock:
+            _psd_hash_cache[psd_path] = (version, digest)
+            _psd_hash_cache.move_to_end(psd_path)
+            while len(_psd_hash_cache) > PSD_HASH_CACHE_SIZE:
+                _psd_hash_cache.popitem(last=False)
+    return digest
+
+
+async def _run_single_flight(
+    psd_path: str,
+    target_width: int,
+    target_height: int,
+    options: Dict[str, Any],
+    factory: Callable[[], Awaitable[Dict[str, Any]]],
+    cleanup: Optional[Callable[[], None]] = None,
+    api_key: Optional[str] = None,
+    extra_metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    按 (PSD內容哈希, 目標尺寸, 引擎及輸出選項, API密鑰, 附加元數據) 去重執行流水線
+
     Args:
-        psd_file: PSD文件
+        options: 影響結果的選項（render、output_mode、positions等）
+        factory: 執行流水線的協程工廠
+        cleanup: 上傳臨時文件的清理回調
+        api_key: 傳給流水線的API密鑰，不同密鑰的請求不共享執行（計費和配額各自獨立）
+        extra_metadata: 傳給流水線的附加元數據，只有完全相同時才共享結果
+    """
+    try:
+        content_hash = await run_in_threadpool(_hash_psd_file, psd_path)
+    except BaseException:
+        if cleanup:
+            cleanup()
+        raise
+    key = (
+        content_hash,
+        target_width,
+        target_height,
+        layout_engine_id(),
+        json.dumps(options, sort_keys=True, ensure_ascii=False),
+        # 只保留密鑰的摘要，避免明文常駐在去重表中
+        hashlib.sha256(api_key.encode('utf-8')).hexdigest() if api_key else None,
+        json.dumps(extra_metadata or {}, sort_keys=True, ensure_ascii=False),
+    )
+    return await resize_flights.do(key, factory, cleanup)
+
+
+async def _noop_report(stage: str, state: str, **data: Any) -> None:
+    """同步接口不需要推送進度"""
+    return None
+
+
+async def _run_resize_pipeline(
+    psd_path: str,
+    target_width: int,
+    target_height: int,
+    api_key: Optional[str] = None,
+    render: bool = True,
+    extra_metadata: Optional[Dict[str, Any]] = None,
+    report: ProgressReporter = _noop_report,
+    stream: bool = False,
+    new_positions: Optional[List[Dict[str, Any]]] = None,
+    output_mode: str = "flat",
+    resampling: str = DEFAULT_RESAMPLING_TIER,
+) -> Dict[str, Any]:
+    """
+    執行完整的縮放流水線: extract -> layout -> render -> encode
+
+    Args:
+        psd_path: PSD文件路徑
         target_width: 目標寬度
         target_height: 目標高度
-        api_key: Gemini API密鑰（可選，如果不提供則使用環境變量）
-    
+        api_key: Gemini API密鑰（可選）
+        render: False時只生成調整方案（預覽），不渲染輸出
+        extra_metadata: 寫入結果元數據的附加字段
+        report: 階段進度回調
+        stream: 流式解析模型輸出，邊生成邊渲染
+        new_positions: 已確定的調整方案（例如代理預覽調好的布局），提供時跳過Gemini直接渲染
+        output_mode: flat / layers / psd，後兩者在PNG之外輸出分圖層結果
+        resampling: 圖層縮放的重採樣檔位 quality / balanced / draft
+
     Returns:
-        縮放後的圖層信息和輸出文件URL
+        包含尺寸、調整方案及輸出文件信息的字典
     """
+    temp_dir = tempfile.mkdtemp()
     try:
-        # 驗證文件類型
-        if not psd_file.filename.lower().endswith('.psd'):
-            raise HTTPException(status_code=400, detail="只支持PSD文件格式")
-        
-        # 保存上傳的PSD文件
-        temp_dir = tempfile.mkdtemp()
-        psd_path = os.path.join(temp_dir, psd_file.filename)
-        
-        with open(psd_path, "wb") as buffer:
-            content = await psd_file.read()
-            buffer.write(content)
-        
-        logger.info(f"PSD文件已保存到: {psd_path}")
-        
         # 步驟1: 提取圖層信息
+        await report("extract", "started")
         logger.info("步驟1: 提取PSD圖層信息")
-        psd, layers_info = get_psd_layers_info(psd_path)
+        psd, layers_info = await run_in_threadpool(get_psd_layers_info, psd_path)
         original_width = psd.width
         original_height = psd.height
-        
+
         logger.info(f"原始尺寸: {original_width}x{original_height}")
         logger.info(f"目標尺寸: {target_width}x{target_height}")
         logger.info(f"圖層數量: {len(layers_info)}")
-        
-        # 生成檢測框圖像
-        detection_image_path = os.path.join(temp_dir, "detection.png")
-        draw_detection_boxes(psd, layers_info, detection_image_path)
-        
-        # 步驟2: 使用Gemini生成新位置
-        logger.info("步驟2: 調用Gemini API生成新位置")
-        service = GeminiPSDResizeService(api_key=api_key)
-        
-        new_positions = await service.resize_psd_layers(
+
+        if new_positions is not None:
+            await report("extract", "completed", layers_count=len(layers_info),
+                         original_size={"width": original_width, "height": original_height})
+            # 使用客戶端提交的布局，只做本地校驗修復
+            await report("layout", "started")
+            validation = validate_layout(
+                new_positions, layers_info, original_width, original_height,
+                target_width, target_height
+            )
+            new_positions = validation.positions
+            stream = False
+            await report("layout", "completed", adjusted_layers=len(new_positions), source="client")
+        else:
+            # 生成檢測框圖像
+            detection_image_path = os.path.join(temp_dir, "detection.png")
+            await run_in_threadpool(draw_detection_boxes, psd, layers_info, detection_image_path)
+            await report("extract", "completed", layers_count=len(layers_info),
+                         original_size={"width": original_width, "height": original_height})
+
+            # 步驟2: 使用Gemini生成新位置
+            await report("layout", "started")
+            logger.info("步驟2: 調用Gemini API生成新位置")
+            service = GeminiPSDResizeService(api_key=api_key)
+
+            if stream:
+                # 流式模式: 每收到一個圖層立即交給渲染線程，渲染與模型生成並行
+                new_positions, renderer = await _stream_layout_and_render(
+                    service, psd_path, layers_info, detection_image_path,
+                    original_width, original_height, target_width, target_height,
+                    render, report, resampling
+                )
+            else:
+                new_positions = await service.resize_psd_layers(
+                    layers_info=layers_info,
+                    detection_image_path=detection_image_path,
+                    original_width=original_width,
+                    original_height=original_height,
+                    target_width=target_width,
+                    target_height=target_height
+                )
+                await report("layout", "completed", adjusted_layers=len(new_positions))
+
+        output_png_path = os.path.join(temp_dir, "resized_output.png")
+        result: Dict[str, Any] = {
+            "original_size": {"width": original_width, "height": original_height},
+            "target_size": {"width": target_width, "height": target_height},
+            "layers_count": len(layers_info),
+            "new_positions": new_positions,
+        }
+        if not render:
+            return result
+
+        if not stream and output_mode != "flat":
+            # 分層輸出需要保留每個圖層的渲染結果
+            await report("render", "started")
+            logger.info("步驟3: 逐圖層渲染")
+            renderer = await run_in_threadpool(
+                IncrementalLayerRenderer, psd_path, target_width, target_height, resampling
+            )
+            await run_in_threadpool(renderer.render_all, new_positions)
+            stream = True
+
+        layer_placements = None
+        output_psd_path = None
+        if stream:
+            await run_in_threadpool(renderer.finalize, output_png_path)
+            if output_mode == "layers":
+                layer_placements = await run_in_threadpool(
+                    renderer.export_layers, os.path.join(temp_dir, "layers")
+                )
+            elif output_mode == "psd":
+                output_psd_path = await run_in_threadpool(
+                    renderer.save_psd, os.path.join(temp_dir, "resized_output.psd")
+                )
+            await report("render", "completed")
+        else:
+            # 保存新位置信息
+            positions_file = os.path.join(temp_dir, "new_positions.json")
+            with open(positions_file, 'w', encoding='utf-8') as f:
+                json.dump(new_positions, f, ensure_ascii=False, indent=2)
+
+            # 步驟3: 重建PSD並渲染
+            await report("render", "started")
+            logger.info("步驟3: 重建PSD並渲染")
+
+            await run_in_threadpool(
+                resize_psd_with_new_positions,
+                psd_path,
+                positions_file,
+                output_png_path,
+                target_width,
+                target_height,
+                resampling
+            )
+            await report("render", "completed")
+
+        # 步驟4: 保存輸出文件及元數據
+        await report("encode", "started")
+        # 結果ID由輸出內容派生，同一秒內完成的多個結果不會互相覆蓋
+        result_file_id = await run_in_threadpool(
+            psd_resize_store.make_result_id,
+            output_png_path,
+            {"target_size": result["target_size"], "new_positions": new_positions,
+             "output_mode": output_mode, "resampling": resampling}
+        )
+
+        # 移動文件到永久目錄
+        os.makedirs(PSD_DIR, exist_ok=True)
+        result_files = [f"{result_file_id}.png"]
+        shutil.move(output_png_path, os.path.join(PSD_DIR, result_files[0]))
+
+        result["output_mode"] = output_mode
+        result["resampling"] = resampling
+        if layer_placements is not None:
+            layers_dir = os.path.join(PSD_DIR, f"{result_file_id}_layers")
+            shutil.rmtree(layers_dir, ignore_errors=True)
+            shutil.move(os.path.join(temp_dir, "layers"), layers_dir)
+            result_files.append(f"{result_file_id}_layers")
+            for placement in layer_placements:
+                placement["image_url"] = f"/api/psd/resize/output/{result_file_id}/layer/{placement['id']}"
+            result["layers"] = layer_placements
+        if output_psd_path is not None:
+            shutil.move(output_psd_path, os.path.join(PSD_DIR, f"{result_file_id}_resized.psd"))
+            result_files.append(f"{result_file_id}_resized.psd")
+            result["psd_url"] = f"/api/psd/resize/output/{result_file_id}/psd"
+
+        # 保存元數據到結果索引
+        metadata = {
+            "file_id": result_file_id,
+            **(extra_metadata or {}),
+            **result,
+            "output_url": f"/api/psd/resize/output/{result_file_id}"
+        }
+        await psd_resize_store.register(result_file_id, result_files, metadata)
+        await report("encode", "completed", file_id=result_file_id)
+
+        return {
+            "file_id": result_file_id,
+            **(extra_metadata or {}),
+            **result,
+            "output_url": f"/api/psd/resize/output/{result_file_id}",
+            "metadata_url": f"/api/psd/resize/metadata/{result_file_id}",
+        }
+
+    finally:
+        # 清理臨時文件
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def _stream_layout_and_render(
+    service: GeminiPSDResizeService,
+    psd_path: str,
+    layers_info: List[Dict[str, Any]],
+    detection_image_path: str,
+    original_width: int,
+    original_height: int,
+    target_width: int,
+    target_height: int,
+    render: bool,
+    report: ProgressReporter,
+    resampling: str = DEFAULT_RESAMPLING_TIER,
+) -> Tuple[List[Dict[str, Any]], Optional[IncrementalLayerRenderer]]:
+    """
+    流式獲取布局並把每個完成的圖層立即分派給渲染器
+
+    Returns:
+        (調整方案, 已渲染所有圖層的渲染器；render為False時為None)
+    """
+    loop = asyncio.get_running_loop()
+    renderer: Optional[IncrementalLayerRenderer] = None
+    # psd-tools的圖層合成不保證線程安全，使用單線程按到達順序渲染
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="psd-render") if render else None
+    pending = []
+    new_positions: List[Dict[str, Any]] = []
+
+    try:
+        if render:
+            renderer = await loop.run_in_executor(
+                executor, IncrementalLayerRenderer, psd_path, target_width, target_height, resampling
+            )
+
+        async for item in service.stream_resize_psd_layers(
             layers_info=layers_info,
             detection_image_path=detection_image_path,
             original_width=original_width,
             original_height=original_height,
             target_width=target_width,
             target_height=target_height
-        )
-        
-        # 保存新位置信息
-        positions_file = os.path.join(temp_dir, "new_positions.json")
-        with open(positions_file, 'w', encoding='utf-8') as f:
-            json.dump(new_positions, f, ensure_ascii=False, indent=2)
-        
-        # 步驟3: 重建PSD並渲染
-        logger.info("步驟3: 重建PSD並渲染")
-        output_png_path = os.path.join(temp_dir, "resized_output.png")
-        
-        result_image = resize_psd_with_new_positions(
+        ):
+            new_positions.append(item)
+            if render:
+                if not pending:
+                    await report("render", "started")
+                pending.append(loop.run_in_executor(executor, renderer.render_layer, item))
+            await report("layout", "progress", received_layers=len(new_positions), layer=item)
+
+        await report("layout", "completed", adjusted_layers=len(new_positions))
+
+        if pending:
+            await asyncio.gather(*pending)
+        elif render:
+            await report("render", "started")
+        return new_positions, renderer
+
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+async def _save_upload_to_temp(psd_file: UploadFile) -> str:
+    """驗證並保存上傳的PSD文件到臨時目錄，返回文件路徑"""
+    if not psd_file.filename or not psd_file.filename.lower().endswith('.psd'):
+        raise HTTPException(status_code=400, detail="只支持PSD文件格式")
+
+    temp_dir = tempfile.mkdtemp()
+    psd_path = os.path.join(temp_dir, os.path.basename(psd_file.filename))
+
+    with open(psd_path, "wb") as buffer:
+        content = await psd_file.read()
+        buffer.write(content)
+
+    logger.info(f"PSD文件已保存到: {psd_path}")
+    return psd_path
+
+
+def _get_uploaded_psd_path(file_id: str) -> str:
+    """獲取已上傳PSD文件的路徑，不存在時拋出404"""
+    psd_path = os.path.join(PSD_DIR, f'{file_id}.psd')
+
+    if not os.path.exists(psd_path):
+        logger.error(f"PSD文件未找到: {psd_path}")
+        raise HTTPException(status_code=404, detail=f"PSD文件未找到: {file_id}")
+
+    return psd_path
+
+
+def _check_output_mode(output_mode: str) -> None:
+    if output_mode not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的輸出模式: {output_mode}，可選: {', '.join(OUTPUT_MODES)}")
+
+
+def _check_resampling(quality: str) -> None:
+    if quality not in RESAMPLING_TIERS:
+        raise HTTPException(status_code=400, detail=f"不支持的重採樣檔位: {quality}，可選: {', '.join(RESAMPLING_TIERS)}")
+
+
+def _parse_positions(positions: str) -> List[Dict[str, Any]]:
+    """解析表單提交的調整方案JSON（與preview返回的adjustments格式一致）"""
+    try:
+        data = json.loads(positions)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"positions不是有效的JSON: {e}")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="positions必須是圖層調整信息的數組")
+    return [item for item in data if isinstance(item, dict)]
+
+
+async def _load_result_metadata(file_id: str) -> Dict[str, Any]:
+    """讀取縮放結果的元數據（優先讀取結果索引，兼容舊的JSON元數據文件），不存在時拋出404"""
+    metadata = await psd_resize_store.get_metadata(file_id)
+    if metadata is not None:
+        return metadata
+
+    metadata_path = os.path.join(PSD_DIR, f"{file_id}_metadata.json")
+    if not os.path.exists(metadata_path):
+        raise HTTPException(status_code=404, detail="元數據文件未找到")
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _layers_info_from_positions(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """由調整方案中的original_coords還原圖層信息（用於校驗，無需重新打開PSD）"""
+    layers_info = []
+    for item in items:
+        coords = item.get('original_coords') or item['new_coords']
+        layers_info.append({
+            'id': item['id'],
+            'name': item.get('name', ''),
+            'type': item.get('type', 'unknown'),
+            'visible': item.get('visible', True),
+            'level': item.get('level', 0),
+            'left': coords['left'],
+            'top': coords['top'],
+            'right': coords['right'],
+            'bottom': coords['bottom'],
+            'width': coords['right'] - coords['left'],
+            'height': coords['bottom'] - coords['top'],
+        })
+    return layers_info
+
+
+def _build_preview_info(result: Dict[str, Any]) -> Dict[str, Any]:
+    """將流水線結果整理為預覽信息"""
+    original_size = result["original_size"]
+    target_size = result["target_size"]
+    return {
+        "original_size": original_size,
+        "target_size": target_size,
+        "layers_count": result["layers_count"],
+        "adjustments": result["new_positions"],
+        "summary": {
+            "total_layers": result["layers_count"],
+            "adjusted_layers": len(result["new_positions"]),
+            "scale_ratio": min(target_size["width"] / original_size["width"],
+                               target_size["height"] / original_size["height"])
+        }
+    }
+
+
+@router.post("/auto-resize")
+async def auto_resize_psd(
+    psd_file: UploadFile = File(...),
+    target_width: int = Form(...),
+    target_height: int = Form(...),
+    api_key: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    output_mode: str = Form("flat"),
+    quality: str = Form(DEFAULT_RESAMPLING_TIER)
+):
+    """
+    使用Gemini API自動縮放PSD文件
+
+    Args:
+        psd_file: PSD文件
+        target_width: 目標寬度
+        target_height: 目標高度
+        api_key: Gemini API密鑰（可選，如果不提供則使用環境變量）
+        stream: 流式解析模型輸出，邊生成邊渲染
+        output_mode: 輸出模式，flat（單張PNG）、layers（每個圖層單獨的PNG及放置信息）、psd（分層PSD）
+        quality: 圖層縮放的重採樣檔位，quality（最高質量）、balanced（預縮小後LANCZOS，默認）、draft（最快）
+
+    Returns:
+        縮放後的圖層信息和輸出文件URL
+    """
+    _check_output_mode(output_mode)
+    _check_resampling(quality)
+    psd_path = await _save_upload_to_temp(psd_file)
+    try:
+        # 相同內容、尺寸、選項、密鑰和文件名的併發請求只執行一次，臨時文件在執行結束後清理
+        result = await _run_single_flight(
             psd_path,
-            positions_file,
-            output_png_path,
             target_width,
-            target_height
+            target_height,
+            {"source": "upload", "render": True, "output_mode": output_mode, "positions": None,
+             "resampling": quality},
+            lambda: _run_resize_pipeline(
+                psd_path,
+                target_width,
+                target_height,
+                api_key=api_key,
+                extra_metadata={"original_filename": psd_file.filename},
+                stream=stream,
+                output_mode=output_mode,
+                resampling=quality
+            ),
+            cleanup=lambda: shutil.rmtree(os.path.dirname(psd_path), ignore_errors=True),
+            api_key=api_key,
+            extra_metadata={"original_filename": psd_file.filename}
         )
-        
-        # 生成文件ID
-        import time
-        file_id = f"resized_{int(time.time())}"
-        
-        # 移動文件到永久目錄
-        final_png_path = os.path.join(PSD_DIR, f"{file_id}.png")
-        os.makedirs(PSD_DIR, exist_ok=True)
-        
-        import shutil
-        shutil.move(output_png_path, final_png_path)
-        
-        # 保存元數據
-        metadata = {
-            "file_id": file_id,
-            "original_filename": psd_file.filename,
-            "original_size": {"width": original_width, "height": original_height},
-            "target_size": {"width": target_width, "height": target_height},
-            "layers_count": len(layers_info),
-            "new_positions": new_positions,
-            "output_url": f"/api/psd/resize/output/{file_id}"
-        }
-        
-        metadata_path = os.path.join(PSD_DIR, f"{file_id}_metadata.json")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-        
+
         logger.info("PSD自動縮放完成")
-        
-        return {
-            "success": True,
-            "file_id": file_id,
-            "original_size": {"width": original_width, "height": original_height},
-            "target_size": {"width": target_width, "height": target_height},
-            "layers_count": len(layers_info),
-            "output_url": f"/api/psd/resize/output/{file_id}",
-            "metadata_url": f"/api/psd/resize/metadata/{file_id}",
-            "new_positions": new_positions
-        }
-        
+
+        return {"success": True, **result}
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"PSD自動縮放失敗: {e}")
         raise HTTPException(status_code=500, detail=f"PSD自動縮放失敗: {str(e)}")
-    
-    finally:
-        # 清理臨時文件
-        try:
-            import shutil
-            if 'temp_dir' in locals():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except Exception:
-            pass
 
 
 @router.get("/output/{file_id}")
 async def get_resized_output(file_id: str):
     """
     獲取縮放後的輸出圖像
-    
+
     Args:
         file_id: 文件ID
-    
+
     Returns:
         縮放後的PNG圖像
     """
     png_path = os.path.join(PSD_DIR, f"{file_id}.png")
-    
+
     if not os.path.exists(png_path):
         raise HTTPException(status_code=404, detail="輸出文件未找到")
-    
+
+    await psd_resize_store.touch(file_id)
     return FileResponse(png_path, media_type="image/png")
 
 
+@router.get("/output/{file_id}/layer/{layer_id}")
+async def get_resized_layer(file_id: str, layer_id: int):
+    """
+    獲取分層輸出中單個圖層的PNG（output_mode=layers）
+
+    Args:
+        file_id: 文件ID
+        layer_id: 圖層ID
+    """
+    png_path = os.path.join(PSD_DIR, f"{file_id}_layers", f"{layer_id}.png")
+
+    if not os.path.exists(png_path):
+        raise HTTPException(status_code=404, detail="圖層文件未找到")
+
+    await psd_resize_store.touch(file_id)
+    return FileResponse(png_path, media_type="image/png")
+
+
+@router.get("/output/{file_id}/psd")
+async def get_resized_psd(file_id: str):
+    """
+    獲取分層PSD輸出（output_mode=psd）
+
+    Args:
+        file_id: 文件ID
+    """
+    psd_path = os.path.join(PSD_DIR, f"{file_id}_resized.psd")
+
+    if not os.path.exists(psd_path):
+        raise HTTPException(status_code=404, detail="PSD文件未找到")
+
+    await psd_resize_store.touch(file_id)
+    return FileResponse(psd_path, media_type="image/vnd.adobe.photoshop", filename=f"{file_id}.psd")
+
+
 @router.get("/metadata/{file_id}")
 async def get_resize_metadata(file_id: str):
     """
     獲取縮放操作的元數據
-    
+
     Args:
         file_id: 文件ID
-    
+
     Returns:
         縮放操作的詳細元數據
     """
-    metadata_path = os.path.join(PSD_DIR, f"{file_id}_metadata.json")
-    
-    if not os.path.exists(metadata_path):
-        raise HTTPException(status_code=404, detail="元數據文件未找到")
-    
-    with open(metadata_path, 'r', encoding='utf-8') as f:
-        metadata = json.load(f)
-    
-    return metadata
+    return await _load_result_metadata(file_id)
+
+
+@router.post("/rerender/{file_id}")
+async def rerender_resized_output(
+    file_id: str,
+    changes: str = Form(...)
+):
+    """
+    手動微調後增量重渲染
+
+    只重新合成被移動/縮放圖層的新舊區域（髒矩形），其餘像素直接沿用上一次的輸出。
+    縮放後的圖層位圖會被緩存，連續微調時每次只需處理尺寸變化的圖層。
+
+    Args:
+        file_id: 上一次縮放結果的文件ID（需由 /resize-by-id 等基於已上傳PSD的接口生成）
+        changes: 修改的圖層JSON數組，每項至少包含 id 和 new_coords
+
+    Returns:
+        新的結果文件ID、輸出URL及重繪區域
+    """
+    metadata = await _load_result_metadata(file_id)
+    original_file_id = metadata.get("original_file_id")
+    if not original_file_id:
+        raise HTTPException(status_code=400, detail="該結果不是由已上傳的PSD生成，無法增量重渲染")
+    psd_path = _get_uploaded_psd_path(original_file_id)
+
+    base_png_path = os.path.join(PSD_DIR, f"{file_id}.png")
+    if not os.path.exists(base_png_path):
+        raise HTTPException(status_code=404, detail="輸出文件未找到")
+
+    old_items = metadata["new_positions"]
+    old_by_id = {item['id']: item for item in old_items}
+    change_items = [item for item in _parse_positions(changes) if item.get('id') in old_by_id]
+    if not change_items:
+        raise HTTPException(status_code=400, detail="changes中沒有有效的圖層")
+
+    original_size = metadata["original_size"]
+    target_size = metadata["target_size"]
+    # 修改後的框同樣經過本地校驗，保證在畫布內
+    validation = validate_layout(
+        change_items, _layers_info_from_positions(old_items),
+        original_size["width"], original_size["height"],
+        target_size["width"], target_size["height"],
+        fill_missing=False
+    )
+    changed = {
+        item['id']: {**old_by_id[item['id']], 'new_coords': item['new_coords']}
+        for item in validation.positions
+        if item['new_coords'] != old_by_id[item['id']].get('new_coords')
+    }
+    new_items = [changed.get(item['id'], item) for item in old_items]
+    # 與生成上一次輸出時的檔位一致，未重繪的區域才能與重繪區域無縫銜接
+    resampling = metadata.get("resampling", "quality")
+
+    def render() -> Tuple[str, List[Any]]:
+        start = time.perf_counter()
+        with Image.open(base_png_path) as base_image:
+            canvas, dirty_rects = rerender_dirty_regions(
+                psd_path, base_image, old_items, new_items, list(changed), layer_bitmap_cache,
+                resampling
+            )
+        temp_dir = tempfile.mkdtemp()
+        try:
+            temp_png_path = save_output(canvas, os.path.join(temp_dir, "rerender.png"))
+            result_file_id = psd_resize_store.make_result_id(
+                temp_png_path, {"target_size": target_size, "new_positions": new_items,
+                                "output_mode": "flat", "resampling": resampling}
+            )
+            shutil.move(temp_png_path, os.path.join(PSD_DIR, f"{result_file_id}.png"))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.info(f"增量重渲染完成: {file_id} -> {result_file_id}, "
+                    f"耗時 {(time.perf_counter() - start) * 1000:.1f}ms")
+        return result_file_id, dirty_rects
+
+    try:
+        result_file_id, dirty_rects = await run_in_threadpool(render)
+    except Exception as e:
+        logger.error(f"增量重渲染失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"增量重渲染失敗: {str(e)}")
+
+    # 分層輸出不隨增量重渲染更新，不繼承父結果的圖層/PSD鏈接
+    inherited = {key: value for key, value in metadata.items() if key not in ("layers", "psd_url")}
+    new_metadata = {
+        **inherited,
+        "output_mode": "flat",
+        "resampling": resampling,
+        "file_id": result_file_id,
+        "parent_file_id": file_id,
+        "new_positions": new_items,
+        "output_url": f"/api/psd/resize/output/{result_file_id}",
+    }
+    await psd_resize_store.register(result_file_id, [f"{result_file_id}.png"], new_metadata)
+
+    return {
+        "success": True,
+        "file_id": result_file_id,
+        "parent_file_id": file_id,
+        "changed_layers": list(changed),
+        "dirty_rects": [list(rect) for rect in dirty_rects],
+        "output_url": f"/api/psd/resize/output/{result_file_id}",
+        "metadata_url": f"/api/psd/resize/metadata/{result_file_id}",
+    }
 
 
 @router.post("/preview-resize")
@@ -204,83 +760,51 @@ async def preview_resize(
     psd_file: UploadFile = File(...),
     target_width: int = Form(...),
     target_height: int = Form(...),
-    api_key: Optional[str] = Form(None)
+    api_key: Optional[str] = Form(None),
+    stream: bool = Form(False)
 ):
     """
     預覽縮放效果（不保存文件，只返回調整方案）
-    
+
     Args:
         psd_file: PSD文件
         target_width: 目標寬度
         target_height: 目標高度
         api_key: Gemini API密鑰
-    
+        stream: 流式解析模型輸出
+
     Returns:
         縮放預覽信息
     """
+    psd_path = await _save_upload_to_temp(psd_file)
     try:
-        # 驗證文件類型
-        if not psd_file.filename.lower().endswith('.psd'):
-            raise HTTPException(status_code=400, detail="只支持PSD文件格式")
-        
-        # 保存臨時文件
-        temp_dir = tempfile.mkdtemp()
-        psd_path = os.path.join(temp_dir, psd_file.filename)
-        
-        with open(psd_path, "wb") as buffer:
-            content = await psd_file.read()
-            buffer.write(content)
-        
-        # 提取圖層信息
-        psd, layers_info = get_psd_layers_info(psd_path)
-        original_width = psd.width
-        original_height = psd.height
-        
-        # 生成檢測框圖像
-        detection_image_path = os.path.join(temp_dir, "detection.png")
-        draw_detection_boxes(psd, layers_info, detection_image_path)
-        
-        # 使用Gemini生成調整方案
-        service = GeminiPSDResizeService(api_key=api_key)
-        new_positions = await service.resize_psd_layers(
-            layers_info=layers_info,
-            detection_image_path=detection_image_path,
-            original_width=original_width,
-            original_height=original_height,
-            target_width=target_width,
-            target_height=target_height
+        result = await _run_single_flight(
+            psd_path,
+            target_width,
+            target_height,
+            {"source": "upload", "render": False, "output_mode": None, "positions": None},
+            lambda: _run_resize_pipeline(
+                psd_path,
+                target_width,
+                target_height,
+                api_key=api_key,
+                render=False,
+                stream=stream
+            ),
+            cleanup=lambda: shutil.rmtree(os.path.dirname(psd_path), ignore_errors=True),
+            api_key=api_key
         )
-        
-        # 生成預覽信息
-        preview_info = {
-            "original_size": {"width": original_width, "height": original_height},
-            "target_size": {"width": target_width, "height": target_height},
-            "layers_count": len(layers_info),
-            "adjustments": new_positions,
-            "summary": {
-                "total_layers": len(layers_info),
-                "adjusted_layers": len(new_positions),
-                "scale_ratio": min(target_width/original_width, target_height/original_height)
-            }
-        }
-        
+
         return {
             "success": True,
-            "preview": preview_info
+            "preview": _build_preview_info(result)
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"預覽縮放失敗: {e}")
         raise HTTPException(status_code=500, detail=f"預覽縮放失敗: {str(e)}")
-    
-    finally:
-        # 清理臨時文件
-        try:
-            import shutil
-            if 'temp_dir' in locals():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except Exception:
-            pass
 
 
 @router.post("/resize-by-id")
@@ -288,135 +812,238 @@ async def resize_psd_by_file_id(
     file_id: str = Form(...),
     target_width: int = Form(...),
     target_height: int = Form(...),
-    api_key: Optional[str] = Form(None)
+    api_key: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    positions: Optional[str] = Form(None),
+    output_mode: str = Form("flat"),
+    quality: str = Form(DEFAULT_RESAMPLING_TIER)
 ):
     """
     通過file_id直接處理已上傳的PSD文件（無需前端下載）
     這是為大文件優化的版本，避免前端下載大PSD文件。
     服務器直接讀取已上傳的PSD文件進行處理。
-    
+
     Args:
         file_id: PSD文件ID
         target_width: 目標寬度
         target_height: 目標高度
         api_key: Gemini API密鑰（可選）
-    
+        stream: 流式解析模型輸出，邊生成邊渲染
+        positions: 已確定的調整方案JSON（例如代理預覽中調好的布局），提供時不再調用Gemini，直接全質量渲染
+        output_mode: 輸出模式，flat（單張PNG）、layers（每個圖層單獨的PNG及放置信息）、psd（分層PSD）
+        quality: 圖層縮放的重採樣檔位，quality（最高質量）、balanced（預縮小後LANCZOS，默認）、draft（最快）
+
     Returns:
         縮放後的圖層信息和輸出文件URL
     """
+    _check_output_mode(output_mode)
+    _check_resampling(quality)
+    new_positions = _parse_positions(positions) if positions else None
     try:
         # 檢查PSD文件是否存在
-        psd_path = os.path.join(PSD_DIR, f'{file_id}.psd')
-        
-        if not os.path.exists(psd_path):
-            logger.error(f"PSD文件未找到: {psd_path}")
-            raise HTTPException(status_code=404, detail=f"PSD文件未找到: {file_id}")
-        
+        psd_path = _get_uploaded_psd_path(file_id)
+
         # 檢查文件大小
         file_size_mb = os.path.getsize(psd_path) / (1024 * 1024)
         logger.info(f"開始處理PSD文件: {file_id}, 大小: {file_size_mb:.2f} MB")
-        
-        # 創建臨時目錄
-        temp_dir = tempfile.mkdtemp()
-        
-        # 步驟1: 提取圖層信息
-        logger.info("步驟1: 提取PSD圖層信息")
-        psd, layers_info = get_psd_layers_info(psd_path)
-        original_width = psd.width
-        original_height = psd.height
-        
-        logger.info(f"原始尺寸: {original_width}x{original_height}")
-        logger.info(f"目標尺寸: {target_width}x{target_height}")
-        logger.info(f"圖層數量: {len(layers_info)}")
-        
-        # 生成檢測框圖像
-        detection_image_path = os.path.join(temp_dir, "detection.png")
-        draw_detection_boxes(psd, layers_info, detection_image_path)
-        
-        # 步驟2: 使用Gemini生成新位置
-        logger.info("步驟2: 調用Gemini API生成新位置")
-        service = GeminiPSDResizeService(api_key=api_key)
-        
-        new_positions = await service.resize_psd_layers(
-            layers_info=layers_info,
-            detection_image_path=detection_image_path,
-            original_width=original_width,
-            original_height=original_height,
-            target_width=target_width,
-            target_height=target_height
-        )
-        
-        # 保存新位置信息
-        positions_file = os.path.join(temp_dir, "new_positions.json")
-        with open(positions_file, 'w', encoding='utf-8') as f:
-            json.dump(new_positions, f, ensure_ascii=False, indent=2)
-        
-        # 步驟3: 重建PSD並渲染
-        logger.info("步驟3: 重建PSD並渲染")
-        output_png_path = os.path.join(temp_dir, "resized_output.png")
-        
-        result_image = resize_psd_with_new_positions(
+
+        result = await _run_single_flight(
             psd_path,
-            positions_file,
-            output_png_path,
             target_width,
-            target_height
+            target_height,
+            {
+                "source": f"file_id:{file_id}",
+                "render": True,
+                "output_mode": output_mode,
+                "positions": positions,
+                "resampling": quality,
+            },
+            lambda: _run_resize_pipeline(
+                psd_path,
+                target_width,
+                target_height,
+                api_key=api_key,
+                extra_metadata={"original_file_id": file_id},
+                stream=stream,
+                new_positions=new_positions,
+                output_mode=output_mode,
+                resampling=quality
+            ),
+            api_key=api_key,
+            extra_metadata={"original_file_id": file_id}
         )
-        
-        # 生成文件ID
-        import time
-        result_file_id = f"resized_{int(time.time())}"
-        
-        # 移動文件到永久目錄
-        final_png_path = os.path.join(PSD_DIR, f"{result_file_id}.png")
-        os.makedirs(PSD_DIR, exist_ok=True)
-        
-        import shutil
-        shutil.move(output_png_path, final_png_path)
-        
-        # 保存元數據
-        metadata = {
-            "file_id": result_file_id,
-            "original_file_id": file_id,
-            "original_size": {"width": original_width, "height": original_height},
-            "target_size": {"width": target_width, "height": target_height},
-            "layers_count": len(layers_info),
-            "new_positions": new_positions,
-            "output_url": f"/api/psd/resize/output/{result_file_id}"
-        }
-        
-        metadata_path = os.path.join(PSD_DIR, f"{result_file_id}_metadata.json")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-        
+
         logger.info(f"PSD自動縮放完成，文件大小: {file_size_mb:.2f} MB")
-        
-        return {
-            "success": True,
-            "file_id": result_file_id,
-            "original_file_id": file_id,
-            "original_size": {"width": original_width, "height": original_height},
-            "target_size": {"width": target_width, "height": target_height},
-            "layers_count": len(layers_info),
-            "output_url": f"/api/psd/resize/output/{result_file_id}",
-            "metadata_url": f"/api/psd/resize/metadata/{result_file_id}",
-            "new_positions": new_positions
-        }
-        
+
+        return {"success": True, **result}
+
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"PSD自動縮放失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"PSD自動縮放失敗: {str(e)}")
-    
-    finally:
-        # 清理臨時文件
-        try:
-            import shutil
-            if 'temp_dir' in locals():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except Exception:
-            pass
+
+
+@router.post("/proxy-preview")
+async def proxy_preview(
+    file_id: str = Form(...),
+    target_width: int = Form(...),
+    target_height: int = Form(...),
+    positions: str = Form(...)
+):
+    """
+    低分辨率代理預覽（用於交互式調整布局）
+
+    使用按PSD緩存的縮小圖層合成任意布局，首次請求構建緩存，之後每次只需幾十毫秒。
+    確定布局後將同樣的positions提交到 /resize-by-id 進行全質量渲染。
+
+    Args:
+        file_id: PSD文件ID
+        target_width: 目標寬度
+        target_height: 目標高度
+        positions: 調整方案JSON（與preview返回的adjustments格式一致）
+
+    Returns:
+        PNG預覽圖（最長邊不超過代理尺寸）
+    """
+    if target_width <= 0 or target_height <= 0:
+        raise HTTPException(status_code=400, detail="目標尺寸必須大於0")
+    psd_path = _get_uploaded_psd_path(file_id)
+    new_positions = _parse_positions(positions)
+
+    try:
+        proxy = await psd_proxy_cache.get(file_id, psd_path)
+
+        def render() -> bytes:
+            start = time.perf_counter()
+            preview = render_proxy_preview(proxy, new_positions, target_width, target_height)
+            buffer = io.BytesIO()
+            preview.save(buffer, 'PNG', compress_level=1)
+            logger.info(f"代理預覽渲染完成: {file_id}, 耗時 {(time.perf_counter() - start) * 1000:.1f}ms")
+            return buffer.getvalue()
+
+        content = await run_in_threadpool(render)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"代理預覽失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"代理預覽失敗: {str(e)}")
+
+    return Response(content=content, media_type="image/png", headers={"Cache-Control": "no-store"})
+
+
+@router.post("/jobs")
+async def submit_resize_job(
+    target_width: int = Form(...),
+    target_height: int = Form(...),
+    file_id: Optional[str] = Form(None),
+    psd_file: Optional[UploadFile] = File(None),
+    mode: str = Form("resize"),
+    api_key: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    output_mode: str = Form("flat"),
+    quality: str = Form(DEFAULT_RESAMPLING_TIER),
+    socket_id: Optional[str] = Form(None)
+):
+    """
+    提交異步縮放任務，立即返回job_id
+
+    各階段（extract、layout、render、encode）的進度通過Socket.IO的
+    `psd_resize_progress` 事件推送給socket_id對應的連接，狀態與耗時可通過 GET /jobs/{job_id} 查詢，
+    完成後的圖像通過 /output/{file_id} 獲取。
+
+    Args:
+        target_width: 目標寬度
+        target_height: 目標高度
+        file_id: 已上傳PSD的文件ID（與psd_file二選一）
+        psd_file: 直接上傳的PSD文件
+        mode: resize（渲染輸出）或 preview（只生成調整方案）
+        api_key: Gemini API密鑰（可選）
+        stream: 流式解析模型輸出，每個圖層完成時推送layout進度並立即渲染
+        output_mode: 輸出模式，flat（單張PNG）、layers（每個圖層單獨的PNG及放置信息）、psd（分層PSD）
+        quality: 圖層縮放的重採樣檔位，quality（最高質量）、balanced（預縮小後LANCZOS，默認）、draft（最快）
+        socket_id: 接收進度推送的Socket.IO連接ID（可選，不提供時只能輪詢）
+
+    Returns:
+        任務ID及狀態查詢地址
+    """
+    if mode not in ("resize", "preview"):
+        raise HTTPException(status_code=400, detail=f"不支持的任務模式: {mode}")
+    _check_output_mode(output_mode)
+    _check_resampling(quality)
+    if not file_id and psd_file is None:
+        raise HTTPException(status_code=400, detail="需要提供file_id或psd_file")
+
+    render = mode == "resize"
+    on_finish = None
+    if file_id:
+        psd_path = _get_uploaded_psd_path(file_id)
+        extra_metadata = {"original_file_id": file_id}
+    else:
+        psd_path = await _save_upload_to_temp(psd_file)
+        extra_metadata = {"original_filename": psd_file.filename}
+        on_finish = lambda: shutil.rmtree(os.path.dirname(psd_path), ignore_errors=True)
+
+    async def runner(report: ProgressReporter) -> Dict[str, Any]:
+        # 重複的任務等待同一次執行，進度只由第一個任務推送；上傳文件由任務的on_finish清理
+        result = await _run_single_flight(
+            psd_path,
+            target_width,
+            target_height,
+            {
+                "source": f"file_id:{file_id}" if file_id else "upload",
+                "render": render,
+                "output_mode": output_mode if render else None,
+                "positions": None,
+                "resampling": quality if render else None,
+            },
+            lambda: _run_resize_pipeline(
+                psd_path,
+                target_width,
+                target_height,
+                api_key=api_key,
+                render=render,
+                extra_metadata=extra_metadata,
+                report=report,
+                stream=stream,
+                output_mode=output_mode,
+                resampling=quality
+            ),
+            api_key=api_key,
+            extra_metadata=extra_metadata
+        )
+        if not render:
+            return {"preview": _build_preview_info(result)}
+        return result
+
+    job = psd_resize_job_manager.submit(
+        mode,
+        runner,
+        stages=None if render else ["extract", "layout"],
+        on_finish=on_finish,
+        socket_id=socket_id
+    )
+
+    return {
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/api/psd/resize/jobs/{job.job_id}"
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_resize_job(job_id: str):
+    """
+    查詢異步縮放任務的狀態、各階段耗時及結果
+
+    Args:
+        job_id: 任務ID
+    """
+    job = psd_resize_job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任務未找到: {job_id}")
+    return job.to_dict()
 
 
 @router.get("/health")
@@ -425,5 +1052,8 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "PSD Auto Resize Service",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "layout_engine": layout_engine_id(),
+        "rate_limiter": gemini_rate_limiter.get_status(),
+        "inflight_resizes": resize_flights.inflight_count
     }
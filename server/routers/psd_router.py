@@ -6,13 +6,17 @@ from PIL import Image
 from io import BytesIO
 import os
 import json
-import uuid
 import numpy as np
 from typing import List, Dict, Any, Optional
 from common import DEFAULT_PORT
 from tools.utils.image_canvas_utils import generate_file_id
 from services.config_service import FILES_DIR
-from datetime import datetime
+from services.library_db_service import template_db
+from services.usage_counter_service import template_usage
+from services.psd_canvas_payload_service import psd_canvas_payloads
+from services.psd_proxy_cache_service import psd_proxy_cache
+from models.template_model import TemplateCategory, TemplateItem
+from sqlalchemy import select
 
 router = APIRouter(prefix="/api/psd")
 
@@ -32,59 +36,6 @@ except Exception as e:
     except Exception as e2:
         print(f'❌ 无法创建PSD目录: {e2}')
 
-# 模板数据库配置
-TEMPLATE_DB_URL = "sqlite:///./user_data/templates.db"
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, JSON, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-
-template_engine = create_engine(TEMPLATE_DB_URL)
-TemplateSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=template_engine)
-TemplateBase = declarative_base()
-
-# 模板数据库模型
-class TemplateCategory(TemplateBase):
-    __tablename__ = "template_categories"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    icon = Column(String, nullable=True)
-    color = Column(String, nullable=True, default="#3b82f6")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-class TemplateItem(TemplateBase):
-    __tablename__ = "template_items"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    category_id = Column(String, ForeignKey("template_categories.id"), nullable=False)
-    type = Column(String, nullable=False)  # psd_file, psd_layer, image, text_style, layer_group, canvas_element
-    thumbnail_url = Column(String, nullable=True)
-    preview_url = Column(String, nullable=True)
-    template_metadata = Column(JSON, nullable=True)
-    tags = Column(JSON, nullable=True, default=list)
-    usage_count = Column(Integer, default=0)
-    is_favorite = Column(Boolean, default=False)
-    is_public = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_by = Column(String, nullable=True)
-    
-    # 关系
-    category = relationship("TemplateCategory", backref="templates")
-
-# 创建模板数据库表
-TemplateBase.metadata.create_all(bind=template_engine)
-
-def get_template_db():
-    db = TemplateSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 async def _create_psd_file_template(
     file_id: str,
@@ -98,65 +49,63 @@ async def _create_psd_file_template(
     """
     为PSD文件自动创建模板
     """
-    db = TemplateSessionLocal()
-    try:
-        # 获取或创建默认分类
-        default_category = db.query(TemplateCategory).filter(
-            TemplateCategory.name == "PSD文件"
-        ).first()
-        
-        if not default_category:
-            default_category = TemplateCategory(
-                name="PSD文件",
-                description="从PSD文件自动创建的模板分类",
-                icon="📁",
-                color="#3b82f6"
+    async with template_db.session() as db:
+        try:
+            # 获取或创建默认分类
+            default_category = (await db.execute(
+                select(TemplateCategory).where(TemplateCategory.name == "PSD文件").limit(1)
+            )).scalar_one_or_none()
+            
+            if not default_category:
+                default_category = TemplateCategory(
+                    name="PSD文件",
+                    description="从PSD文件自动创建的模板分类",
+                    icon="📁",
+                    color="#3b82f6"
+                )
+                db.add(default_category)
+                await db.commit()
+                await db.refresh(default_category)
+            
+            # 创建模板名称（去掉.psd扩展名）
+            template_name = filename.replace('.psd', '').replace('.PSD', '')
+            
+            # 创建模板元数据
+            template_metadata = {
+                "psd_file_id": file_id,
+                "original_filename": filename,
+                "width": width,
+                "height": height,
+                "layers_count": layers_count,
+                "layers_info": layers_info,
+                "file_type": "psd_file",
+                "created_from": "auto_upload"
+            }
+            
+            # 创建模板
+            template = TemplateItem(
+                name=template_name,
+                description=f"PSD文件模板 - {layers_count}个图层，尺寸: {width}x{height}",
+                category_id=default_category.id,
+                type="psd_file",
+                thumbnail_url=thumbnail_url,
+                preview_url=thumbnail_url,
+                template_metadata=template_metadata,
+                tags=["psd", "文件", "自动创建"],
+                is_public=False,
+                is_favorite=False,
+                usage_count=0
             )
-            db.add(default_category)
-            db.commit()
-            db.refresh(default_category)
-        
-        # 创建模板名称（去掉.psd扩展名）
-        template_name = filename.replace('.psd', '').replace('.PSD', '')
-        
-        # 创建模板元数据
-        template_metadata = {
-            "psd_file_id": file_id,
-            "original_filename": filename,
-            "width": width,
-            "height": height,
-            "layers_count": layers_count,
-            "layers_info": layers_info,
-            "file_type": "psd_file",
-            "created_from": "auto_upload"
-        }
-        
-        # 创建模板
-        template = TemplateItem(
-            name=template_name,
-            description=f"PSD文件模板 - {layers_count}个图层，尺寸: {width}x{height}",
-            category_id=default_category.id,
-            type="psd_file",
-            thumbnail_url=thumbnail_url,
-            preview_url=thumbnail_url,
-            template_metadata=template_metadata,
-            tags=["psd", "文件", "自动创建"],
-            is_public=False,
-            is_favorite=False,
-            usage_count=0
-        )
-        
-        db.add(template)
-        db.commit()
-        db.refresh(template)
-        
-        return template.id
-        
-    except Exception as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+            
+            db.add(template)
+            await db.commit()
+            await db.refresh(template)
+            
+            return template.id
+            
+        except Exception as e:
+            await db.rollback()
+            raise e
 
 
 @router.post("/upload")
@@ -214,6 +163,9 @@ async def upload_psd(file: UploadFile = File(...)):
                 'original_filename': file.filename
             }, f, ensure_ascii=False, indent=2)
         
+        # 预计算模板的画布载荷，首次应用时无需再读图层图片
+        await run_in_threadpool(psd_canvas_payloads.build, file_id)
+        
         # 自动创建PSD文件模板
         template_id = None
         template_created = False
@@ -366,6 +318,9 @@ async def update_layer(file_id: str, layer_index: int, file: UploadFile = File(.
         # 保存更新后的图层
         layer_path = os.path.join(PSD_DIR, f'{file_id}_layer_{layer_index}.png')
         await run_in_threadpool(img.save, layer_path, format='PNG')
+        # 元数据文件未变，需手动让画布载荷和预览代理失效
+        psd_canvas_payloads.invalidate(file_id)
+        psd_proxy_cache.invalidate(file_id)
         
         return {
             'success': True,
@@ -884,6 +839,30 @@ async def get_thumbnail(file_id: str):
     return FileResponse(thumbnail_path)
 
 
+async def _get_psd_template_payload(template_id: str):
+    """查找PSD文件模板并返回 (模板, PSD文件ID, 画布载荷)"""
+    async with template_db.session() as db:
+        template = await db.get(TemplateItem, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+
+    if template.type != "psd_file":
+        raise HTTPException(status_code=400, detail="Template is not a PSD file")
+
+    # 获取PSD文件ID
+    psd_file_id = (template.template_metadata or {}).get("psd_file_id")
+    if not psd_file_id:
+        raise HTTPException(status_code=404, detail="PSD file ID not found in template metadata")
+
+    # 命中内存缓存只需一次stat，未命中时在线程池中读取磁盘缓存或重建
+    payload = psd_canvas_payloads.cached(psd_file_id)
+    if payload is None:
+        payload = await run_in_threadpool(psd_canvas_payloads.get, psd_file_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="PSD metadata not found")
+    return template, psd_file_id, payload
+
+
 @router.get("/template/{template_id}/layers")
 async def get_psd_template_layers(template_id: str):
     """
@@ -893,47 +872,26 @@ async def get_psd_template_layers(template_id: str):
         template_id: 模板ID
     
     Returns:
-        图层信息列表
+        图层信息列表，以及预计算的画布元素 elements
     """
-    db = TemplateSessionLocal()
     try:
-        # 查找模板
-        template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
-        if not template:
-            raise HTTPException(status_code=404, detail="Template not found")
-        
-        if template.type != "psd_file":
-            raise HTTPException(status_code=400, detail="Template is not a PSD file")
-        
-        # 获取PSD文件ID
-        psd_file_id = template.template_metadata.get("psd_file_id")
-        if not psd_file_id:
-            raise HTTPException(status_code=404, detail="PSD file ID not found in template metadata")
-        
-        # 读取PSD元数据
-        metadata_path = os.path.join(PSD_DIR, f'{psd_file_id}_metadata.json')
-        if not os.path.exists(metadata_path):
-            raise HTTPException(status_code=404, detail="PSD metadata not found")
-        
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        template, psd_file_id, payload = await _get_psd_template_payload(template_id)
         
         return {
             "template_id": template_id,
             "template_name": template.name,
             "psd_file_id": psd_file_id,
-            "width": metadata["width"],
-            "height": metadata["height"],
-            "layers": metadata["layers"],
-            "original_filename": metadata["original_filename"]
+            "width": payload["width"],
+            "height": payload["height"],
+            "layers": payload["layers"],
+            "elements": payload["elements"],
+            "original_filename": payload["original_filename"]
         }
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting PSD template layers: {str(e)}")
-    finally:
-        db.close()
 
 
 @router.post("/template/{template_id}/apply")
@@ -946,35 +904,13 @@ async def apply_psd_template(template_id: str, canvas_id: str = None):
         canvas_id: 画布ID（可选）
     
     Returns:
-        应用结果
+        应用结果，elements 为可直接插入画布的元素（坐标相对模板左上角）
     """
-    db = TemplateSessionLocal()
     try:
-        # 查找模板
-        template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
-        if not template:
-            raise HTTPException(status_code=404, detail="Template not found")
-        
-        if template.type != "psd_file":
-            raise HTTPException(status_code=400, detail="Template is not a PSD file")
-        
-        # 增加使用次数
-        template.usage_count += 1
-        template.updated_at = datetime.utcnow()
-        db.commit()
-        
-        # 获取PSD文件ID
-        psd_file_id = template.template_metadata.get("psd_file_id")
-        if not psd_file_id:
-            raise HTTPException(status_code=404, detail="PSD file ID not found in template metadata")
-        
-        # 读取PSD元数据
-        metadata_path = os.path.join(PSD_DIR, f'{psd_file_id}_metadata.json')
-        if not os.path.exists(metadata_path):
-            raise HTTPException(status_code=404, detail="PSD metadata not found")
+        template, psd_file_id, payload = await _get_psd_template_payload(template_id)
         
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        # 增加使用次数（缓冲后批量写回）
+        template_usage.add(template_id)
         
         return {
             "success": True,
@@ -982,13 +918,13 @@ async def apply_psd_template(template_id: str, canvas_id: str = None):
             "template_id": template_id,
             "psd_file_id": psd_file_id,
             "canvas_id": canvas_id,
-            "layers": metadata["layers"],
-            "usage_count": template.usage_count
+            "width": payload["width"],
+            "height": payload["height"],
+            "elements": payload["elements"],
+            "usage_count": template_usage.count(template.id, template.usage_count)
         }
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error applying PSD template: {str(e)}")
-    finally:
-        db.close()
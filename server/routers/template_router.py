@@ -1,69 +1,24 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query, Form
-from fastapi.responses import JSONResponse
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, JSON, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query, Form, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from sqlalchemy import select, func, null, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 import json
 import os
-import uuid
-from PIL import Image
+import zipfile
+import base64
 import io
 
-# 数据库配置
-DATABASE_URL = "sqlite:///./user_data/templates.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# 数据库模型
-class TemplateCategory(Base):
-    __tablename__ = "template_categories"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    icon = Column(String, nullable=True)
-    color = Column(String, nullable=True, default="#3b82f6")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-class TemplateItem(Base):
-    __tablename__ = "template_items"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    category_id = Column(String, ForeignKey("template_categories.id"), nullable=False)
-    type = Column(String, nullable=False)  # psd_layer, image, text_style, layer_group, canvas_element
-    thumbnail_url = Column(String, nullable=True)
-    preview_url = Column(String, nullable=True)
-    template_metadata = Column(JSON, nullable=True)
-    tags = Column(JSON, nullable=True, default=list)
-    usage_count = Column(Integer, default=0)
-    is_favorite = Column(Boolean, default=False)
-    is_public = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_by = Column(String, nullable=True)
-    
-    # 关系
-    category = relationship("TemplateCategory", backref="templates")
-
-class TemplateCollection(Base):
-    __tablename__ = "template_collections"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    template_ids = Column(JSON, nullable=True, default=list)
-    thumbnail_url = Column(String, nullable=True)
-    is_public = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_by = Column(String, nullable=True)
+from models.template_model import TemplateCategory, TemplateItem, TemplateCollection
+from services.library_db_service import template_db
+from services.template_search_index import TemplateSearchIndex
+from services.usage_counter_service import template_usage
+from services.template_thumbnail_service import template_thumbnail_service, TEMPLATE_UPLOAD_DIR, THUMBS_SUBFOLDER, is_content_digest, upload_url
+from services.template_bundle_service import template_bundle_service
 
 # Pydantic模型
 class TemplateCategoryCreate(BaseModel):
@@ -107,62 +62,119 @@ class TemplateCollectionUpdate(BaseModel):
     template_ids: Optional[List[str]] = None
     is_public: Optional[bool] = None
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 全文索引（FTS5，由触发器同步）
+template_search = TemplateSearchIndex(template_db.sync_engine)
+template_search.ensure()
 
 # 依赖注入
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with template_db.session() as db:
         yield db
-    finally:
-        db.close()
 
 # 文件上传目录
-UPLOAD_DIR = "user_data/template_uploads"
+UPLOAD_DIR = TEMPLATE_UPLOAD_DIR
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def save_uploaded_file(file: UploadFile, subfolder: str = "") -> str:
-    """保存上传的文件并返回URL"""
-    file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-    filename = f"{file_id}{file_extension}"
-    
-    folder_path = os.path.join(UPLOAD_DIR, subfolder)
-    os.makedirs(folder_path, exist_ok=True)
-    
-    file_path = os.path.join(folder_path, filename)
-    
-    with open(file_path, "wb") as buffer:
-        content = file.file.read()
-        buffer.write(content)
+async def save_uploaded_file(file: UploadFile, subfolder: str = "") -> str:
+    """保存上传的文件（按内容哈希命名）并返回URL，缩略图在后台生成"""
+    file_path, digest = await run_in_threadpool(template_thumbnail_service.store_upload, file, subfolder)
+    template_thumbnail_service.submit(digest, file_path)
     
     # 返回完整的URL路径
-    return f"http://localhost:3000/api/templates/uploads/{subfolder}/{filename}"
+    return upload_url(subfolder, os.path.basename(file_path))
+
+# 列表响应字段
+TEMPLATE_FIELDS = (
+    "id", "name", "description", "category_id", "type", "thumbnail_url", "thumbnail_srcset", "preview_url",
+    "metadata", "tags", "usage_count", "is_favorite", "is_public", "created_at", "updated_at", "created_by",
+)
+
+# 列表默认不返回的元数据键（PSD模板的图层列表），需要时通过 fields=metadata 或单个模板接口获取
+HEAVY_METADATA_KEYS = ("layers_info",)
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    """解析 fields 参数，返回None表示默认字段（元数据去掉大字段）"""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(TEMPLATE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested | {"id"}
+
+def metadata_summary_column():
+    """在SQLite中去掉元数据大字段，避免把图层列表读出再丢弃"""
+    return func.coalesce(
+        func.json_remove(TemplateItem.template_metadata, *[f"$.{key}" for key in HEAVY_METADATA_KEYS]),
+        "null"
+    )
 
-def generate_thumbnail(image_path: str, size: tuple = (200, 200)) -> str:
-    """生成缩略图"""
+def select_templates(fields: Optional[set]):
+    """按字段投影构造查询，返回的每行为 (TemplateItem, 精简元数据JSON或None)"""
+    if fields is not None and "metadata" in fields:
+        return select(TemplateItem, null())
+    summary = metadata_summary_column() if fields is None else null()
+    return select(TemplateItem, summary).options(defer(TemplateItem.template_metadata))
+
+def template_to_dict(template: TemplateItem, fields: Optional[set] = None, metadata_summary: Optional[str] = None) -> Dict[str, Any]:
+    """序列化模板，fields 为None时返回全部字段，metadata_summary 为精简后的元数据JSON"""
+    if metadata_summary is not None:
+        metadata = json.loads(metadata_summary)
+    elif fields is not None and "metadata" not in fields:
+        metadata = None
+    else:
+        metadata = template.template_metadata
+    data = {
+        "id": template.id,
+        "name": template.name,
+        "description": template.description,
+        "category_id": template.category_id,
+        "type": template.type,
+        "thumbnail_url": template.thumbnail_url,
+        "thumbnail_srcset": template_thumbnail_service.srcset(template.thumbnail_url),
+        "preview_url": template.preview_url,
+        "metadata": metadata,
+        "tags": template.tags or [],
+        "usage_count": template_usage.count(template.id, template.usage_count),
+        "is_favorite": template.is_favorite,
+        "is_public": template.is_public,
+        "created_at": template.created_at.isoformat(),
+        "updated_at": template.updated_at.isoformat(),
+        "created_by": template.created_by,
+    }
+    if fields is not None:
+        data = {key: value for key, value in data.items() if key in fields}
+    return data
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, length: int) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def after_updated_key(values: Any):
+    """把游标中的 [updated_at, id] 转成 keyset 条件"""
     try:
-        with Image.open(image_path) as img:
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            thumbnail_path = image_path.replace(".", "_thumb.")
-            img.save(thumbnail_path)
-            return thumbnail_path
-    except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        return image_path
-
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+        updated_at, template_id = values
+        updated_at = datetime.fromisoformat(updated_at)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple_(TemplateItem.updated_at, TemplateItem.id) < (updated_at, template_id)
 
 # 路由
 router = APIRouter(prefix="/templates", tags=["templates"])
 
 # 分类管理
 @router.get("/categories")
-async def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db: AsyncSession = Depends(get_db)):
     """获取所有分类"""
-    categories = db.query(TemplateCategory).all()
+    categories = (await db.execute(select(TemplateCategory))).scalars().all()
     return [{
         "id": cat.id,
         "name": cat.name,
@@ -174,12 +186,12 @@ async def get_categories(db: Session = Depends(get_db)):
     } for cat in categories]
 
 @router.post("/categories")
-async def create_category(category: TemplateCategoryCreate, db: Session = Depends(get_db)):
+async def create_category(category: TemplateCategoryCreate, db: AsyncSession = Depends(get_db)):
     """创建新分类"""
     db_category = TemplateCategory(**category.dict())
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     
     return {
         "id": db_category.id,
@@ -192,9 +204,9 @@ async def create_category(category: TemplateCategoryCreate, db: Session = Depend
     }
 
 @router.put("/categories/{category_id}")
-async def update_category(category_id: str, category: TemplateCategoryUpdate, db: Session = Depends(get_db)):
+async def update_category(category_id: str, category: TemplateCategoryUpdate, db: AsyncSession = Depends(get_db)):
     """更新分类"""
-    db_category = db.query(TemplateCategory).filter(TemplateCategory.id == category_id).first()
+    db_category = await db.get(TemplateCategory, category_id)
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
     
@@ -203,8 +215,8 @@ async def update_category(category_id: str, category: TemplateCategoryUpdate, db
         setattr(db_category, field, value)
     
     db_category.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     
     return {
         "id": db_category.id,
@@ -217,89 +229,72 @@ async def update_category(category_id: str, category: TemplateCategoryUpdate, db
     }
 
 @router.delete("/categories/{category_id}")
-async def delete_category(category_id: str, db: Session = Depends(get_db)):
+async def delete_category(category_id: str, db: AsyncSession = Depends(get_db)):
     """删除分类"""
-    db_category = db.query(TemplateCategory).filter(TemplateCategory.id == category_id).first()
+    db_category = await db.get(TemplateCategory, category_id)
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
     
     # 检查是否有模板使用此分类
-    templates_count = db.query(TemplateItem).filter(TemplateItem.category_id == category_id).count()
+    templates_count = await db.scalar(
+        select(func.count()).select_from(TemplateItem).where(TemplateItem.category_id == category_id)
+    )
     if templates_count > 0:
         raise HTTPException(status_code=400, detail=f"Cannot delete category with {templates_count} templates")
     
-    db.delete(db_category)
-    db.commit()
+    await db.delete(db_category)
+    await db.commit()
     return {"message": "Category deleted successfully"}
 
 # 模板管理
 @router.get("/items")
 async def get_templates(
+    response: Response,
     category_id: Optional[str] = Query(None),
     type: Optional[str] = Query(None),
     tags: Optional[List[str]] = Query(None),
     is_favorite: Optional[bool] = Query(None),
     is_public: Optional[bool] = Query(None),
     created_by: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，包含 metadata 时返回完整元数据"),
+    db: AsyncSession = Depends(get_db)
 ):
-    """获取模板列表"""
-    query = db.query(TemplateItem)
+    """获取模板列表（按更新时间倒序，keyset 分页）"""
+    field_set = parse_fields(fields)
+    query = select_templates(field_set)
     
     if category_id:
-        query = query.filter(TemplateItem.category_id == category_id)
+        query = query.where(TemplateItem.category_id == category_id)
     if type:
-        query = query.filter(TemplateItem.type == type)
+        query = query.where(TemplateItem.type == type)
     if is_favorite is not None:
-        query = query.filter(TemplateItem.is_favorite == is_favorite)
+        query = query.where(TemplateItem.is_favorite == is_favorite)
     if is_public is not None:
-        query = query.filter(TemplateItem.is_public == is_public)
+        query = query.where(TemplateItem.is_public == is_public)
     if created_by:
-        query = query.filter(TemplateItem.created_by == created_by)
-    
-    templates = query.all()
-    return [{
-        "id": template.id,
-        "name": template.name,
-        "description": template.description,
-        "category_id": template.category_id,
-        "type": template.type,
-        "thumbnail_url": template.thumbnail_url,
-        "preview_url": template.preview_url,
-        "metadata": template.template_metadata,
-        "tags": template.tags or [],
-        "usage_count": template.usage_count,
-        "is_favorite": template.is_favorite,
-        "is_public": template.is_public,
-        "created_at": template.created_at.isoformat(),
-        "updated_at": template.updated_at.isoformat(),
-        "created_by": template.created_by,
-    } for template in templates]
+        query = query.where(TemplateItem.created_by == created_by)
+    if cursor:
+        query = query.where(after_updated_key(decode_cursor(cursor, 2)))
+    
+    rows = (await db.execute(
+        query.order_by(TemplateItem.updated_at.desc(), TemplateItem.id.desc()).limit(limit + 1)
+    )).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor([last.updated_at.isoformat(), last.id])
+    return [template_to_dict(template, field_set, summary) for template, summary in rows]
 
 @router.get("/items/{template_id}")
-async def get_template(template_id: str, db: Session = Depends(get_db)):
+async def get_template(template_id: str, db: AsyncSession = Depends(get_db)):
     """获取单个模板"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
+    template = await db.get(TemplateItem, template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    return {
-        "id": template.id,
-        "name": template.name,
-        "description": template.description,
-        "category_id": template.category_id,
-        "type": template.type,
-        "thumbnail_url": template.thumbnail_url,
-        "preview_url": template.preview_url,
-        "metadata": template.template_metadata,
-        "tags": template.tags or [],
-        "usage_count": template.usage_count,
-        "is_favorite": template.is_favorite,
-        "is_public": template.is_public,
-        "created_at": template.created_at.isoformat(),
-        "updated_at": template.updated_at.isoformat(),
-        "created_by": template.created_by,
-    }
+    return template_to_dict(template)
 
 @router.post("/items")
 async def create_template(
@@ -312,7 +307,7 @@ async def create_template(
     is_public: str = Form("false"),
     thumbnail: Optional[UploadFile] = File(None),
     preview: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """创建新模板"""
     try:
@@ -327,10 +322,10 @@ async def create_template(
     preview_url = None
     
     if thumbnail:
-        thumbnail_url = save_uploaded_file(thumbnail, "thumbnails")
+        thumbnail_url = await save_uploaded_file(thumbnail, "thumbnails")
     
     if preview:
-        preview_url = save_uploaded_file(preview, "previews")
+        preview_url = await save_uploaded_file(preview, "previews")
     
     template = TemplateItem(
         name=name,
@@ -345,26 +340,10 @@ async def create_template(
     )
     
     db.add(template)
-    db.commit()
-    db.refresh(template)
+    await db.commit()
+    await db.refresh(template)
     
-    return {
-        "id": template.id,
-        "name": template.name,
-        "description": template.description,
-        "category_id": template.category_id,
-        "type": template.type,
-        "thumbnail_url": template.thumbnail_url,
-        "preview_url": template.preview_url,
-        "metadata": template.template_metadata,
-        "tags": template.tags,
-        "usage_count": template.usage_count,
-        "is_favorite": template.is_favorite,
-        "is_public": template.is_public,
-        "created_at": template.created_at.isoformat(),
-        "updated_at": template.updated_at.isoformat(),
-        "created_by": template.created_by,
-    }
+    return template_to_dict(template)
 
 @router.put("/items/{template_id}")
 async def update_template(
@@ -377,10 +356,10 @@ async def update_template(
     is_public: Optional[str] = Form(None),
     thumbnail: Optional[UploadFile] = File(None),
     preview: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """更新模板"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
+    template = await db.get(TemplateItem, template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
@@ -406,37 +385,21 @@ async def update_template(
     
     # 更新文件
     if thumbnail:
-        template.thumbnail_url = save_uploaded_file(thumbnail, "thumbnails")
+        template.thumbnail_url = await save_uploaded_file(thumbnail, "thumbnails")
     
     if preview:
-        template.preview_url = save_uploaded_file(preview, "previews")
+        template.preview_url = await save_uploaded_file(preview, "previews")
     
     template.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(template)
+    await db.commit()
+    await db.refresh(template)
     
-    return {
-        "id": template.id,
-        "name": template.name,
-        "description": template.description,
-        "category_id": template.category_id,
-        "type": template.type,
-        "thumbnail_url": template.thumbnail_url,
-        "preview_url": template.preview_url,
-        "metadata": template.template_metadata,
-        "tags": template.tags,
-        "usage_count": template.usage_count,
-        "is_favorite": template.is_favorite,
-        "is_public": template.is_public,
-        "created_at": template.created_at.isoformat(),
-        "updated_at": template.updated_at.isoformat(),
-        "created_by": template.created_by,
-    }
+    return template_to_dict(template)
 
 @router.delete("/items/{template_id}")
-async def delete_template(template_id: str, db: Session = Depends(get_db)):
+async def delete_template(template_id: str, db: AsyncSession = Depends(get_db)):
     """删除模板"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
+    template = await db.get(TemplateItem, template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
@@ -451,21 +414,21 @@ async def delete_template(template_id: str, db: Session = Depends(get_db)):
         if os.path.exists(preview_path):
             os.remove(preview_path)
     
-    db.delete(template)
-    db.commit()
+    await db.delete(template)
+    await db.commit()
     return {"message": "Template deleted successfully"}
 
 @router.post("/items/{template_id}/favorite")
-async def toggle_favorite(template_id: str, db: Session = Depends(get_db)):
+async def toggle_favorite(template_id: str, db: AsyncSession = Depends(get_db)):
     """切换收藏状态"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
+    template = await db.get(TemplateItem, template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
     template.is_favorite = not template.is_favorite
     template.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(template)
+    await db.commit()
+    await db.refresh(template)
     
     return {
         "id": template.id,
@@ -473,23 +436,22 @@ async def toggle_favorite(template_id: str, db: Session = Depends(get_db)):
     }
 
 @router.post("/items/{template_id}/usage")
-async def increment_usage(template_id: str, db: Session = Depends(get_db)):
+async def increment_usage(template_id: str, db: AsyncSession = Depends(get_db)):
     """增加使用次数"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
-    if not template:
+    exists = await db.scalar(select(TemplateItem.id).where(TemplateItem.id == template_id))
+    if not exists:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    template.usage_count += 1
-    template.updated_at = datetime.utcnow()
-    db.commit()
+    # 计入缓冲，由后台批量写回
+    template_usage.add(template_id)
     
     return {"message": "Usage count incremented"}
 
 # 集合管理
 @router.get("/collections")
-async def get_collections(db: Session = Depends(get_db)):
+async def get_collections(db: AsyncSession = Depends(get_db)):
     """获取所有集合"""
-    collections = db.query(TemplateCollection).all()
+    collections = (await db.execute(select(TemplateCollection))).scalars().all()
     return [{
         "id": collection.id,
         "name": collection.name,
@@ -503,12 +465,12 @@ async def get_collections(db: Session = Depends(get_db)):
     } for collection in collections]
 
 @router.post("/collections")
-async def create_collection(collection: TemplateCollectionCreate, db: Session = Depends(get_db)):
+async def create_collection(collection: TemplateCollectionCreate, db: AsyncSession = Depends(get_db)):
     """创建新集合"""
     db_collection = TemplateCollection(**collection.dict())
     db.add(db_collection)
-    db.commit()
-    db.refresh(db_collection)
+    await db.commit()
+    await db.refresh(db_collection)
     
     return {
         "id": db_collection.id,
@@ -523,9 +485,9 @@ async def create_collection(collection: TemplateCollectionCreate, db: Session =
     }
 
 @router.put("/collections/{collection_id}")
-async def update_collection(collection_id: str, collection: TemplateCollectionUpdate, db: Session = Depends(get_db)):
+async def update_collection(collection_id: str, collection: TemplateCollectionUpdate, db: AsyncSession = Depends(get_db)):
     """更新集合"""
-    db_collection = db.query(TemplateCollection).filter(TemplateCollection.id == collection_id).first()
+    db_collection = await db.get(TemplateCollection, collection_id)
     if not db_collection:
         raise HTTPException(status_code=404, detail="Collection not found")
     
@@ -534,8 +496,8 @@ async def update_collection(collection_id: str, collection: TemplateCollectionUp
         setattr(db_collection, field, value)
     
     db_collection.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_collection)
+    await db.commit()
+    await db.refresh(db_collection)
     
     return {
         "id": db_collection.id,
@@ -550,14 +512,14 @@ async def update_collection(collection_id: str, collection: TemplateCollectionUp
     }
 
 @router.delete("/collections/{collection_id}")
-async def delete_collection(collection_id: str, db: Session = Depends(get_db)):
+async def delete_collection(collection_id: str, db: AsyncSession = Depends(get_db)):
     """删除集合"""
-    db_collection = db.query(TemplateCollection).filter(TemplateCollection.id == collection_id).first()
+    db_collection = await db.get(TemplateCollection, collection_id)
     if not db_collection:
         raise HTTPException(status_code=404, detail="Collection not found")
     
-    db.delete(db_collection)
-    db.commit()
+    await db.delete(db_collection)
+    await db.commit()
     return {"message": "Collection deleted successfully"}
 
 # 特殊功能
@@ -570,7 +532,7 @@ async def create_from_psd_layer(
     category_id: str = Form(...),
     tags: str = Form("[]"),
     is_public: str = Form("false"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """从PSD图层创建模板"""
     try:
@@ -599,8 +561,8 @@ async def create_from_psd_layer(
     )
     
     db.add(template)
-    db.commit()
-    db.refresh(template)
+    await db.commit()
+    await db.refresh(template)
     
     return {
         "id": template.id,
@@ -610,7 +572,7 @@ async def create_from_psd_layer(
         "type": template.type,
         "metadata": template.template_metadata,
         "tags": template.tags,
-        "usage_count": template.usage_count,
+        "usage_count": template_usage.count(template.id, template.usage_count),
         "is_favorite": template.is_favorite,
         "is_public": template.is_public,
         "created_at": template.created_at.isoformat(),
@@ -623,17 +585,15 @@ async def apply_to_canvas(
     template_id: str = Form(...),
     canvas_id: str = Form(...),
     position: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """应用模板到画布"""
-    template = db.query(TemplateItem).filter(TemplateItem.id == template_id).first()
+    template = await db.get(TemplateItem, template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    # 增加使用次数
-    template.usage_count += 1
-    template.updated_at = datetime.utcnow()
-    db.commit()
+    # 增加使用次数（缓冲后批量写回）
+    template_usage.add(template_id)
     
     # 解析位置信息
     position_data = None
@@ -662,70 +622,101 @@ async def apply_to_canvas(
 
 @router.get("/search")
 async def search_templates(
+    response: Response,
     q: str = Query(...),
     category_id: Optional[str] = Query(None),
     type: Optional[str] = Query(None),
     tags: Optional[List[str]] = Query(None),
     is_favorite: Optional[bool] = Query(None),
     is_public: Optional[bool] = Query(None),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，包含 metadata 时返回完整元数据"),
+    db: AsyncSession = Depends(get_db)
 ):
-    """搜索模板"""
-    query = db.query(TemplateItem)
-    
-    # 文本搜索
-    if q:
-        query = query.filter(
-            TemplateItem.name.contains(q) |
-            TemplateItem.description.contains(q)
-        )
-    
-    # 其他筛选条件
+    """搜索模板（全文索引可用时按相关度排序）"""
+    field_set = parse_fields(fields)
+    filters = {}
     if category_id:
-        query = query.filter(TemplateItem.category_id == category_id)
+        filters["category_id"] = category_id
     if type:
-        query = query.filter(TemplateItem.type == type)
+        filters["type"] = type
     if is_favorite is not None:
-        query = query.filter(TemplateItem.is_favorite == is_favorite)
+        filters["is_favorite"] = is_favorite
     if is_public is not None:
-        query = query.filter(TemplateItem.is_public == is_public)
-    
-    templates = query.all()
-    return [{
-        "id": template.id,
-        "name": template.name,
-        "description": template.description,
-        "category_id": template.category_id,
-        "type": template.type,
-        "thumbnail_url": template.thumbnail_url,
-        "preview_url": template.preview_url,
-        "metadata": template.template_metadata,
-        "tags": template.tags or [],
-        "usage_count": template.usage_count,
-        "is_favorite": template.is_favorite,
-        "is_public": template.is_public,
-        "created_at": template.created_at.isoformat(),
-        "updated_at": template.updated_at.isoformat(),
-        "created_by": template.created_by,
-    } for template in templates]
+        filters["is_public"] = is_public
+    
+    # 游标的第一个值标记排序方式，索引不可用时退回按更新时间分页
+    after = decode_cursor(cursor, 2) if cursor else None
+    ranked = None
+    if after is None or after[0] == "fts":
+        if after and not (isinstance(after[1], list) and all(isinstance(value, (int, float)) for value in after[1])):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        ranked = await template_search.search(db, q, filters, limit + 1, after[1] if after else None)
+    
+    if ranked is not None:
+        next_key = None
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            next_key = ranked[-1][1]
+        ranked_ids = [template_id for template_id, _ in ranked]
+        rows = (await db.execute(
+            select_templates(field_set).where(TemplateItem.id.in_(ranked_ids))
+        )).all() if ranked_ids else []
+        by_id = {template.id: (template, summary) for template, summary in rows}
+        rows = [by_id[template_id] for template_id in ranked_ids if template_id in by_id]
+        if next_key is not None:
+            response.headers["X-Next-Cursor"] = encode_cursor(["fts", next_key])
+    else:
+        query = select_templates(field_set)
+        
+        # 文本搜索
+        if q:
+            query = query.where(
+                TemplateItem.name.contains(q) |
+                TemplateItem.description.contains(q)
+            )
+        
+        # 其他筛选条件
+        for column, value in filters.items():
+            query = query.where(getattr(TemplateItem, column) == value)
+        if after:
+            if after[0] != "like":
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query = query.where(after_updated_key(after[1]))
+        
+        rows = (await db.execute(
+            query.order_by(TemplateItem.updated_at.desc(), TemplateItem.id.desc()).limit(limit + 1)
+        )).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            response.headers["X-Next-Cursor"] = encode_cursor(["like", [last.updated_at.isoformat(), last.id]])
+    
+    return [template_to_dict(template, field_set, summary) for template, summary in rows]
 
 @router.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(db: AsyncSession = Depends(get_db)):
     """获取模板统计信息"""
-    total_templates = db.query(TemplateItem).count()
-    total_categories = db.query(TemplateCategory).count()
-    total_collections = db.query(TemplateCollection).count()
+    # 先写回缓冲中的使用次数，热门排行反映最新值
+    await template_usage.flush()
+    # 总数由触发器维护，Top-N 走 usage_count / created_at 索引
+    counters = await template_db.read_counters(db)
     
     # 最常用的模板
-    most_used = db.query(TemplateItem).order_by(TemplateItem.usage_count.desc()).limit(5).all()
+    most_used = (await db.execute(
+        select(TemplateItem).order_by(TemplateItem.usage_count.desc()).limit(5)
+    )).scalars().all()
     most_used_templates = [{
         "id": template.id,
         "name": template.name,
-        "usage_count": template.usage_count,
+        "usage_count": template_usage.count(template.id, template.usage_count),
     } for template in most_used]
     
     # 最近的模板
-    recent = db.query(TemplateItem).order_by(TemplateItem.created_at.desc()).limit(5).all()
+    recent = (await db.execute(
+        select(TemplateItem).order_by(TemplateItem.created_at.desc()).limit(5)
+    )).scalars().all()
     recent_templates = [{
         "id": template.id,
         "name": template.name,
@@ -733,24 +724,49 @@ async def get_stats(db: Session = Depends(get_db)):
     } for template in recent]
     
     return {
-        "total_templates": total_templates,
-        "total_categories": total_categories,
-        "total_collections": total_collections,
+        "total_templates": counters["total_templates"],
+        "total_categories": counters["total_categories"],
+        "total_collections": counters["total_collections"],
         "most_used_templates": most_used_templates,
         "recent_templates": recent_templates,
     }
 
+# 导入导出
+@router.get("/export")
+async def export_templates():
+    """导出整个模板库为 zip 包（流式生成，不在内存中构建）"""
+    # 先写回缓冲中的使用次数，导出的行是最新值
+    await template_usage.flush()
+    filename = f"templates-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        template_bundle_service.export_bundle(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/import")
+async def import_templates(file: UploadFile = File(...)):
+    """导入 /export 生成的 zip 包，已存在的模板和图片会被跳过"""
+    try:
+        stats = await run_in_threadpool(template_bundle_service.import_bundle, file.file)
+    except (zipfile.BadZipFile, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template bundle: {str(e)}")
+    
+    return {"message": "Templates imported successfully", **stats}
+
 # 文件服务
 @router.get("/uploads/{subfolder}/{filename}")
 async def get_uploaded_file(subfolder: str, filename: str):
     """获取上传的文件"""
     file_path = os.path.join(UPLOAD_DIR, subfolder, filename)
+    if not os.path.exists(file_path) and subfolder == THUMBS_SUBFOLDER:
+        # 缩略图可能仍在后台生成，等待完成（或按原图补生成）
+        digest, _, width = os.path.splitext(filename)[0].rpartition("_")
+        if is_content_digest(digest) and width.isdigit():
+            file_path = await template_thumbnail_service.ensure(digest, int(width)) or file_path
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
-    from fastapi.responses import FileResponse
-    from fastapi import Response
-    
     # 根据文件扩展名设置正确的媒体类型
     media_type = "application/octet-stream"
     if filename.lower().endswith(('.jpg', '.jpeg')):
@@ -0,0 +1,144 @@
+"""
+字体元数据提取与批量导入
+TTFont 以 lazy 模式打开，只读取 name、OS/2、head、maxp 表，字形数取自 maxp，不再解析全部字形。
+批量导入时元数据提取在进程池中并行执行，字体文件在同一文件系统上用硬链接代替复制。
+"""
+
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from fontTools.ttLib import TTFont
+
+IMPORT_WORKERS = int(os.environ.get("FONT_IMPORT_WORKERS", max(1, min(8, os.cpu_count() or 1))))
+# 少于该数量时不启动进程池，进程启动开销比串行处理还大
+_POOL_THRESHOLD = 16
+
+_WEIGHT_MAP = {
+    100: 'Thin',
+    200: 'Extra Light',
+    300: 'Light',
+    400: 'Normal',
+    500: 'Medium',
+    600: 'Semi Bold',
+    700: 'Bold',
+    800: 'Extra Bold',
+    900: 'Black'
+}
+
+_STRETCH_MAP = {
+    1: 'ultra-condensed',
+    2: 'extra-condensed',
+    3: 'condensed',
+    4: 'semi-condensed',
+    5: 'normal',
+    6: 'semi-expanded',
+    7: 'expanded',
+    8: 'extra-expanded',
+    9: 'ultra-expanded'
+}
+
+# head.macStyle 第1位为斜体
+_MAC_STYLE_ITALIC = 1 << 1
+
+
+def _empty_metadata() -> Dict[str, Any]:
+    return {
+        'font_family': 'Unknown',
+        'font_weight': 'normal',
+        'font_style': 'normal',
+        'font_stretch': 'normal',
+        'unicode_ranges': [],
+        'glyph_count': 0,
+        'version': '',
+        'copyright': '',
+        'vendor': ''
+    }
+
+
+def get_font_metadata(font_path: str) -> Dict[str, Any]:
+    """提取字体元数据"""
+    try:
+        with TTFont(font_path, lazy=True) as font:
+            metadata = _empty_metadata()
+            metadata['font_family'] = ''
+            metadata['glyph_count'] = font['maxp'].numGlyphs
+
+            # 提取字体名称信息
+            for record in font['name'].names:
+                if record.nameID == 1:  # Font Family
+                    metadata['font_family'] = record.toUnicode()
+                elif record.nameID == 2:  # Font Subfamily
+                    metadata['font_style'] = record.toUnicode()
+                elif record.nameID == 5:  # Version
+                    metadata['version'] = record.toUnicode()
+                elif record.nameID == 0:  # Copyright
+                    metadata['copyright'] = record.toUnicode()
+                elif record.nameID == 8:  # Manufacturer
+                    metadata['vendor'] = record.toUnicode()
+
+            # 提取字重、字宽信息
+            if 'OS/2' in font:
+                os2_table = font['OS/2']
+                metadata['font_weight'] = _WEIGHT_MAP.get(os2_table.usWeightClass, 'Normal')
+                metadata['font_stretch'] = _STRETCH_MAP.get(os2_table.usWidthClass, 'normal')
+
+            # 没有子族名称时按 head 表判断斜体
+            if not metadata['font_style'] or metadata['font_style'] == 'normal':
+                if 'head' in font and font['head'].macStyle & _MAC_STYLE_ITALIC:
+                    metadata['font_style'] = 'italic'
+
+            return metadata
+
+    except Exception as e:
+        print(f"Error extracting font metadata: {e}")
+        return _empty_metadata()
+
+
+def link_or_copy(source_path: str, target_path: str):
+    """同一文件系统上创建硬链接，跨设备或不支持硬链接时复制"""
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+def _import_font_file(paths: Tuple[str, str]) -> Dict[str, Any]:
+    """进程池任务：链接字体文件并提取元数据，失败时返回错误信息"""
+    source_path, target_path = paths
+    try:
+        link_or_copy(source_path, target_path)
+        return {
+            'file_path': target_path,
+            'file_size': os.path.getsize(target_path),
+            'font_metadata': get_font_metadata(target_path),
+        }
+    except Exception as e:
+        return {'error': str(e)}
+
+
+class FontImporter:
+    """批量导入字体文件"""
+
+    def __init__(self, workers: int = IMPORT_WORKERS):
+        self.workers = workers
+
+    def import_files(self, paths: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        按 (源路径, 目标路径) 导入，结果与输入顺序一致。
+        同步方法，在线程池中调用；进程池只在本次导入期间存在。
+        """
+        if len(paths) < _POOL_THRESHOLD or self.workers <= 1:
+            return [_import_font_file(item) for item in paths]
+        # spawn：不复制服务进程的线程和事件循环状态
+        context = multiprocessing.get_context("spawn")
+        workers = min(self.workers, len(paths) // _POOL_THRESHOLD + 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            chunksize = max(1, len(paths) // (workers * 4))
+            return list(pool.map(_import_font_file, paths, chunksize=chunksize))
+
+
+# 全局实例
+font_importer = FontImporter()
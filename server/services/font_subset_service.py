@@ -0,0 +1,161 @@
+"""
+字体子集
+按画布实际用到的字符生成 WOFF2 子集，CJK 字体从十几MB降到几十KB。
+子集按 (字体内容哈希, 码点集合哈希) 缓存在 font_subsets/ 下，同一组合只生成一次；生成在后台线程池中执行。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from fontTools import subset
+
+from services.config_service import USER_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+FONT_SUBSET_DIR = os.path.join(USER_DATA_DIR, "font_subsets")
+SUBSET_WORKERS = int(os.environ.get("FONT_SUBSET_WORKERS", 2))
+# 超过该数量时子集不再比原字体小多少，应直接使用完整字体
+MAX_CODEPOINTS = int(os.environ.get("FONT_SUBSET_MAX_CODEPOINTS", 8000))
+_CHUNK_SIZE = 1024 * 1024
+
+
+class InvalidCodepoints(ValueError):
+    pass
+
+
+def parse_codepoints(value: str) -> Set[int]:
+    """解析逗号分隔的码点，支持十进制、U+4E00、0x4E00 和范围 U+4E00-4E0F"""
+    codepoints: Set[int] = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        hexadecimal = start.strip().lower().startswith(("u+", "0x"))
+        try:
+            first, last = _parse_codepoint(start), _parse_codepoint(end or start, hexadecimal)
+        except ValueError:
+            raise InvalidCodepoints(f"Invalid codepoint: {part}")
+        if first > last or last > 0x10FFFF or last - first >= MAX_CODEPOINTS:
+            raise InvalidCodepoints(f"Invalid codepoint range: {part}")
+        codepoints.update(range(first, last + 1))
+    return codepoints
+
+
+def _parse_codepoint(value: str, hexadecimal: bool = False) -> int:
+    """范围终点没有前缀时沿用起点的进制"""
+    value = value.strip().lower()
+    if value.startswith(("u+", "0x")):
+        return int(value[2:], 16)
+    return int(value, 16 if hexadecimal else 10)
+
+
+def text_codepoints(texts: Iterable[Optional[str]]) -> Set[int]:
+    """文本中用到的码点（不含换行等控制字符）"""
+    return {ord(char) for text in texts if text for char in text if char.isprintable()}
+
+
+def _render_subset(font_path: str, codepoints: Tuple[int, ...], target_path: str) -> str:
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = ["*"]
+    options.name_IDs = ["*"]
+    options.notdef_outline = True
+    options.hinting = False
+    options.desubroutinize = True
+    font = subset.load_font(font_path, options, lazy=True)
+    try:
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        # 先写临时文件再改名，避免并发请求读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                subset.save_font(font, f, options)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        font.close()
+    return target_path
+
+
+class FontSubsetService:
+    """WOFF2 子集生成与缓存"""
+
+    def __init__(self, cache_dir: str = FONT_SUBSET_DIR, workers: int = SUBSET_WORKERS):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="font-subset")
+        self._jobs: Dict[str, Future] = {}
+        # 字体路径 -> ((mtime_ns, 大小), 内容哈希)，文件未变时不重复读取整个字体
+        self._digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    def font_digest(self, font_path: str) -> str:
+        """字体内容哈希，同步方法，首次计算时在线程池中调用"""
+        stat = os.stat(font_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(font_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        hasher = hashlib.sha256()
+        with open(font_path, "rb") as f:
+            while True:
+                chunk = f.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        self._digests[font_path] = (version, digest)
+        return digest
+
+    def _cached_digest(self, font_path: str) -> Optional[str]:
+        cached = self._digests.get(font_path)
+        if cached is None:
+            return None
+        try:
+            stat = os.stat(font_path)
+        except FileNotFoundError:
+            return None
+        return cached[1] if cached[0] == (stat.st_mtime_ns, stat.st_size) else None
+
+    async def subset(self, font_path: str, codepoints: Set[int]) -> str:
+        """返回子集文件路径，已缓存时直接返回，同一组合并发请求只生成一次"""
+        if not codepoints:
+            raise InvalidCodepoints("No codepoints")
+        if len(codepoints) > MAX_CODEPOINTS:
+            raise InvalidCodepoints(f"Too many codepoints (max {MAX_CODEPOINTS})")
+
+        font_hash = self._cached_digest(font_path)
+        if font_hash is None:
+            font_hash = await asyncio.wrap_future(self._executor.submit(self.font_digest, font_path))
+        ordered = tuple(sorted(codepoints))
+        codepoint_hash = hashlib.sha256(",".join(map(str, ordered)).encode("ascii")).hexdigest()
+        key = f"{font_hash[:32]}_{codepoint_hash[:32]}"
+        target_path = os.path.join(self.cache_dir, f"{key}.woff2")
+        if os.path.exists(target_path):
+            return target_path
+
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._executor.submit(_render_subset, font_path, ordered, target_path)
+            self._jobs[key] = job
+            job.add_done_callback(lambda _: self._jobs.pop(key, None))
+        return await asyncio.wrap_future(job)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局实例
+font_subset_service = FontSubsetService()
@@ -1,56 +1,233 @@
 #!/usr/bin/env python3
 """
 Gemini PSD自動縮放服務
-整合Gemini 2.5 Pro API進行PSD圖層智能縮放
+整合Gemini 2.5 Pro API進行PSD圖層智能縮放，
+模型調用由 services.layout_providers 中的布局後端完成（Gemini / 本地求解 / OpenAI兼容接口）
 """
 
+import asyncio
 import base64
+import csv
+import io
 import json
 import os
 import re
+import time
 from pathlib import Path
-from typing import Dict, List, Any, Optional
-try:
-    from google import genai
-    from google.genai import types
-except ImportError:
-    import google.generativeai as genai
-    types = None
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple, Union
 import logging
 
+from services.gemini_rate_limiter import PRIORITY_NORMAL
+from services.layout_providers import (
+    DEFAULT_LAYOUT_PROVIDER,
+    LayoutProviderBase,
+    LayoutRequest,
+    get_layout_provider,
+)
+from utils.layout_validation import validate_layout, resolve_cross_cluster_overlaps
+
 logger = logging.getLogger(__name__)
 
+# 完整輸出格式（包含調整說明等字段）
+VERBOSE_OUTPUT_FORMAT = """請為每個圖層提供新的坐標信息，使用以下JSON格式：
+
+```json
+[
+  {
+    "id": 圖層ID,
+    "name": "圖層名稱",
+    "type": "圖層類型",
+    "level": 圖層層級,
+    "visible": true/false,
+    "original_coords": {
+      "left": 原始左邊界,
+      "top": 原始上邊界,
+      "right": 原始右邊界,
+      "bottom": 原始下邊界
+    },
+    "new_coords": {
+      "left": 新左邊界,
+      "top": 新上邊界,
+      "right": 新右邊界,
+      "bottom": 新下邊界
+    },
+    "scale_factor": 縮放比例,
+    "adjustment_reason": "調整原因說明",
+    "quality_check": "質量檢查結果",
+    "warnings": ["潛在問題警告"]
+  }
+]
+```"""
+
+# 緊湊輸出格式：只要求渲染必需的字段，其餘字段由圖層表回填
+COMPACT_OUTPUT_FORMAT = """請為每個圖層提供新的坐標，只輸出以下字段的JSON數組（不要輸出其他字段）：
+
+```json
+[{"id": 圖層ID, "new_coords": {"left": 新左邊界, "top": 新上邊界, "right": 新右邊界, "bottom": 新下邊界}}]
+```"""
+
+# 緊湊模式下檢測框圖像的最長邊（接近模型的有效輸入分辨率）與JPEG質量
+COMPACT_IMAGE_MAX_EDGE = int(os.environ.get("GEMINI_COMPACT_IMAGE_MAX_EDGE", 1024))
+COMPACT_IMAGE_JPEG_QUALITY = 85
+# 是否默認啟用緊湊模式
+DEFAULT_COMPACT_PAYLOAD = os.environ.get("GEMINI_COMPACT_PAYLOAD", "1") not in ("0", "false", "False")
+# 圖層數超過閾值時按圖層組/空間位置分簇，併發發送多個子請求
+CLUSTER_LAYER_THRESHOLD = int(os.environ.get("GEMINI_CLUSTER_THRESHOLD", 120))
+CLUSTER_MAX_LAYERS = int(os.environ.get("GEMINI_CLUSTER_MAX_LAYERS", 80))
+
+# Gemini按768×768切片計費，每片約258個token
+_IMAGE_TILE_SIZE = 768
+_IMAGE_TILE_TOKENS = 258
+
+
+class IncrementalJSONArrayParser:
+    """
+    增量JSON數組解析器
+
+    逐塊輸入模型的流式輸出，每當頂層數組中的一個對象完整閉合時即返回該對象，
+    無需等待整個響應結束。會跳過數組之前的說明文字或markdown代碼塊標記；
+    只有後面（跳過空白）緊跟 { 或 ] 的 [ 才作為數組開始，說明文字中的方括號會被忽略。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._finished = False
+        self._object_count = 0
+        self._object_start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._decoder = json.JSONDecoder()
+
+    @property
+    def finished(self) -> bool:
+        """是否已讀到頂層數組的結束符"""
+        return self._finished
+
+    @property
+    def object_count(self) -> int:
+        """已成功解析的對象數"""
+        return self._object_count
+
+    def feed(self, chunk: str) -> List[Any]:
+        """輸入一段文本，返回本次新完成的對象列表"""
+        if self._finished or not chunk:
+            return []
+
+        self._buffer += chunk
+        completed = []
+        buffer = self._buffer
+        pos = self._pos
+
+        while pos < len(buffer):
+            char = buffer[pos]
+
+            if not self._in_array:
+                if char == '[':
+                    after = pos + 1
+                    while after < len(buffer) and buffer[after].isspace():
+                        after += 1
+                    if after == len(buffer):
+                        # 還不知道 [ 後面是什麼，保留到下一塊再判斷
+                        break
+                    if buffer[after] in '{]':
+                        self._in_array = True
+                        pos = after
+                        continue
+                pos += 1
+                continue
+
+            if self._object_start < 0:
+                # 在對象之間：跳過空白和逗號，遇到 ] 表示數組結束
+                if char == '{':
+                    self._object_start = pos
+                    self._depth = 1
+                elif char == ']':
+                    self._finished = True
+                    pos += 1
+                    break
+                pos += 1
+                continue
+
+            # 在對象內部：跟蹤字符串和括號深度
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    text = buffer[self._object_start:pos + 1]
+                    try:
+                        obj, _ = self._decoder.raw_decode(text)
+                        completed.append(obj)
+                        self._object_count += 1
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"流式解析跳過無效對象: {e}: {text[:200]}")
+                    self._object_start = -1
+            pos += 1
+
+        # 丟棄已處理完的內容，只保留未閉合的對象
+        if self._object_start >= 0:
+            self._buffer = buffer[self._object_start:]
+            pos -= self._object_start
+            self._object_start = 0
+        else:
+            # 數組開始之前可能停在一個待判斷的 [ 上
+            self._buffer = buffer[pos:]
+            pos = 0
+        self._pos = pos
+
+        return completed
+
 
 class GeminiPSDResizeService:
     """Gemini PSD自動縮放服務類"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 provider: Union[str, LayoutProviderBase, None] = None):
         """
         初始化服務
         
         Args:
-            api_key: Gemini API密鑰，如果不提供則從環境變量或配置文件讀取
+            api_key: Gemini API密鑰，如果不提供則從環境變量或配置文件讀取（僅Gemini後端需要）
+            provider: 布局後端名稱（gemini / local / http）或實例，默認由 PSD_LAYOUT_PROVIDER 環境變量決定
         """
-        self.api_key = api_key or self._load_api_key_from_config()
-        if not self.api_key:
-            raise ValueError("需要提供Gemini API密鑰，通過參數、GEMINI_API_KEY環境變量或config.env文件")
-        
-        # 设置API密钥和初始化客户端
-        os.environ["GOOGLE_API_KEY"] = self.api_key
-        self.model_name = "gemini-2.5-pro"  # 使用Gemini 2.5 Pro模型
+        if isinstance(provider, LayoutProviderBase):
+            self.provider = provider
+            self.api_key = api_key or getattr(provider, "api_key", None)
+            return
         
-        # 初始化客户端
-        try:
-            # 尝试使用新版 google-genai SDK
-            self.client = genai.Client(api_key=self.api_key)
-            self.use_new_sdk = True
-            logger.info("使用 google-genai SDK (新版)")
-        except (AttributeError, TypeError):
-            # 回退到旧版 google-generativeai
-            genai.configure(api_key=self.api_key)
-            self.client = None
-            self.use_new_sdk = False
-            logger.info("使用 google-generativeai SDK (旧版)")
+        provider = provider or DEFAULT_LAYOUT_PROVIDER
+        self.api_key = None
+        if provider == "gemini":
+            self.api_key = api_key or self._load_api_key_from_config()
+            if not self.api_key:
+                raise ValueError("需要提供Gemini API密鑰，通過參數、GEMINI_API_KEY環境變量或config.env文件")
+            # 设置API密钥
+            os.environ["GOOGLE_API_KEY"] = self.api_key
+        self.provider = get_layout_provider(provider, api_key=self.api_key)
+        logger.info(f"PSD布局後端: {self.provider.name}")
+    
+    @property
+    def model_name(self) -> str:
+        """布局後端使用的模型（本地後端返回後端名稱）"""
+        return getattr(self.provider, "model_name", None) or getattr(self.provider, "model", None) or self.provider.name
+    
+    @property
+    def use_new_sdk(self) -> bool:
+        """Gemini後端是否使用新版SDK（google-genai）"""
+        return getattr(self.provider, "use_new_sdk", False)
     
     def _load_api_key_from_config(self) -> Optional[str]:
         """從配置文件加載API密鑰"""
@@ -88,7 +265,8 @@ class GeminiPSDResizeService:
                             original_width: int, 
                             original_height: int,
                             target_width: int, 
-                            target_height: int) -> str:
+                            target_height: int,
+                            compact: bool = False) -> str:
         """
         生成Gemini API調用的完整提示詞
         
@@ -98,13 +276,22 @@ class GeminiPSDResizeService:
             original_height: 原始高度
             target_width: 目標寬度
             target_height: 目標高度
+            compact: 緊湊模式，使用CSV圖層表並只要求輸出必要字段
             
         Returns:
             完整的提示詞字符串
         """
         
         # 格式化圖層信息為表格
-        layer_info_text = self._format_layers_info_table(layers_info)
+        if compact:
+            layer_info_text = self._format_layers_info_compact(layers_info)
+        else:
+            layer_info_text = self._format_layers_info_table(layers_info)
+        
+        if compact:
+            output_format_text = COMPACT_OUTPUT_FORMAT
+        else:
+            output_format_text = VERBOSE_OUTPUT_FORMAT
         
         prompt = f"""# PSD 圖層智能縮放任務
 
@@ -176,35 +363,7 @@ class GeminiPSDResizeService:
 
 ## 📋 輸出格式要求
 
-請為每個圖層提供新的坐標信息，使用以下JSON格式：
-
-```json
-[
-  {{
-    "id": 圖層ID,
-    "name": "圖層名稱",
-    "type": "圖層類型",
-    "level": 圖層層級,
-    "visible": true/false,
-    "original_coords": {{
-      "left": 原始左邊界,
-      "top": 原始上邊界,
-      "right": 原始右邊界,
-      "bottom": 原始下邊界
-    }},
-    "new_coords": {{
-      "left": 新左邊界,
-      "top": 新上邊界,
-      "right": 新右邊界,
-      "bottom": 新下邊界
-    }},
-    "scale_factor": 縮放比例,
-    "adjustment_reason": "調整原因說明",
-    "quality_check": "質量檢查結果",
-    "warnings": ["潛在問題警告"]
-  }}
-]
-```
+{output_format_text}
 
 ## ⚠️ 重要注意事項
 
@@ -247,108 +406,144 @@ class GeminiPSDResizeService:
             lines.append(line)
         
         return "\n".join(lines)
+
+    def _format_layers_info_compact(self, layers_info: List[Dict[str, Any]]) -> str:
+        """格式化圖層信息為緊湊CSV（寬高可由坐標推出，不再重複）"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["id", "level", "type", "name", "left", "top", "right", "bottom"])
+        for info in layers_info:
+            writer.writerow([
+                info['id'], info.get('level', 0), info['type'], info['name'],
+                info['left'], info['top'], info['right'], info['bottom']
+            ])
+        return buffer.getvalue().rstrip("\n")
+    
+    def _filter_layers_for_prompt(self, layers_info: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """去掉隱藏圖層和零面積圖層（渲染時本來就會跳過）"""
+        return [
+            info for info in layers_info
+            if info.get('visible', True) and info.get('width', 0) > 0 and info.get('height', 0) > 0
+        ]
+    
+    def _prepare_detection_image(self, detection_image_path: str, compact: bool) -> Tuple[bytes, str]:
+        """
+        讀取檢測框圖像
+        
+        緊湊模式下縮小到模型的有效分辨率並轉為JPEG，返回 (圖像字節, MIME類型)
+        """
+        with open(detection_image_path, 'rb') as f:
+            image_data = f.read()
+        if not compact:
+            return image_data, "image/png"
+        
+        from PIL import Image
+        
+        with Image.open(io.BytesIO(image_data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((COMPACT_IMAGE_MAX_EDGE, COMPACT_IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=COMPACT_IMAGE_JPEG_QUALITY, optimize=True)
+            size = image.size
+        
+        logger.info(f"檢測框圖像已壓縮: {len(image_data)} -> {output.tell()} 字節, 尺寸 {size[0]}x{size[1]}")
+        return output.getvalue(), "image/jpeg"
+    
+    def _log_payload_stats(self, prompt: str, image_data: bytes, mime_type: str,
+                           layers_count: int, sent_layers_count: int) -> None:
+        """記錄每次請求的字節數和估算token數"""
+        prompt_bytes = len(prompt.encode('utf-8'))
+        image_tokens = _IMAGE_TILE_TOKENS
+        try:
+            from PIL import Image
+            with Image.open(io.BytesIO(image_data)) as image:
+                width, height = image.size
+            tiles = max(1, -(-width // _IMAGE_TILE_SIZE)) * max(1, -(-height // _IMAGE_TILE_SIZE))
+            image_tokens = tiles * _IMAGE_TILE_TOKENS
+        except Exception:
+            pass
+        # 中英混合文本粗略按每3個字符1個token估算
+        text_tokens = len(prompt) // 3
+        logger.info(
+            f"Gemini請求負載: 圖層 {sent_layers_count}/{layers_count}, "
+            f"提示詞 {prompt_bytes} 字節 (約 {text_tokens} tokens), "
+            f"圖像 {len(image_data)} 字節 {mime_type} (約 {image_tokens} tokens), "
+            f"base64後總計約 {prompt_bytes + len(image_data) * 4 // 3} 字節"
+        )
+    
+    def _merge_layer_fields(self,
+                            new_positions: List[Dict[str, Any]],
+                            layers_info: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """用原始圖層信息回填模型未輸出的字段（緊湊模式下只返回id和new_coords）"""
+        layers_by_id = {info['id']: info for info in layers_info}
+        for item in new_positions:
+            info = layers_by_id.get(item.get('id'))
+            if info is None:
+                continue
+            item.setdefault('name', info['name'])
+            item.setdefault('type', info['type'])
+            item.setdefault('level', info.get('level', 0))
+            item.setdefault('visible', info.get('visible', True))
+            item.setdefault('original_coords', {
+                'left': info['left'],
+                'top': info['top'],
+                'right': info['right'],
+                'bottom': info['bottom'],
+            })
+        return new_positions
+    
+    async def call_layout_api(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        """
+        調用布局後端，返回模型輸出的原始文本
+        
+        Args:
+            request: 布局請求（提示詞、檢測框圖像、本次需要布局的圖層及畫布尺寸）
+            max_retries: 可重試錯誤的最大嘗試次數
+        """
+        start = time.perf_counter()
+        response_text = await self.provider.complete(request, max_retries)
+        logger.info(f"布局後端 {self.provider.name} 返回 {len(request.layers)} 個圖層的布局, "
+                    f"耗時 {time.perf_counter() - start:.2f}秒")
+        return response_text
     
-    async def call_gemini_api(self, 
-                            prompt: str, 
-                            image_base64: str,
-                            temperature: float = 0.1,
-                            max_tokens: int = 32000,
-                            max_retries: int = 3) -> str:
+    async def call_gemini_api(self,
+                              prompt: str,
+                              image_base64: str,
+                              temperature: float = 0.1,
+                              max_tokens: int = 32000,
+                              max_retries: int = 3) -> str:
         """
-        調用Gemini API（带重试机制）
+        以單個提示詞和base64圖像調用布局後端（兼容舊接口，供連接測試腳本使用）
         
         Args:
             prompt: 提示詞
-            image_base64: 圖像的base64編碼
+            image_base64: 圖像的base64編碼（PNG或JPEG）
             temperature: 溫度參數
             max_tokens: 最大輸出token數
-            max_retries: 最大重试次数（针对配额错误）
-            
-        Returns:
-            API響應文本
+            max_retries: 可重試錯誤的最大嘗試次數
+        """
+        image_data = base64.b64decode(image_base64)
+        mime_type = "image/jpeg" if image_data[:2] == b"\xff\xd8" else "image/png"
+        # 不涉及具體圖層和畫布，只驗證後端可用
+        return await self.call_layout_api(LayoutRequest(
+            prompt=prompt,
+            image_data=image_data,
+            mime_type=mime_type,
+            layers=[],
+            original_size=(0, 0),
+            target_size=(0, 0),
+            temperature=temperature,
+            max_tokens=max_tokens,
+        ), max_retries)
+    
+    async def call_layout_api_stream(self, request: LayoutRequest, max_retries: int = 3) -> AsyncIterator[str]:
         """
-        import time
-        import asyncio
+        流式調用布局後端，逐塊返回響應文本
         
-        for attempt in range(max_retries):
-            try:
-                import base64
-                from PIL import Image
-                from io import BytesIO
-                
-                # 準備圖像數據
-                image_data = base64.b64decode(image_base64)
-                image = Image.open(BytesIO(image_data))
-                
-                if self.use_new_sdk and self.client:
-                    # 使用新版 google-genai SDK
-                    logger.info("使用新版SDK調用Gemini API")
-                    
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=[prompt, image],
-                        config=types.GenerateContentConfig(
-                            temperature=temperature,
-                            max_output_tokens=max_tokens,
-                            response_modalities=["Text"]
-                        )
-                    )
-                    
-                    # 提取响应文本
-                    return response.candidates[0].content.parts[0].text
-                else:
-                    # 使用旧版 google-generativeai SDK
-                    logger.info("使用旧版SDK調用Gemini API")
-                    
-                    model = genai.GenerativeModel(self.model_name)
-                    
-                    # 生成內容
-                    response = model.generate_content(
-                        [prompt, image],
-                        generation_config={
-                            "temperature": temperature,
-                            "max_output_tokens": max_tokens,
-                        }
-                    )
-                    
-                    return response.text
-                
-            except Exception as e:
-                error_str = str(e)
-                error_type = type(e).__name__
-                
-                # 检查是否是配额错误
-                is_quota_error = (
-                    '429' in error_str or 
-                    'RESOURCE_EXHAUSTED' in error_str or
-                    'quota' in error_str.lower() or
-                    'rate limit' in error_str.lower()
-                )
-                
-                if is_quota_error and attempt < max_retries - 1:
-                    # 指数退避重试
-                    wait_time = (2 ** attempt) * 5  # 5秒, 10秒, 20秒...
-                    logger.warning(f"配额限制错误，{wait_time}秒后进行第{attempt + 2}次重试...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                
-                # 记录详细错误信息
-                logger.error(f"Gemini API調用失敗: {e}")
-                logger.error(f"错误详情: {error_type}: {error_str}")
-                
-                # 提供更友好的错误消息
-                if is_quota_error:
-                    raise Exception(
-                        f"Gemini API 配额已用尽。\n"
-                        f"免费配额限制：每分钟 15 次，每天 1,500 次。\n"
-                        f"解决方案：\n"
-                        f"1. 等待一段时间后重试\n"
-                        f"2. 访问 https://ai.dev/usage?tab=rate-limit 查看配额使用情况\n"
-                        f"3. 考虑升级到付费计划以获得更高配额\n"
-                        f"原始错误: {error_str}"
-                    )
-                
-                raise
+        不支持流式的後端一次性返回完整響應
+        """
+        async for chunk in self.provider.stream(request, max_retries):
+            yield chunk
     
     def parse_gemini_response(self, response_text: str) -> List[Dict[str, Any]]:
         """
@@ -405,7 +600,9 @@ class GeminiPSDResizeService:
                               original_width: int,
                               original_height: int,
                               target_width: int,
-                              target_height: int) -> List[Dict[str, Any]]:
+                              target_height: int,
+                              priority: int = PRIORITY_NORMAL,
+                              compact: Optional[bool] = None) -> List[Dict[str, Any]]:
         """
         完整的PSD圖層縮放流程
         
@@ -416,27 +613,44 @@ class GeminiPSDResizeService:
             original_height: 原始高度
             target_width: 目標寬度
             target_height: 目標高度
+            priority: 限流隊列中的優先級
+            compact: 是否使用緊湊負載（縮小JPEG檢測圖、CSV圖層表、去掉隱藏和零面積圖層），
+                默認由 GEMINI_COMPACT_PAYLOAD 環境變量決定
             
         Returns:
             調整後的圖層信息列表
         """
         try:
-            # 生成提示詞
-            prompt = self.generate_resize_prompt(
-                layers_info, original_width, original_height, 
-                target_width, target_height
-            )
+            if self._should_cluster(layers_info, compact):
+                new_positions = await self._resize_in_clusters(
+                    layers_info, detection_image_path, original_width, original_height,
+                    target_width, target_height, priority, compact
+                )
+                logger.info(f"成功生成 {len(new_positions)} 個圖層的調整方案")
+                return new_positions
             
-            # 讀取檢測框圖像並轉換為base64
-            with open(detection_image_path, 'rb') as f:
-                image_data = f.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            request = await self._prepare_request(
+                layers_info, detection_image_path, original_width, original_height,
+                target_width, target_height, compact, priority
+            )
             
-            # 調用Gemini API
-            response_text = await self.call_gemini_api(prompt, image_base64)
+            # 調用布局後端
+            response_text = await self.call_layout_api(request)
             
             # 解析響應
             new_positions = self.parse_gemini_response(response_text)
+            new_positions = self._merge_layer_fields(new_positions, layers_info)
+            
+            # 校驗並在本地修復，只有無法修復的圖層才重新詢問模型
+            validation = validate_layout(
+                new_positions, layers_info, original_width, original_height,
+                target_width, target_height
+            )
+            new_positions = await self._retry_unresolved_layers(
+                validation.positions, validation.unresolved_ids, layers_info,
+                request.image_data, request.mime_type, original_width, original_height,
+                target_width, target_height, priority, compact
+            )
             
             logger.info(f"成功生成 {len(new_positions)} 個圖層的調整方案")
             return new_positions
@@ -444,6 +658,358 @@ class GeminiPSDResizeService:
         except Exception as e:
             logger.error(f"PSD圖層縮放失敗: {e}")
             raise
+    
+    async def stream_resize_psd_layers(self,
+                                       layers_info: List[Dict[str, Any]],
+                                       detection_image_path: str,
+                                       original_width: int,
+                                       original_height: int,
+                                       target_width: int,
+                                       target_height: int,
+                                       priority: int = PRIORITY_NORMAL,
+                                       compact: Optional[bool] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式PSD圖層縮放流程：模型每輸出一個完整的圖層對象就立即返回
+        
+        參數與resize_psd_layers相同。流式解析失敗時（例如模型沒有按數組格式輸出）
+        會回退到parse_gemini_response解析完整文本，只返回尚未輸出過的圖層。
+        圖層數量達到分簇閾值時改為分簇請求，全部完成後再逐個返回。
+        
+        Yields:
+            單個圖層的調整信息
+        """
+        if self._should_cluster(layers_info, compact):
+            # 分簇請求需要合併後統一消除跨簇重疊，整體完成後再逐個返回
+            for item in await self.resize_psd_layers(
+                layers_info, detection_image_path, original_width, original_height,
+                target_width, target_height, priority=priority, compact=compact
+            ):
+                yield item
+            return
+        
+        request = await self._prepare_request(
+            layers_info, detection_image_path, original_width, original_height,
+            target_width, target_height, compact, priority
+        )
+        
+        parser = IncrementalJSONArrayParser()
+        chunks: List[str] = []
+        emitted: Dict[int, Dict[str, Any]] = {}
+        unresolved_ids = set()
+        
+        def prepare(items: List[Any]) -> List[Dict[str, Any]]:
+            items = [
+                item for item in items
+                if isinstance(item, dict) and item.get('id') not in emitted and item.get('id') not in unresolved_ids
+            ]
+            items = self._merge_layer_fields(items, layers_info)
+            # 逐個校驗: 可修復的立即返回，無法修復的留到最後統一重新詢問
+            validation = validate_layout(
+                items, layers_info, original_width, original_height,
+                target_width, target_height, fill_missing=False
+            )
+            unresolved_ids.update(validation.unresolved_ids)
+            ready = [item for item in validation.positions if item['id'] not in unresolved_ids]
+            emitted.update((item['id'], item) for item in ready)
+            return ready
+        
+        async for chunk in self.call_layout_api_stream(request):
+            chunks.append(chunk)
+            for item in prepare(parser.feed(chunk)):
+                yield item
+        
+        if not parser.finished or parser.object_count == 0:
+            logger.warning("流式解析未讀到完整的JSON數組或數組為空，回退到完整解析")
+            for item in prepare(self.parse_gemini_response("".join(chunks))):
+                yield item
+        
+        # 補全缺失圖層，並為無法修復的圖層重新詢問一次模型
+        validation = validate_layout(
+            list(emitted.values()), layers_info, original_width, original_height,
+            target_width, target_height
+        )
+        remaining = [item for item in validation.positions if item['id'] not in emitted]
+        remaining = await self._retry_unresolved_layers(
+            remaining, sorted(unresolved_ids), layers_info,
+            request.image_data, request.mime_type, original_width, original_height,
+            target_width, target_height, priority, compact
+        )
+        for item in remaining:
+            yield item
+        
+        logger.info(f"流式生成 {len(emitted) + len(remaining)} 個圖層的調整方案")
+    
+    async def _retry_unresolved_layers(self,
+                                       positions: List[Dict[str, Any]],
+                                       unresolved_ids: List[int],
+                                       layers_info: List[Dict[str, Any]],
+                                       image_data: bytes,
+                                       mime_type: str,
+                                       original_width: int,
+                                       original_height: int,
+                                       target_width: int,
+                                       target_height: int,
+                                       priority: int,
+                                       compact: Optional[bool]) -> List[Dict[str, Any]]:
+        """
+        只針對本地無法修復的圖層重新詢問模型一次
+        
+        positions中這些圖層已有按比例縮放的兜底坐標；重新生成失敗或結果仍然無效時保留兜底坐標。
+        """
+        if compact is None:
+            compact = DEFAULT_COMPACT_PAYLOAD
+        
+        # 隱藏和零面積圖層不會被渲染，無需重新生成
+        retry_layers = self._filter_layers_for_prompt(
+            [info for info in layers_info if info['id'] in set(unresolved_ids)]
+        )
+        if not retry_layers:
+            return positions
+        
+        logger.info(f"重新生成 {len(retry_layers)} 個無法修復的圖層: {[info['id'] for info in retry_layers]}")
+        retry_ids = {info['id'] for info in retry_layers}
+        placed_layers = [
+            {**item, **item['new_coords']} for item in positions
+            if item['id'] not in retry_ids and item.get('visible', True)
+        ]
+        prompt = self.generate_resize_prompt(
+            retry_layers, original_width, original_height,
+            target_width, target_height, compact=compact
+        )
+        if placed_layers:
+            prompt += (
+                "\n\n## 📌 已確定的圖層位置（目標畫布坐標，請避免與之衝突，只輸出上面列出的圖層）\n```\n"
+                + self._format_layers_info_compact(placed_layers)
+                + "\n```"
+            )
+        
+        try:
+            response_text = await self.call_layout_api(LayoutRequest(
+                prompt=prompt,
+                image_data=image_data,
+                mime_type=mime_type,
+                layers=retry_layers,
+                original_size=(original_width, original_height),
+                target_size=(target_width, target_height),
+                priority=priority,
+            ))
+            retried = self._merge_layer_fields(self.parse_gemini_response(response_text), retry_layers)
+        except Exception as e:
+            logger.warning(f"重新生成圖層失敗，使用按比例縮放的坐標: {e}")
+            return positions
+        
+        validation = validate_layout(
+            retried, retry_layers, original_width, original_height,
+            target_width, target_height, fill_missing=False
+        )
+        fixed = {
+            item['id']: item for item in validation.positions
+            if item['id'] not in validation.unresolved_ids
+        }
+        logger.info(f"重新生成成功 {len(fixed)}/{len(retry_layers)} 個圖層")
+        return [fixed.get(item['id'], item) for item in positions]
+    
+    def _should_cluster(self, layers_info: List[Dict[str, Any]], compact: Optional[bool]) -> bool:
+        if compact is None:
+            compact = DEFAULT_COMPACT_PAYLOAD
+        prompt_layers = self._filter_layers_for_prompt(layers_info) if compact else layers_info
+        return len(prompt_layers) > CLUSTER_LAYER_THRESHOLD
+    
+    def _cluster_layers(self, layers_info: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        將圖層表分簇
+        
+        以頂層圖層（及其子圖層）為單位，按空間位置（自上而下、自左而右）排序後
+        貪心裝箱到不超過CLUSTER_MAX_LAYERS的簇中；單個圖層組超過上限時按空間位置切分。
+        """
+        # 按DFS順序切分頂層子樹
+        subtrees: List[List[Dict[str, Any]]] = []
+        for info in layers_info:
+            if info.get('level', 0) == 0 or not subtrees:
+                subtrees.append([])
+            subtrees[-1].append(info)
+        
+        def center_key(layers: List[Dict[str, Any]]) -> Tuple[float, float]:
+            top = min(info['top'] for info in layers)
+            bottom = max(info['bottom'] for info in layers)
+            left = min(info['left'] for info in layers)
+            right = max(info['right'] for info in layers)
+            return (top + bottom) / 2, (left + right) / 2
+        
+        units: List[List[Dict[str, Any]]] = []
+        for subtree in subtrees:
+            if len(subtree) <= CLUSTER_MAX_LAYERS:
+                units.append(subtree)
+                continue
+            # 過大的圖層組按空間位置切分
+            ordered = sorted(subtree, key=lambda info: center_key([info]))
+            for start in range(0, len(ordered), CLUSTER_MAX_LAYERS):
+                units.append(ordered[start:start + CLUSTER_MAX_LAYERS])
+        
+        units.sort(key=center_key)
+        clusters: List[List[Dict[str, Any]]] = []
+        for unit in units:
+            if clusters and len(clusters[-1]) + len(unit) <= CLUSTER_MAX_LAYERS:
+                clusters[-1].extend(unit)
+            else:
+                clusters.append(list(unit))
+        
+        # 簇內保持原始圖層順序
+        order = {info['id']: index for index, info in enumerate(layers_info)}
+        for cluster in clusters:
+            cluster.sort(key=lambda info: order[info['id']])
+        return clusters
+    
+    def _format_cluster_context(self,
+                                clusters: List[List[Dict[str, Any]]],
+                                index: int,
+                                layers_info: List[Dict[str, Any]]) -> str:
+        """生成所有子請求共享的全局上下文：頂層結構及各簇的原始範圍"""
+        lines = [
+            "\n\n## 🧩 分塊任務說明",
+            f"圖層較多，本任務被拆分為 {len(clusters)} 個子任務併發處理，當前為第 {index + 1} 個。",
+            "只輸出本任務圖層表中的圖層；請參考下面的全局結構，保持與其他子任務圖層的相對位置，避免互相重疊。",
+            "\n### 各子任務在原始畫布中的範圍 (left, top, right, bottom)",
+        ]
+        for cluster_index, cluster in enumerate(clusters):
+            bounds = (
+                min(info['left'] for info in cluster), min(info['top'] for info in cluster),
+                max(info['right'] for info in cluster), max(info['bottom'] for info in cluster)
+            )
+            marker = " ← 當前" if cluster_index == index else ""
+            lines.append(f"- 子任務{cluster_index + 1}: {len(cluster)} 個圖層, {bounds}{marker}")
+        
+        top_level = [info for info in layers_info if info.get('level', 0) == 0]
+        lines.append("\n### 頂層圖層（全局結構）\n```")
+        lines.append(self._format_layers_info_compact(top_level))
+        lines.append("```")
+        return "\n".join(lines)
+    
+    async def _resize_in_clusters(self,
+                                  layers_info: List[Dict[str, Any]],
+                                  detection_image_path: str,
+                                  original_width: int,
+                                  original_height: int,
+                                  target_width: int,
+                                  target_height: int,
+                                  priority: int,
+                                  compact: Optional[bool]) -> List[Dict[str, Any]]:
+        """
+        分簇併發生成布局
+        
+        每個簇一個子請求（共享檢測框圖像和全局上下文），併發數由全局限流器控制；
+        失敗的簇單獨重試一次，仍失敗的簇由本地校驗按比例縮放兜底，最後消除跨簇重疊。
+        """
+        if compact is None:
+            compact = DEFAULT_COMPACT_PAYLOAD
+        prompt_layers = self._filter_layers_for_prompt(layers_info) if compact else layers_info
+        clusters = self._cluster_layers(prompt_layers)
+        logger.info(f"圖層數 {len(prompt_layers)} 超過分簇閾值，拆分為 {len(clusters)} 個子請求: "
+                    f"{[len(cluster) for cluster in clusters]}")
+        
+        image_data, mime_type = await asyncio.to_thread(
+            self._prepare_detection_image, detection_image_path, compact
+        )
+        prompts = []
+        for index, cluster in enumerate(clusters):
+            prompt = self.generate_resize_prompt(
+                cluster, original_width, original_height,
+                target_width, target_height, compact=compact
+            ) + self._format_cluster_context(clusters, index, prompt_layers)
+            self._log_payload_stats(prompt, image_data, mime_type, len(layers_info), len(cluster))
+            prompts.append(prompt)
+        
+        async def run_cluster(index: int) -> List[Dict[str, Any]]:
+            response_text = await self.call_layout_api(LayoutRequest(
+                prompt=prompts[index],
+                image_data=image_data,
+                mime_type=mime_type,
+                layers=clusters[index],
+                original_size=(original_width, original_height),
+                target_size=(target_width, target_height),
+                priority=priority,
+            ))
+            items = self.parse_gemini_response(response_text)
+            cluster_ids = {info['id'] for info in clusters[index]}
+            items = [item for item in items if isinstance(item, dict) and item.get('id') in cluster_ids]
+            return self._merge_layer_fields(items, clusters[index])
+        
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        pending = list(range(len(clusters)))
+        for attempt in range(2):
+            outcomes = await asyncio.gather(*(run_cluster(index) for index in pending), return_exceptions=True)
+            failed = []
+            for index, outcome in zip(pending, outcomes):
+                if isinstance(outcome, BaseException):
+                    logger.warning(f"子請求 {index + 1}/{len(clusters)} 失敗（第{attempt + 1}次）: {outcome}")
+                    failed.append(index)
+                else:
+                    results[index] = outcome
+            pending = failed
+            if not pending:
+                break
+        
+        if len(results) == 0:
+            raise Exception("所有分簇子請求均失敗")
+        if pending:
+            logger.warning(f"{len(pending)} 個子請求重試後仍失敗，對應圖層按比例縮放")
+        
+        new_positions = [item for index in sorted(results) for item in results[index]]
+        validation = validate_layout(
+            new_positions, layers_info, original_width, original_height,
+            target_width, target_height
+        )
+        positions = await self._retry_unresolved_layers(
+            validation.positions, validation.unresolved_ids, layers_info,
+            image_data, mime_type, original_width, original_height,
+            target_width, target_height, priority, compact
+        )
+        
+        cluster_of = {
+            info['id']: index for index, cluster in enumerate(clusters) for info in cluster
+        }
+        resolve_cross_cluster_overlaps(
+            positions, cluster_of, layers_info, original_width, original_height,
+            target_width, target_height
+        )
+        return positions
+    
+    async def _prepare_request(self,
+                               layers_info: List[Dict[str, Any]],
+                               detection_image_path: str,
+                               original_width: int,
+                               original_height: int,
+                               target_width: int,
+                               target_height: int,
+                               compact: Optional[bool],
+                               priority: int = PRIORITY_NORMAL) -> LayoutRequest:
+        """生成提示詞並準備檢測框圖像"""
+        if compact is None:
+            compact = DEFAULT_COMPACT_PAYLOAD
+        
+        prompt_layers = self._filter_layers_for_prompt(layers_info) if compact else layers_info
+        
+        # 生成提示詞
+        prompt = self.generate_resize_prompt(
+            prompt_layers, original_width, original_height, 
+            target_width, target_height, compact=compact
+        )
+        
+        # 讀取檢測框圖像
+        image_data, mime_type = await asyncio.to_thread(
+            self._prepare_detection_image, detection_image_path, compact
+        )
+        self._log_payload_stats(prompt, image_data, mime_type, len(layers_info), len(prompt_layers))
+        
+        return LayoutRequest(
+            prompt=prompt,
+            image_data=image_data,
+            mime_type=mime_type,
+            layers=prompt_layers,
+            original_size=(original_width, original_height),
+            target_size=(target_width, target_height),
+            priority=priority,
+        )
 
 
 # 使用示例
@@ -520,6 +1086,5 @@ async def example_usage():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(example_usage())
 
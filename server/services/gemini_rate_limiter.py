@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Gemini API 全局限流器
+進程內共享的令牌桶（RPM / RPD）+ 併發上限 + 優先級等待隊列
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 免費配額默認值：每分鐘 15 次，每天 1,500 次
+DEFAULT_GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 15))
+DEFAULT_GEMINI_RPD = int(os.environ.get("GEMINI_RPD", 1500))
+DEFAULT_GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4))
+
+# 優先級：數值越小越先執行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BATCH = 20
+
+
+class _TokenBucket:
+    """簡單令牌桶，按固定速率回填"""
+
+    def __init__(self, capacity: int, period_seconds: float):
+        self.capacity = max(1, capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until_available(self) -> float:
+        """距離下一個可用令牌的秒數，0 表示立即可用"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+
+class GeminiRateLimiter:
+    """
+    Gemini 請求限流器
+
+    - 每分鐘/每天兩個令牌桶，與配置的 RPM / RPD 一致
+    - 同時進行中的請求數受 max_concurrency 限制
+    - 等待中的請求按 (priority, 到達順序) 出隊
+    """
+
+    def __init__(self,
+                 rpm: int = DEFAULT_GEMINI_RPM,
+                 rpd: int = DEFAULT_GEMINI_RPD,
+                 max_concurrency: int = DEFAULT_GEMINI_MAX_CONCURRENCY):
+        self.configure(rpm, rpd, max_concurrency)
+        self._waiters: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._active = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def configure(self, rpm: int, rpd: int, max_concurrency: int) -> None:
+        """重新配置限額（例如批處理工具按賬號配額調整）"""
+        self.rpm = rpm
+        self.rpd = rpd
+        self.max_concurrency = max(1, max_concurrency)
+        self._minute_bucket = _TokenBucket(rpm, 60)
+        self._day_bucket = _TokenBucket(rpd, 86400)
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _time_until_available(self) -> float:
+        return max(
+            self._minute_bucket.time_until_available(),
+            self._day_bucket.time_until_available()
+        )
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        """等待直到輪到本請求且配額可用"""
+        condition = self._get_condition()
+        entry = (priority, next(self._counter))
+
+        async with condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiters[0] == entry and self._active < self.max_concurrency:
+                        timeout = self._time_until_available()
+                        if timeout <= 0:
+                            heapq.heappop(self._waiters)
+                            self._minute_bucket.consume()
+                            self._day_bucket.consume()
+                            self._active += 1
+                            # 喚醒下一個排隊者重新檢查
+                            condition.notify_all()
+                            return
+                        logger.info(f"Gemini 配額暫不可用，{timeout:.1f}秒後重試 (等待隊列: {len(self._waiters)})")
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                # 取消/超時時移出隊列，避免阻塞後續請求
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    condition.notify_all()
+                raise
+
+    async def release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self._active = max(0, self._active - 1)
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL):
+        """佔用一個請求名額: async with gemini_rate_limiter.slot(): ..."""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def get_status(self) -> dict:
+        return {
+            "rpm": self.rpm,
+            "rpd": self.rpd,
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "waiting": len(self._waiters),
+        }
+
+
+# 全局实例
+gemini_rate_limiter = GeminiRateLimiter()
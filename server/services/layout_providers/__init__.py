@@ -0,0 +1,56 @@
+# PSD resize layout providers
+import os
+from typing import Optional
+
+from .layout_base_provider import LayoutProviderBase, LayoutRequest
+from .gemini_provider import GeminiLayoutProvider, GEMINI_MODEL_NAME
+from .local_solver_provider import LocalSolverLayoutProvider
+from .openai_compatible_provider import OpenAICompatibleLayoutProvider
+
+# gemini: Google Gemini；local: 本地等比縮放；http: OpenAI兼容接口（如本地模擬服務）
+LAYOUT_PROVIDERS = ("gemini", "local", "http")
+DEFAULT_LAYOUT_PROVIDER = os.environ.get("PSD_LAYOUT_PROVIDER", "gemini")
+
+# 無狀態或需要共享連接池的後端全局復用
+_shared_providers = {}
+
+
+def get_layout_provider(name: Optional[str] = None, api_key: Optional[str] = None) -> LayoutProviderBase:
+    """按名稱創建布局後端，默認由 PSD_LAYOUT_PROVIDER 環境變量決定"""
+    name = name or DEFAULT_LAYOUT_PROVIDER
+    if name == "gemini":
+        if not api_key:
+            raise ValueError("Gemini布局後端需要API密鑰")
+        return GeminiLayoutProvider(api_key)
+    if name == "local":
+        return _shared_providers.setdefault(name, LocalSolverLayoutProvider())
+    if name == "http":
+        if name not in _shared_providers:
+            _shared_providers[name] = OpenAICompatibleLayoutProvider()
+        return _shared_providers[name]
+    raise ValueError(f"不支持的布局後端: {name}，可選: {', '.join(LAYOUT_PROVIDERS)}")
+
+
+def layout_engine_id(name: Optional[str] = None) -> str:
+    """標識布局引擎（後端及模型），用於結果去重的鍵"""
+    name = name or DEFAULT_LAYOUT_PROVIDER
+    if name == "gemini":
+        return f"gemini:{GEMINI_MODEL_NAME}"
+    if name == "http":
+        provider = get_layout_provider(name)
+        return f"http:{provider.url}:{provider.model}"
+    return name
+
+
+__all__ = [
+    "LayoutProviderBase",
+    "LayoutRequest",
+    "GeminiLayoutProvider",
+    "LocalSolverLayoutProvider",
+    "OpenAICompatibleLayoutProvider",
+    "GEMINI_MODEL_NAME",
+    "LAYOUT_PROVIDERS",
+    "DEFAULT_LAYOUT_PROVIDER",
+    "get_layout_provider",
+    "layout_engine_id",
+]
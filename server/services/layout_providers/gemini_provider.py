@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Gemini布局後端
+請求經過全局限流器排隊，使用異步客戶端（舊版SDK則在專用線程池中執行），不會阻塞事件循環
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import AsyncIterator
+
+try:
+    from google import genai
+    from google.genai import types
+except ImportError:
+    import google.generativeai as genai
+    types = None
+
+from services.gemini_rate_limiter import gemini_rate_limiter, DEFAULT_GEMINI_MAX_CONCURRENCY
+from .layout_base_provider import LayoutProviderBase, LayoutRequest
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAME = "gemini-2.5-pro"
+
+# 舊版SDK只有同步接口，使用專用線程池避免佔用默認線程池
+_GEMINI_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DEFAULT_GEMINI_MAX_CONCURRENCY,
+    thread_name_prefix="gemini"
+)
+
+
+class GeminiLayoutProvider(LayoutProviderBase):
+    """Gemini布局後端"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = GEMINI_MODEL_NAME):
+        self.api_key = api_key
+        self.model_name = model_name
+
+        # 初始化客户端
+        try:
+            # 尝试使用新版 google-genai SDK
+            self.client = genai.Client(api_key=self.api_key)
+            self.use_new_sdk = True
+            logger.info("使用 google-genai SDK (新版)")
+        except (AttributeError, TypeError):
+            # 回退到旧版 google-generativeai
+            genai.configure(api_key=self.api_key)
+            self.client = None
+            self.use_new_sdk = False
+            logger.info("使用 google-generativeai SDK (旧版)")
+
+    def _generate_config(self, request: LayoutRequest):
+        return types.GenerateContentConfig(
+            temperature=request.temperature,
+            max_output_tokens=request.max_tokens,
+            response_modalities=["Text"]
+        )
+
+    async def complete(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        """調用Gemini API（配額錯誤時指數退避重試）"""
+        legacy_image = None
+
+        for attempt in range(max_retries):
+            try:
+                async with gemini_rate_limiter.slot(request.priority):
+                    if self.use_new_sdk and self.client:
+                        # 使用新版 google-genai SDK 的異步客戶端
+                        logger.info("使用新版SDK調用Gemini API")
+
+                        response = await self.client.aio.models.generate_content(
+                            model=self.model_name,
+                            contents=[
+                                request.prompt,
+                                types.Part.from_bytes(data=request.image_data, mime_type=request.mime_type)
+                            ],
+                            config=self._generate_config(request)
+                        )
+
+                        usage = getattr(response, 'usage_metadata', None)
+                        if usage is not None:
+                            logger.info(
+                                f"Gemini token用量: 輸入 {getattr(usage, 'prompt_token_count', None)}, "
+                                f"輸出 {getattr(usage, 'candidates_token_count', None)}"
+                            )
+
+                        # 提取响应文本
+                        return response.candidates[0].content.parts[0].text
+                    else:
+                        # 使用旧版 google-generativeai SDK（同步接口，放到專用線程池）
+                        logger.info("使用旧版SDK調用Gemini API")
+
+                        if legacy_image is None:
+                            from PIL import Image
+                            legacy_image = Image.open(BytesIO(request.image_data))
+                            legacy_image.load()
+
+                        model = genai.GenerativeModel(self.model_name)
+                        loop = asyncio.get_running_loop()
+
+                        # 生成內容
+                        response = await loop.run_in_executor(
+                            _GEMINI_EXECUTOR,
+                            functools.partial(
+                                model.generate_content,
+                                [request.prompt, legacy_image],
+                                generation_config={
+                                    "temperature": request.temperature,
+                                    "max_output_tokens": request.max_tokens,
+                                }
+                            )
+                        )
+
+                        return response.text
+
+            except Exception as e:
+                if await self._handle_api_error(e, attempt, max_retries):
+                    continue
+                raise
+
+    async def stream(self, request: LayoutRequest, max_retries: int = 3) -> AsyncIterator[str]:
+        """
+        流式調用Gemini API，逐塊返回響應文本
+
+        只有在尚未收到任何輸出時才會對配額錯誤進行重試；舊版SDK不支持異步流式接口，
+        退化為一次性返回完整響應。
+        """
+        if not (self.use_new_sdk and self.client):
+            yield await self.complete(request, max_retries)
+            return
+
+        for attempt in range(max_retries):
+            received_any = False
+            try:
+                async with gemini_rate_limiter.slot(request.priority):
+                    logger.info("使用新版SDK流式調用Gemini API")
+
+                    stream = await self.client.aio.models.generate_content_stream(
+                        model=self.model_name,
+                        contents=[
+                            request.prompt,
+                            types.Part.from_bytes(data=request.image_data, mime_type=request.mime_type)
+                        ],
+                        config=self._generate_config(request)
+                    )
+                    async for chunk in stream:
+                        if chunk.text:
+                            received_any = True
+                            yield chunk.text
+                    return
+
+            except Exception as e:
+                if not received_any and await self._handle_api_error(e, attempt, max_retries):
+                    continue
+                raise
+
+    async def _handle_api_error(self, e: Exception, attempt: int, max_retries: int) -> bool:
+        """
+        處理API錯誤：配额错误时指数退避并返回True表示重试，否则抛出友好的异常或返回False
+        """
+        error_str = str(e)
+        error_type = type(e).__name__
+
+        # 检查是否是配额错误
+        is_quota_error = (
+            '429' in error_str or
+            'RESOURCE_EXHAUSTED' in error_str or
+            'quota' in error_str.lower() or
+            'rate limit' in error_str.lower()
+        )
+
+        if is_quota_error and attempt < max_retries - 1:
+            # 指数退避重试（等待期間不佔用限流名額）
+            wait_time = (2 ** attempt) * 5  # 5秒, 10秒, 20秒...
+            logger.warning(f"配额限制错误，{wait_time}秒后进行第{attempt + 2}次重试...")
+            await asyncio.sleep(wait_time)
+            return True
+
+        # 记录详细错误信息
+        logger.error(f"Gemini API調用失敗: {e}")
+        logger.error(f"错误详情: {error_type}: {error_str}")
+
+        # 提供更友好的错误消息
+        if is_quota_error:
+            raise Exception(
+                f"Gemini API 配额已用尽。\n"
+                f"免费配额限制：每分钟 {gemini_rate_limiter.rpm} 次，每天 {gemini_rate_limiter.rpd:,} 次。\n"
+                f"解决方案：\n"
+                f"1. 等待一段时间后重试\n"
+                f"2. 访问 https://ai.dev/usage?tab=rate-limit 查看配额使用情况\n"
+                f"3. 考虑升级到付费计划以获得更高配额\n"
+                f"原始错误: {error_str}"
+            ) from e
+
+        return False
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+PSD縮放布局後端接口
+GeminiPSDResizeService負責提示詞、解析、校驗和分簇，具體的模型調用由LayoutProvider完成
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from services.gemini_rate_limiter import PRIORITY_NORMAL
+
+
+@dataclass
+class LayoutRequest:
+    """單次布局請求"""
+    prompt: str
+    image_data: bytes
+    mime_type: str
+    # 本次請求需要布局的圖層（分簇/重試時只是全部圖層的一部分）
+    layers: List[Dict[str, Any]]
+    original_size: Tuple[int, int]
+    target_size: Tuple[int, int]
+    temperature: float = 0.1
+    max_tokens: int = 32000
+    priority: int = PRIORITY_NORMAL
+
+
+class LayoutProviderBase(ABC):
+    """布局後端基類，返回模型輸出的原始文本（JSON數組）"""
+
+    name = "base"
+
+    @abstractmethod
+    async def complete(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        """
+        生成布局
+
+        Args:
+            request: 布局請求
+            max_retries: 可重試錯誤（配額、服務端錯誤）的最大嘗試次數
+
+        Returns:
+            響應文本
+        """
+        pass
+
+    async def stream(self, request: LayoutRequest, max_retries: int = 3) -> AsyncIterator[str]:
+        """流式生成布局，默認一次性返回完整響應"""
+        yield await self.complete(request, max_retries)
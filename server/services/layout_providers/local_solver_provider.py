@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+本地布局後端
+不調用模型，按原始位置等比縮放並在目標畫布中居中，用於離線運行和基準測試
+"""
+
+import json
+
+import numpy as np
+
+from utils.layout_validation import proportional_boxes
+from .layout_base_provider import LayoutProviderBase, LayoutRequest
+
+
+class LocalSolverLayoutProvider(LayoutProviderBase):
+    """等比縮放居中的本地布局"""
+
+    name = "local"
+
+    async def complete(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        if not request.layers:
+            return "[]"
+        original = np.array(
+            [[info['left'], info['top'], info['right'], info['bottom']] for info in request.layers],
+            dtype=np.float64
+        )
+        boxes = np.rint(proportional_boxes(original, *request.original_size, *request.target_size)).astype(int)
+        return json.dumps([
+            {
+                "id": info['id'],
+                "new_coords": dict(zip(("left", "top", "right", "bottom"), (int(value) for value in box)))
+            }
+            for info, box in zip(request.layers, boxes)
+        ])
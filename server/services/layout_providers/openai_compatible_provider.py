@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+OpenAI兼容的HTTP布局後端
+向任意 /chat/completions 接口發送提示詞和檢測框圖像（包括本地的 resize/mock_layout_server.py）
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from utils.http_client import HttpClient
+from .layout_base_provider import LayoutProviderBase, LayoutRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HTTP_BASE_URL = os.environ.get("PSD_LAYOUT_HTTP_URL", "http://127.0.0.1:8765/v1")
+DEFAULT_HTTP_MODEL = os.environ.get("PSD_LAYOUT_HTTP_MODEL", "layout-mock")
+DEFAULT_HTTP_CONCURRENCY = int(os.environ.get("PSD_LAYOUT_HTTP_CONCURRENCY", 16))
+DEFAULT_HTTP_TIMEOUT = float(os.environ.get("PSD_LAYOUT_HTTP_TIMEOUT", 300))
+
+# 可重試的HTTP狀態碼
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class OpenAICompatibleLayoutProvider(LayoutProviderBase):
+    """OpenAI兼容接口的布局後端，連接池和併發上限在所有請求間共享"""
+
+    name = "http"
+
+    def __init__(self,
+                 base_url: str = DEFAULT_HTTP_BASE_URL,
+                 model: str = DEFAULT_HTTP_MODEL,
+                 api_key: Optional[str] = None,
+                 max_concurrency: int = DEFAULT_HTTP_CONCURRENCY,
+                 timeout: float = DEFAULT_HTTP_TIMEOUT):
+        self.url = base_url.rstrip('/') + "/chat/completions"
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.environ.get("PSD_LAYOUT_HTTP_API_KEY", "")
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # 壓測時需要保持連接，覆蓋默認的不保活配置
+            self._client = HttpClient.create_async_client(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _payload(self, request: LayoutRequest, stream: bool) -> Dict[str, Any]:
+        image_url = f"data:{request.mime_type};base64,{base64.b64encode(request.image_data).decode('utf-8')}"
+        return {
+            "model": self.model,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": request.prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                ],
+            }],
+            "temperature": request.temperature,
+            "max_tokens": request.max_tokens,
+            "stream": stream,
+        }
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    @staticmethod
+    def _describe(error: Exception) -> str:
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"HTTP {error.response.status_code}"
+        return f"{type(error).__name__}: {error}"
+
+    async def _backoff(self, error: Exception, attempt: int, max_retries: int) -> bool:
+        """可重試的錯誤退避後返回True"""
+        retryable = isinstance(error, httpx.TransportError) or (
+            isinstance(error, httpx.HTTPStatusError) and error.response.status_code in _RETRY_STATUS
+        )
+        if not retryable or attempt >= max_retries - 1:
+            return False
+        wait_time = 2 ** attempt
+        logger.warning(f"布局接口請求失敗（{self._describe(error)}），{wait_time}秒後進行第{attempt + 2}次重試")
+        await asyncio.sleep(wait_time)
+        return True
+
+    async def complete(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        client = self._get_client()
+        payload = self._payload(request, stream=False)
+        for attempt in range(max_retries):
+            try:
+                async with self._semaphore:
+                    response = await client.post(self.url, json=payload, headers=self._headers())
+                    response.raise_for_status()
+                    data = response.json()
+                return data["choices"][0]["message"]["content"] or ""
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if await self._backoff(e, attempt, max_retries):
+                    continue
+                raise Exception(f"布局接口調用失敗: {self._describe(e)}") from e
+
+    async def stream(self, request: LayoutRequest, max_retries: int = 3) -> AsyncIterator[str]:
+        """解析SSE流（data: {...} / data: [DONE]），只在尚未收到輸出時重試"""
+        client = self._get_client()
+        payload = self._payload(request, stream=True)
+        for attempt in range(max_retries):
+            received_any = False
+            try:
+                async with self._semaphore:
+                    async with client.stream("POST", self.url, json=payload, headers=self._headers()) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                return
+                            choices = json.loads(data).get("choices") or []
+                            text = choices[0].get("delta", {}).get("content") if choices else None
+                            if text:
+                                received_any = True
+                                yield text
+                return
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if not received_any and await self._backoff(e, attempt, max_retries):
+                    continue
+                raise Exception(f"布局接口調用失敗: {self._describe(e)}") from e
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,125 @@
+"""
+模板库 / 字体库数据库
+每个库一个共享的异步引擎（aiosqlite），WAL 模式下读请求互不阻塞，也不会阻塞事件循环；
+建表、补建索引等启动时的DDL走同步引擎。
+各表的行数由触发器维护在 library_counters 表中，统计接口无需 count(*)。
+"""
+
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeMeta
+
+from models.font_model import FontBase
+from models.template_model import TemplateBase
+from services.config_service import USER_DATA_DIR
+
+TEMPLATE_DB_PATH = os.path.join(USER_DATA_DIR, "templates.db")
+FONT_DB_PATH = os.path.join(USER_DATA_DIR, "fonts.db")
+
+# 连接池：SQLite 写入串行，读连接数够覆盖并发请求即可
+POOL_SIZE = int(os.environ.get("LIBRARY_DB_POOL_SIZE", 8))
+MAX_OVERFLOW = int(os.environ.get("LIBRARY_DB_MAX_OVERFLOW", 8))
+# 写锁等待时间（毫秒），超过后报 database is locked
+BUSY_TIMEOUT_MS = int(os.environ.get("LIBRARY_DB_BUSY_TIMEOUT_MS", 5000))
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+class LibraryDatabase:
+    """一个SQLite库的共享引擎与会话工厂"""
+
+    def __init__(self, db_path: str, base: DeclarativeMeta, counters: Dict[str, str]):
+        """
+        Args:
+            counters: 计数器名到表名，如 {"total_fonts": "font_items"}
+        """
+        self.db_path = db_path
+        self.counters = counters
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        # 同步引擎只用于启动时建表和维护性DDL
+        self.sync_engine = create_engine(f"sqlite:///{self.db_path}")
+        event.listen(self.sync_engine, "connect", _apply_pragmas)
+        base.metadata.create_all(bind=self.sync_engine)
+        # create_all 不会给已存在的表补建索引
+        for table in base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.sync_engine, checkfirst=True)
+        self._init_counters()
+
+        self.engine = create_async_engine(
+            f"sqlite+aiosqlite:///{self.db_path}",
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_recycle=3600,
+        )
+        event.listen(self.engine.sync_engine, "connect", _apply_pragmas)
+        # 提交后不过期对象，响应序列化时无需再次查询
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    def _init_counters(self):
+        """创建计数表和增删触发器，启动时按实际行数校准（手动改库后也能恢复）"""
+        with self.sync_engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS library_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            """))
+            for name, table in self.counters.items():
+                conn.execute(text(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table} BEGIN
+                        UPDATE library_counters SET value = value + 1 WHERE name = '{name}';
+                    END
+                """))
+                conn.execute(text(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table} BEGIN
+                        UPDATE library_counters SET value = value - 1 WHERE name = '{name}';
+                    END
+                """))
+                conn.execute(
+                    text(f"INSERT OR REPLACE INTO library_counters (name, value) SELECT :name, count(*) FROM {table}"),
+                    {"name": name}
+                )
+
+    async def read_counters(self, db: AsyncSession) -> Dict[str, int]:
+        """读取全部计数器（一次小表查询）"""
+        rows = await db.execute(text("SELECT name, value FROM library_counters"))
+        values = dict(rows.all())
+        return {name: values.get(name, 0) for name in self.counters}
+
+    async def get_session(self) -> AsyncIterator[AsyncSession]:
+        """FastAPI 依赖"""
+        async with self.session_factory() as session:
+            yield session
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        async with self.session_factory() as session:
+            yield session
+
+    async def dispose(self):
+        await self.engine.dispose()
+        self.sync_engine.dispose()
+
+
+# 全局实例
+template_db = LibraryDatabase(TEMPLATE_DB_PATH, TemplateBase, {
+    "total_templates": "template_items",
+    "total_categories": "template_categories",
+    "total_collections": "template_collections",
+})
+font_db = LibraryDatabase(FONT_DB_PATH, FontBase, {
+    "total_fonts": "font_items",
+    "total_categories": "font_categories",
+})
@@ -0,0 +1,189 @@
+"""
+PSD模板画布载荷
+把 {file_id}_metadata.json 里的图层列表预先转换成可直接插入画布的元素（坐标、尺寸、透明度、
+图片地址和稳定的文件ID、图片实际像素尺寸），按模板版本缓存：内存LRU + 元数据旁的 {file_id}_canvas.json。
+版本由元数据文件的 mtime/大小决定，图层元数据被修改后自动重建；只替换图层图片时需调用 invalidate。
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from services.config_service import FILES_DIR
+
+logger = logging.getLogger(__name__)
+
+PSD_DIR = os.path.join(FILES_DIR, "psd")
+CACHE_SIZE = int(os.environ.get("PSD_CANVAS_CACHE_SIZE", 64))
+# 载荷格式变化时递增，旧的磁盘缓存自动失效
+PAYLOAD_FORMAT = 1
+
+Version = Tuple[int, int]
+
+
+def _layer_image_path(psd_dir: str, file_id: str, layer_index: int) -> str:
+    return os.path.join(psd_dir, f'{file_id}_layer_{layer_index}.png')
+
+
+def _to_canvas_opacity(value: Any) -> int:
+    """PSD透明度 0-255 转换为画布的 0-100"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 100
+    return max(0, min(100, round(value * 100 / 255)))
+
+
+def _build_element(psd_dir: str, file_id: str, layer: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """单个图层的画布元素，隐藏或没有位图的图层返回None"""
+    if not layer.get('visible', True) or not layer.get('image_url'):
+        return None
+    image_path = _layer_image_path(psd_dir, file_id, layer['index'])
+    try:
+        stat = os.stat(image_path)
+        # 只读PNG文件头
+        with Image.open(image_path) as img:
+            natural_width, natural_height = img.size
+    except (OSError, ValueError) as e:
+        logger.warning(f"PSD图层图片不可用 {image_path}: {e}")
+        return None
+
+    # 图片版本进入文件ID和URL：内容不变时画布复用已加载的文件，替换后自动换新
+    image_version = f'{stat.st_mtime_ns:x}{stat.st_size:x}'
+    base_url = layer['image_url'].split('?', 1)[0]
+    return {
+        'layer_index': layer['index'],
+        'name': layer.get('name'),
+        'type': layer.get('type'),
+        'x': layer.get('left') or 0,
+        'y': layer.get('top') or 0,
+        'width': layer.get('width') or natural_width,
+        'height': layer.get('height') or natural_height,
+        'opacity': _to_canvas_opacity(layer.get('opacity', 255)),
+        'file_id': f'psd-{file_id}-{layer["index"]}-{image_version}',
+        'image_url': f'{base_url}?v={image_version}',
+        'mime_type': 'image/png',
+        'natural_width': natural_width,
+        'natural_height': natural_height,
+    }
+
+
+class PSDCanvasPayloadCache:
+    """按PSD文件缓存图层元数据和预计算的画布元素"""
+
+    def __init__(self, psd_dir: str = PSD_DIR, max_entries: int = CACHE_SIZE):
+        self.psd_dir = psd_dir
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Version, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def metadata_path(self, file_id: str) -> str:
+        return os.path.join(self.psd_dir, f'{file_id}_metadata.json')
+
+    def payload_path(self, file_id: str) -> str:
+        return os.path.join(self.psd_dir, f'{file_id}_canvas.json')
+
+    def _version(self, file_id: str) -> Optional[Version]:
+        try:
+            stat = os.stat(self.metadata_path(file_id))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def cached(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """命中内存缓存且版本未变时返回载荷（只需一次stat），否则返回None"""
+        version = self._version(file_id)
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or version is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(file_id)
+            return entry[1]
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        返回载荷，元数据不存在时返回None。
+        依次尝试内存缓存、磁盘缓存，都不可用时重建。同步方法，未命中内存时在线程池中调用。
+        """
+        payload = self.cached(file_id)
+        if payload is not None:
+            return payload
+        version = self._version(file_id)
+        if version is None:
+            return None
+        payload = self._load(file_id, version) or self.build(file_id)
+        return payload
+
+    def _load(self, file_id: str, version: Version) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.payload_path(file_id), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get('format') != PAYLOAD_FORMAT or tuple(stored.get('version') or ()) != version:
+            return None
+        payload = stored['payload']
+        self._remember(file_id, version, payload)
+        return payload
+
+    def build(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """读取元数据并重新计算载荷，写入内存和磁盘缓存"""
+        version = self._version(file_id)
+        if version is None:
+            return None
+        with open(self.metadata_path(file_id), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+
+        elements: List[Dict[str, Any]] = []
+        for layer in metadata.get('layers', []):
+            element = _build_element(self.psd_dir, file_id, layer)
+            if element is not None:
+                elements.append(element)
+
+        payload = {
+            'width': metadata.get('width'),
+            'height': metadata.get('height'),
+            'original_filename': metadata.get('original_filename'),
+            'layers': metadata.get('layers', []),
+            'elements': elements,
+        }
+        self._remember(file_id, version, payload)
+        self._store(file_id, version, payload)
+        return payload
+
+    def _store(self, file_id: str, version: Version, payload: Dict[str, Any]):
+        """先写临时文件再改名，并发读取不会读到半个文件"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.psd_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': PAYLOAD_FORMAT, 'version': list(version), 'payload': payload},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self.payload_path(file_id))
+        except OSError as e:
+            logger.warning(f"PSD画布载荷写入失败 {file_id}: {e}")
+
+    def _remember(self, file_id: str, version: Version, payload: Dict[str, Any]):
+        with self._lock:
+            self._entries[file_id] = (version, payload)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_id: str):
+        """图层图片被替换等元数据文件不变的修改后调用"""
+        with self._lock:
+            self._entries.pop(file_id, None)
+        try:
+            os.remove(self.payload_path(file_id))
+        except FileNotFoundError:
+            pass
+
+
+# 全局实例
+psd_canvas_payloads = PSDCanvasPayloadCache()
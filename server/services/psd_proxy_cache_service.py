@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+PSD代理圖層緩存
+按file_id緩存縮小後的圖層渲染結果：內存LRU + 磁盤，PSD文件或已保存的圖層圖像更新後自動失效
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+
+from services.config_service import FILES_DIR
+from utils.proxy_render import PROXY_MAX_EDGE, ProxyLayerSet, build_proxy_layers, stored_layers_version
+
+logger = logging.getLogger(__name__)
+
+PROXY_CACHE_DIR = os.path.join(FILES_DIR, "psd", "proxy")
+# 內存中保留的PSD數量
+PROXY_MEMORY_CACHE_SIZE = int(os.environ.get("PSD_PROXY_MEMORY_CACHE_SIZE", 8))
+
+# (PSD修改時間, 已保存圖層圖像的版本摘要)
+ProxyVersion = Tuple[float, str]
+
+
+class PSDProxyCache:
+    """PSD代理圖層緩存"""
+
+    def __init__(self, max_entries: int = PROXY_MEMORY_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, ProxyLayerSet]" = OrderedDict()
+        self._versions: Dict[str, ProxyVersion] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def get(self, file_id: str, psd_path: str) -> ProxyLayerSet:
+        """獲取代理圖層，首次訪問時構建（同一file_id的併發請求只構建一次）"""
+        proxy = self._get_from_memory(file_id, psd_path)
+        if proxy is not None:
+            return proxy
+
+        lock = self._locks.setdefault(file_id, asyncio.Lock())
+        async with lock:
+            proxy = self._get_from_memory(file_id, psd_path)
+            if proxy is not None:
+                return proxy
+
+            proxy = await run_in_threadpool(self._load_from_disk, file_id, psd_path)
+            if proxy is None:
+                proxy = await run_in_threadpool(build_proxy_layers, psd_path, PROXY_MAX_EDGE)
+                logger.info(f"代理圖層已構建: {file_id}, {len(proxy.layers)} 個圖層, "
+                            f"耗時 {proxy.build_seconds:.2f}秒")
+                await run_in_threadpool(self._save_to_disk, file_id, psd_path, proxy)
+
+            self._put_in_memory(file_id, psd_path, proxy)
+            return proxy
+
+    def invalidate(self, file_id: str) -> None:
+        self._entries.pop(file_id, None)
+        self._versions.pop(file_id, None)
+        shutil.rmtree(os.path.join(PROXY_CACHE_DIR, file_id), ignore_errors=True)
+
+    @staticmethod
+    def _version(psd_path: str, layer_ids: List[int]) -> ProxyVersion:
+        return (os.path.getmtime(psd_path), stored_layers_version(psd_path, layer_ids))
+
+    def _get_from_memory(self, file_id: str, psd_path: str) -> Optional[ProxyLayerSet]:
+        proxy = self._entries.get(file_id)
+        if proxy is None:
+            return None
+        if self._versions.get(file_id) != self._version(psd_path, [layer_id for layer_id, _ in proxy.layers]):
+            self._entries.pop(file_id, None)
+            return None
+        self._entries.move_to_end(file_id)
+        return proxy
+
+    def _put_in_memory(self, file_id: str, psd_path: str, proxy: ProxyLayerSet) -> None:
+        self._entries[file_id] = proxy
+        self._entries.move_to_end(file_id)
+        self._versions[file_id] = self._version(psd_path, [layer_id for layer_id, _ in proxy.layers])
+        while len(self._entries) > self.max_entries:
+            evicted_id, _ = self._entries.popitem(last=False)
+            self._versions.pop(evicted_id, None)
+
+    def _load_from_disk(self, file_id: str, psd_path: str) -> Optional[ProxyLayerSet]:
+        cache_dir = os.path.join(PROXY_CACHE_DIR, file_id)
+        index_path = os.path.join(cache_dir, "index.json")
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            psd_mtime, layers_version = self._version(psd_path, index["layer_ids"])
+            if (index.get("psd_mtime") != psd_mtime or index.get("layers_version") != layers_version
+                    or index.get("max_edge") != PROXY_MAX_EDGE):
+                return None
+
+            proxy = ProxyLayerSet(width=index["width"], height=index["height"], scale=index["scale"])
+            for layer_id in index["layer_ids"]:
+                with Image.open(os.path.join(cache_dir, f"{layer_id}.png")) as image:
+                    proxy.layers.append((layer_id, image.convert('RGBA')))
+            return proxy
+        except Exception as e:
+            logger.warning(f"讀取代理圖層緩存失敗 {file_id}: {e}")
+            return None
+
+    def _save_to_disk(self, file_id: str, psd_path: str, proxy: ProxyLayerSet) -> None:
+        cache_dir = os.path.join(PROXY_CACHE_DIR, file_id)
+        try:
+            layer_ids = [layer_id for layer_id, _ in proxy.layers]
+            psd_mtime, layers_version = self._version(psd_path, layer_ids)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.makedirs(cache_dir, exist_ok=True)
+            for layer_id, image in proxy.layers:
+                image.save(os.path.join(cache_dir, f"{layer_id}.png"), 'PNG', compress_level=1)
+            # 最後寫索引，索引存在即表示緩存完整
+            with open(os.path.join(cache_dir, "index.json"), 'w', encoding='utf-8') as f:
+                json.dump({
+                    "psd_mtime": psd_mtime,
+                    "layers_version": layers_version,
+                    "max_edge": PROXY_MAX_EDGE,
+                    "width": proxy.width,
+                    "height": proxy.height,
+                    "scale": proxy.scale,
+                    "layer_ids": layer_ids,
+                }, f)
+        except Exception as e:
+            logger.warning(f"保存代理圖層緩存失敗 {file_id}: {e}")
+
+
+# 全局实例
+psd_proxy_cache = PSDProxyCache()
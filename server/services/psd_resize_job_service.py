@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+PSD縮放異步任務管理
+提交後立即返回job_id，各階段進度通過Socket.IO推送給提交任務的連接，結果可通過輪詢獲取
+"""
+
+import asyncio
+import logging
+import time
+import traceback
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services.websocket_state import sio
+
+logger = logging.getLogger(__name__)
+
+# 縮放流水線的各個階段（按執行順序）
+RESIZE_STAGES = ["extract", "layout", "render", "encode"]
+
+# 已結束任務在內存中的保留時間
+JOB_RETENTION_SECONDS = 60 * 60
+
+
+@dataclass
+class ResizeJob:
+    job_id: str
+    kind: str
+    # 接收進度推送的Socket.IO連接，未提供時只能輪詢
+    socket_id: Optional[str] = None
+    status: str = "pending"  # pending, running, completed, failed
+    stage: Optional[str] = None
+    stages: List[str] = field(default_factory=lambda: list(RESIZE_STAGES))
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    stage_started_at: Dict[str, float] = field(default_factory=dict)
+    details: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @property
+    def progress(self) -> float:
+        """已完成階段佔比"""
+        if self.status == "completed":
+            return 1.0
+        done = sum(1 for stage in self.stages if stage in self.timings)
+        return round(done / len(self.stages), 3) if self.stages else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": self.stages,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings,
+            "total_seconds": (
+                round(self.finished_at - self.started_at, 3)
+                if self.finished_at and self.started_at else None
+            ),
+            "details": self.details,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+# 流水線回調: await report(stage, "started"|"completed", **data)
+ProgressReporter = Callable[..., Awaitable[None]]
+
+
+class PSDResizeJobManager:
+    """PSD縮放任務管理器"""
+
+    def __init__(self):
+        self.jobs: Dict[str, ResizeJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self,
+               kind: str,
+               runner: Callable[[ProgressReporter], Awaitable[Dict[str, Any]]],
+               stages: Optional[List[str]] = None,
+               on_finish: Optional[Callable[[], None]] = None,
+               socket_id: Optional[str] = None) -> ResizeJob:
+        """
+        提交任務並立即返回
+
+        Args:
+            kind: 任務類型（resize / preview）
+            runner: 執行流水線的協程工廠，接收進度回調
+            stages: 本任務包含的階段，默認為全部階段
+            on_finish: 任務結束（成功或失敗）後的清理回調
+            socket_id: 提交者的Socket.IO連接ID，進度只推送給該連接
+        """
+        self.cleanup_expired()
+
+        job = ResizeJob(job_id=f"job_{uuid.uuid4().hex[:12]}", kind=kind, socket_id=socket_id)
+        if stages is not None:
+            job.stages = list(stages)
+        self.jobs[job.job_id] = job
+
+        task = asyncio.create_task(self._run(job, runner, on_finish))
+        self._tasks[job.job_id] = task
+        return job
+
+    def get(self, job_id: str) -> Optional[ResizeJob]:
+        return self.jobs.get(job_id)
+
+    async def _run(self,
+                   job: ResizeJob,
+                   runner: Callable[[ProgressReporter], Awaitable[Dict[str, Any]]],
+                   on_finish: Optional[Callable[[], None]]) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        await self._emit(job, "job", "started")
+
+        async def report(stage: str, state: str, **data: Any) -> None:
+            now = time.time()
+            if state == "started":
+                job.stage = stage
+                job.stage_started_at[stage] = now
+            elif state == "completed" and stage in job.stage_started_at:
+                job.timings[stage] = round(now - job.stage_started_at[stage], 3)
+            if data:
+                job.details.setdefault(stage, {}).update(data)
+            await self._emit(job, stage, state, data)
+
+        try:
+            job.result = await runner(report)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"PSD縮放任務失敗 {job.job_id}: {e}")
+            traceback.print_exc()
+            job.status = "failed"
+            job.error = getattr(e, "detail", None) or str(e)
+        finally:
+            job.finished_at = time.time()
+            job.stage = None
+            self._tasks.pop(job.job_id, None)
+            if on_finish:
+                try:
+                    on_finish()
+                except Exception as e:
+                    logger.warning(f"任務清理失敗 {job.job_id}: {e}")
+
+        await self._emit(job, "job", job.status)
+
+    async def _emit(self, job: ResizeJob, stage: str, state: str,
+                    data: Optional[Dict[str, Any]] = None) -> None:
+        # 不廣播：進度和結果ID只發給提交任務的連接
+        if not job.socket_id:
+            return
+        try:
+            await sio.emit('psd_resize_progress', {
+                'job_id': job.job_id,
+                'kind': job.kind,
+                'status': job.status,
+                'stage': stage,
+                'state': state,
+                'progress': job.progress,
+                'timings': job.timings,
+                'data': data or {},
+                'result': job.result if stage == "job" else None,
+                'error': job.error,
+            }, room=job.socket_id)
+        except Exception as e:
+            logger.warning(f"推送任務進度失敗 {job.job_id}: {e}")
+
+    def cleanup_expired(self) -> None:
+        """清理過期的已結束任務"""
+        now = time.time()
+        expired_ids = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at and now - job.finished_at > JOB_RETENTION_SECONDS
+        ]
+        for job_id in expired_ids:
+            del self.jobs[job_id]
+
+
+# 全局实例
+psd_resize_job_manager = PSDResizeJobManager()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+PSD縮放結果存儲
+結果ID由輸出內容派生（不會互相覆蓋），元數據及文件列表記錄在SQLite索引中，
+後台清理任務按最大佔用、最長保留時間和最近訪問時間（LRU）回收磁盤
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+from fastapi.concurrency import run_in_threadpool
+
+from services.config_service import FILES_DIR, USER_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+PSD_DIR = os.path.join(FILES_DIR, "psd")
+DB_PATH = os.path.join(USER_DATA_DIR, "psd_resize_results.db")
+
+# 保留策略
+RESULT_MAX_BYTES = int(os.environ.get("PSD_RESULT_MAX_MB", 5 * 1024)) * 1024 * 1024
+RESULT_MAX_AGE_SECONDS = float(os.environ.get("PSD_RESULT_MAX_AGE_DAYS", 30)) * 86400
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("PSD_RESULT_SWEEP_SECONDS", 600))
+
+
+class PSDResizeResultStore:
+    """縮放結果索引與保留策略"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._sweeper: Optional[asyncio.Task] = None
+        self._initialized = False
+
+    def _ensure_db(self):
+        """首次使用時（通常是啟動清理任務時）才創建數據庫，導入模塊不產生文件"""
+        if self._initialized:
+            return
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS resize_results (
+                    file_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    last_accessed_at REAL NOT NULL,
+                    total_bytes INTEGER NOT NULL DEFAULT 0,
+                    files TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_resize_results_last_accessed
+                ON resize_results (last_accessed_at)
+            """)
+        self._initialized = True
+
+    @staticmethod
+    def make_result_id(output_png_path: str, key_data: Dict[str, Any]) -> str:
+        """由輸出圖像內容和生成參數派生結果ID（相同輸出得到相同ID）"""
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        with open(output_png_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return f"resized_{sha256.hexdigest()[:24]}"
+
+    async def register(self, file_id: str, files: List[str], metadata: Dict[str, Any]) -> None:
+        """
+        記錄結果
+
+        Args:
+            file_id: 結果ID
+            files: 屬於該結果的文件/目錄（相對PSD_DIR）
+            metadata: 完整元數據
+        """
+        self._ensure_db()
+        total_bytes = await run_in_threadpool(self._measure, files)
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("""
+                INSERT INTO resize_results (file_id, created_at, last_accessed_at, total_bytes, files, metadata)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(file_id) DO UPDATE SET
+                    last_accessed_at = excluded.last_accessed_at,
+                    total_bytes = excluded.total_bytes,
+                    files = excluded.files,
+                    metadata = excluded.metadata
+            """, (file_id, now, now, total_bytes, json.dumps(files),
+                  json.dumps(metadata, ensure_ascii=False)))
+            await db.commit()
+
+    async def get_metadata(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """讀取元數據並更新訪問時間，不在索引中時返回None"""
+        self._ensure_db()
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT metadata FROM resize_results WHERE file_id = ?", (file_id,)
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                return None
+            await db.execute(
+                "UPDATE resize_results SET last_accessed_at = ? WHERE file_id = ?",
+                (time.time(), file_id)
+            )
+            await db.commit()
+        return json.loads(row[0])
+
+    async def touch(self, file_id: str) -> None:
+        """記錄一次訪問（LRU）"""
+        self._ensure_db()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE resize_results SET last_accessed_at = ? WHERE file_id = ?",
+                (time.time(), file_id)
+            )
+            await db.commit()
+
+    async def sweep(self) -> Dict[str, int]:
+        """按保留策略刪除過期和超出容量的結果"""
+        self._ensure_db()
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("""
+                SELECT file_id, files, total_bytes, last_accessed_at
+                FROM resize_results
+                ORDER BY last_accessed_at ASC
+            """)
+            rows = await cursor.fetchall()
+
+        total_bytes = sum(row[2] for row in rows)
+        expired = []
+        for file_id, files, size, last_accessed_at in rows:
+            if now - last_accessed_at > RESULT_MAX_AGE_SECONDS or total_bytes > RESULT_MAX_BYTES:
+                expired.append((file_id, json.loads(files)))
+                total_bytes -= size
+
+        if expired:
+            await run_in_threadpool(self._remove_files, [files for _, files in expired])
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.executemany(
+                    "DELETE FROM resize_results WHERE file_id = ?",
+                    [(file_id,) for file_id, _ in expired]
+                )
+                await db.commit()
+
+        legacy_removed = await run_in_threadpool(self._sweep_legacy_files, now)
+        if expired or legacy_removed:
+            logger.info(f"清理縮放結果: {len(expired)} 個, 舊格式文件 {legacy_removed} 個, "
+                        f"剩餘佔用 {total_bytes / 1024 / 1024:.1f} MB")
+        return {"removed": len(expired), "legacy_removed": legacy_removed, "total_bytes": total_bytes}
+
+    def start_sweeper(self) -> None:
+        """創建數據庫並啟動後台清理任務"""
+        self._ensure_db()
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"清理縮放結果失敗: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
+    @staticmethod
+    def _measure(files: List[str]) -> int:
+        total = 0
+        for name in files:
+            path = os.path.join(PSD_DIR, name)
+            if os.path.isdir(path):
+                for root, _, filenames in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(root, filename)) for filename in filenames)
+            elif os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+    @staticmethod
+    def _remove_files(file_groups: List[List[str]]) -> None:
+        for files in file_groups:
+            for name in files:
+                path = os.path.join(PSD_DIR, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+
+    @staticmethod
+    def _sweep_legacy_files(now: float) -> int:
+        """清理索引建立之前以時間戳命名（resized_<秒>）的過期結果文件"""
+        if not os.path.isdir(PSD_DIR):
+            return 0
+        removed = 0
+        for name in os.listdir(PSD_DIR):
+            stem = name.split('_', 2)
+            if len(stem) < 2 or stem[0] != "resized":
+                continue
+            timestamp = stem[1].split('.')[0]
+            # 秒或毫秒時間戳，內容派生的ID為24位十六進制
+            if not timestamp.isdigit() or len(timestamp) > 13:
+                continue
+            path = os.path.join(PSD_DIR, name)
+            try:
+                if now - os.path.getmtime(path) <= RESULT_MAX_AGE_SECONDS:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+# 全局实例
+psd_resize_store = PSDResizeResultStore()
@@ -0,0 +1,328 @@
+"""
+模板库导入 / 导出
+导出为流式 zip：数据库行按表写成 JSON Lines，随后是引用到的上传图片和PSD文件（元数据、图层图片、缩略图、源文件），
+最后写 assets.jsonl 记录每个文件的SHA-256。数据库分批读取、文件分块写入，内存占用与库大小无关。
+导入时上传图片按内容哈希落盘（已存在则跳过），数据库行批量 INSERT OR IGNORE，已存在的ID保留本地版本。
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import zipfile
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Table, insert, literal_column, select
+
+from models.template_model import TemplateCategory, TemplateCollection, TemplateItem
+from services.library_db_service import LibraryDatabase, template_db
+from services.psd_canvas_payload_service import PSD_DIR
+from services.template_thumbnail_service import (
+    TEMPLATE_UPLOAD_DIR, THUMBS_SUBFOLDER, is_content_digest, template_thumbnail_service, upload_url,
+)
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+ASSETS_NAME = "assets.jsonl"
+UPLOADS_PREFIX = "uploads/"
+PSD_PREFIX = "psd/"
+
+# 按依赖顺序导出 / 导入
+TABLES: List[Table] = [TemplateCategory.__table__, TemplateCollection.__table__, TemplateItem.__table__]
+BATCH_SIZE = 500
+_CHUNK_SIZE = 1024 * 1024
+# 已压缩格式直接存储，不再浪费CPU压缩
+_STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+_UPLOAD_URL_PATTERN = re.compile(r"/api/templates?/uploads/([^/?#]+)/([^/?#]+)$")
+
+
+def _is_safe_name(name: str) -> bool:
+    return bool(name) and name not in (".", "..") and os.path.basename(name) == name and "\\" not in name
+
+
+def _table_entry(table: Table) -> str:
+    return f"{table.name}.jsonl"
+
+
+def _row_to_json(table: Table, row: Dict[str, Any]) -> Dict[str, Any]:
+    data = {}
+    for column in table.columns:
+        value = row[column.name]
+        data[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def _row_from_json(table: Table, data: Dict[str, Any]) -> Dict[str, Any]:
+    row = {}
+    for column in table.columns:
+        value = data.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        row[column.name] = value
+    return row
+
+
+def _upload_entry(url: Optional[str]) -> Optional[str]:
+    """上传图片URL对应的包内路径，非模板上传目录的URL返回None"""
+    if not url:
+        return None
+    match = _UPLOAD_URL_PATTERN.search(url)
+    if not match or not all(_is_safe_name(part) for part in match.groups()):
+        return None
+    subfolder, filename = match.groups()
+    if subfolder == THUMBS_SUBFOLDER:
+        return None
+    return f"{UPLOADS_PREFIX}{subfolder}/{filename}"
+
+
+class _ZipStream:
+    """只支持追加写入的输出流，zipfile 检测到不可 seek 时改用数据描述符，无需回写文件头"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class TemplateBundleService:
+    """模板库打包与导入"""
+
+    def __init__(self, database: LibraryDatabase = template_db, upload_dir: str = TEMPLATE_UPLOAD_DIR,
+                 psd_dir: str = PSD_DIR):
+        self.database = database
+        self.upload_dir = upload_dir
+        self.psd_dir = psd_dir
+
+    # 导出
+
+    def _iter_rows(self, table: Table) -> Iterator[Dict[str, Any]]:
+        """按 rowid 分批读取，每批单独取连接，生成器在不同线程中恢复也安全"""
+        rowid = literal_column("rowid")
+        last_rowid = 0
+        while True:
+            with self.database.sync_engine.connect() as conn:
+                rows = conn.execute(
+                    select(rowid.label("_rowid"), *table.columns)
+                    .where(rowid > last_rowid)
+                    .order_by(rowid)
+                    .limit(BATCH_SIZE)
+                ).mappings().all()
+            for row in rows:
+                yield row
+            if len(rows) < BATCH_SIZE:
+                return
+            last_rowid = rows[-1]["_rowid"]
+
+    def _psd_files(self, psd_file_id: str) -> List[str]:
+        """PSD模板引用的文件（不含可重建的画布载荷缓存）"""
+        names = [f"{psd_file_id}.psd", f"{psd_file_id}_metadata.json", f"{psd_file_id}_thumbnail.png"]
+        paths = [os.path.join(self.psd_dir, name) for name in names]
+        paths += sorted(glob.glob(os.path.join(glob.escape(self.psd_dir), f"{glob.escape(psd_file_id)}_layer_*.png")))
+        return [path for path in paths if os.path.isfile(path)]
+
+    def export_bundle(self) -> Iterator[bytes]:
+        """逐块生成 zip 内容，供 StreamingResponse 使用"""
+        return (chunk for chunk in self._generate_bundle() if chunk)
+
+    def _generate_bundle(self) -> Iterator[bytes]:
+        stream = _ZipStream()
+        assets: Dict[str, str] = {}  # 包内路径 -> 本地路径
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            zf.writestr(MANIFEST_NAME, json.dumps({
+                "format": BUNDLE_FORMAT,
+                "created_at": datetime.utcnow().isoformat(),
+                "tables": [table.name for table in TABLES],
+            }))
+
+            for table in TABLES:
+                info = zipfile.ZipInfo(_table_entry(table), self._now())
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(info, "w", force_zip64=True) as entry:
+                    for row in self._iter_rows(table):
+                        entry.write(json.dumps(_row_to_json(table, row), ensure_ascii=False).encode("utf-8") + b"\n")
+                        if table is TemplateItem.__table__:
+                            self._collect_assets(row, assets)
+                        yield stream.drain()
+                yield stream.drain()
+
+            listing = []
+            for name, path in assets.items():
+                written = yield from self._write_file(zf, stream, name, path)
+                if written is not None:
+                    digest, size = written
+                    listing.append({"name": name, "sha256": digest, "size": size})
+
+            zf.writestr(ASSETS_NAME, "".join(json.dumps(item) + "\n" for item in listing))
+        yield stream.drain()
+
+    @staticmethod
+    def _now():
+        return datetime.now().timetuple()[:6]
+
+    def _collect_assets(self, row: Dict[str, Any], assets: Dict[str, str]):
+        for url in (row["thumbnail_url"], row["preview_url"]):
+            name = _upload_entry(url)
+            if name is not None:
+                assets[name] = os.path.join(self.upload_dir, *name[len(UPLOADS_PREFIX):].split("/"))
+        metadata = row["template_metadata"]
+        psd_file_id = metadata.get("psd_file_id") if isinstance(metadata, dict) else None
+        if isinstance(psd_file_id, str) and _is_safe_name(psd_file_id):
+            for path in self._psd_files(psd_file_id):
+                assets[PSD_PREFIX + os.path.basename(path)] = path
+
+    def _write_file(self, zf: zipfile.ZipFile, stream: _ZipStream, name: str, path: str):
+        """分块写入一个文件，返回 (SHA-256, 字节数)，文件已被删除时跳过"""
+        try:
+            source = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        hasher = hashlib.sha256()
+        with source:
+            info = zipfile.ZipInfo(name, self._now())
+            info.file_size = os.fstat(source.fileno()).st_size
+            if os.path.splitext(name)[1].lower() in _STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, "w") as entry:
+                while True:
+                    chunk = source.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    entry.write(chunk)
+                    yield stream.drain()
+        yield stream.drain()
+        return hasher.hexdigest(), info.file_size
+
+    # 导入
+
+    def import_bundle(self, file: BinaryIO) -> Dict[str, int]:
+        """
+        导入 zip 包（需可 seek，如上传的临时文件），返回统计。
+        同步方法，在线程池中调用；包格式错误时抛出 ValueError。
+        """
+        with zipfile.ZipFile(file) as zf:
+            names = set(zf.namelist())
+            if MANIFEST_NAME not in names or ASSETS_NAME not in names:
+                raise ValueError("Not a template bundle")
+            manifest = json.loads(zf.read(MANIFEST_NAME))
+            if manifest.get("format") != BUNDLE_FORMAT:
+                raise ValueError(f"Unsupported bundle format: {manifest.get('format')}")
+
+            stats = {"assets_written": 0, "assets_deduplicated": 0}
+            url_map: Dict[str, str] = {}
+            new_uploads: List[Tuple[str, str]] = []
+            with zf.open(ASSETS_NAME) as listing:
+                for line in listing:
+                    if line.strip():
+                        self._import_asset(zf, json.loads(line), stats, url_map, new_uploads)
+
+            with self.database.sync_engine.begin() as conn:
+                for table in TABLES:
+                    inserted, skipped = 0, 0
+                    entry = _table_entry(table)
+                    if entry in names:
+                        with zf.open(entry) as rows:
+                            for batch in self._read_batches(table, rows, url_map):
+                                result = conn.execute(insert(table).prefix_with("OR IGNORE"), batch)
+                                inserted += max(result.rowcount, 0)
+                                skipped += len(batch) - max(result.rowcount, 0)
+                    stats[f"{table.name}_inserted"] = inserted
+                    stats[f"{table.name}_skipped"] = skipped
+
+        # 数据库提交后再生成缩略图
+        for digest, path in new_uploads:
+            template_thumbnail_service.submit(digest, path)
+        return stats
+
+    def _read_batches(self, table: Table, rows: BinaryIO, url_map: Dict[str, str]) -> Iterator[List[Dict[str, Any]]]:
+        batch = []
+        for line in rows:
+            if not line.strip():
+                continue
+            row = _row_from_json(table, json.loads(line))
+            if table is TemplateItem.__table__:
+                # 上传图片在本机按内容哈希重新命名
+                for key in ("thumbnail_url", "preview_url"):
+                    name = _upload_entry(row[key])
+                    if name in url_map:
+                        row[key] = url_map[name]
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _import_asset(self, zf: zipfile.ZipFile, item: Dict[str, Any], stats: Dict[str, int],
+                      url_map: Dict[str, str], new_uploads: List[Tuple[str, str]]):
+        name, digest = item["name"], item["sha256"]
+        # 哈希会进入文件名和模板URL，必须是小写十六进制的sha256
+        if not isinstance(digest, str) or not is_content_digest(digest):
+            raise ValueError(f"Invalid asset digest: {name}")
+        if name.startswith(UPLOADS_PREFIX):
+            subfolder, _, filename = name[len(UPLOADS_PREFIX):].partition("/")
+            if not _is_safe_name(subfolder) or not _is_safe_name(filename) or subfolder == THUMBS_SUBFOLDER:
+                raise ValueError(f"Invalid asset path: {name}")
+            stored_name = f"{digest}{os.path.splitext(filename)[1].lower()}"
+            target = os.path.join(self.upload_dir, subfolder, stored_name)
+            url_map[name] = upload_url(subfolder, stored_name)
+            written = self._extract(zf, name, digest, target)
+            if written:
+                new_uploads.append((digest, target))
+        elif name.startswith(PSD_PREFIX):
+            filename = name[len(PSD_PREFIX):]
+            if not _is_safe_name(filename):
+                raise ValueError(f"Invalid asset path: {name}")
+            # PSD文件按文件ID命名，本机已有同名文件时保留本地版本
+            written = self._extract(zf, name, digest, os.path.join(self.psd_dir, filename))
+        else:
+            raise ValueError(f"Invalid asset path: {name}")
+        stats["assets_written" if written else "assets_deduplicated"] += 1
+
+    def _extract(self, zf: zipfile.ZipFile, name: str, digest: str, target: str) -> bool:
+        """分块解压并校验哈希，目标已存在时跳过；返回是否写入了新文件"""
+        if os.path.exists(target):
+            return False
+        folder = os.path.dirname(target)
+        os.makedirs(folder, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".import")
+        try:
+            with os.fdopen(fd, "wb") as output, zf.open(name) as source:
+                while True:
+                    chunk = source.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    output.write(chunk)
+            if hasher.hexdigest() != digest:
+                raise ValueError(f"Checksum mismatch: {name}")
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+
+# 全局实例
+template_bundle_service = TemplateBundleService()
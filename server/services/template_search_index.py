@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+模板全文索引
+template_items 的 FTS5 索引（名称、描述、标签、PSD图层名），由触发器与模板表保持同步，
+按 bm25 排序返回结果。使用 trigram 分词器，任意位置的子串（包括输入中的前缀）都能命中，
+中文名称无需分词；不足3个字符的关键词无法走索引，改为在索引表上做 LIKE 匹配。
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "template_items_fts"
+
+# trigram 分词器的最短可索引长度
+MIN_INDEXED_TERM_LENGTH = 3
+
+# bm25 列权重：template_id（不索引）、name、description、tags、layer_names
+BM25_WEIGHTS = (0.0, 10.0, 4.0, 6.0, 1.0)
+
+# 从模板行提取索引列，{row} 为 new / old 或表名
+_INDEX_COLUMNS_SQL = """
+    {row}.id,
+    {row}.name,
+    COALESCE({row}.description, ''),
+    COALESCE((
+        SELECT group_concat(value, ' ') FROM json_each(
+            CASE WHEN json_type({row}.tags) = 'array' THEN {row}.tags END
+        )
+    ), ''),
+    trim(COALESCE(json_extract(
+        CASE WHEN json_type({row}.template_metadata) = 'object' THEN {row}.template_metadata END,
+        '$.layer_name'
+    ), '') || ' ' || COALESCE((
+        SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each(
+            CASE WHEN json_type({row}.template_metadata, '$.layers_info') = 'array'
+                 THEN {row}.template_metadata END,
+            '$.layers_info'
+        )
+    ), ''))
+"""
+
+_INSERT_SQL = f"""
+    INSERT INTO {FTS_TABLE} (rowid, template_id, name, description, tags, layer_names)
+    SELECT {{row}}.rowid, {_INDEX_COLUMNS_SQL}
+"""
+
+_SCHEMA_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        template_id UNINDEXED, name, description, tags, layer_names,
+        tokenize = 'trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS template_items_fts_insert AFTER INSERT ON template_items BEGIN
+        {_INSERT_SQL.format(row='new')};
+    END
+    """,
+    # 只有索引列变化时才重建，usage_count / is_favorite 等更新不触发
+    f"""
+    CREATE TRIGGER IF NOT EXISTS template_items_fts_update
+    AFTER UPDATE OF name, description, tags, template_metadata ON template_items BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+        {_INSERT_SQL.format(row='new')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS template_items_fts_delete AFTER DELETE ON template_items BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+    END
+    """,
+]
+
+
+def _quote(term: str) -> str:
+    """FTS5 字符串字面量"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class TemplateSearchIndex:
+    """模板全文索引，当前 SQLite 不支持 FTS5 / trigram 时 available 为 False"""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.available = False
+
+    def ensure(self) -> bool:
+        """创建索引表和触发器，索引与模板表不一致时（首次创建、VACUUM 或手动改库后）重建索引"""
+        try:
+            with self.engine.begin() as conn:
+                for statement in _SCHEMA_SQL:
+                    conn.execute(text(statement))
+                # 查询按 rowid 关联模板表，VACUUM 可能重排 rowid，启动时校验 rowid 与模板ID仍然对应
+                indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+                matched = conn.execute(text(f"""
+                    SELECT count(*) FROM {FTS_TABLE} f
+                    JOIN template_items t ON t.rowid = f.rowid AND t.id = f.template_id
+                """)).scalar()
+                total = conn.execute(text("SELECT count(*) FROM template_items")).scalar()
+                if not (indexed == matched == total):
+                    logger.info(f"重建模板全文索引: {indexed} -> {total}")
+                    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+                    conn.execute(text(_INSERT_SQL.format(row='template_items') + " FROM template_items"))
+            self.available = True
+        except Exception as e:
+            logger.warning(f"模板全文索引不可用，搜索将使用 LIKE 匹配: {e}")
+            self.available = False
+        return self.available
+
+    async def search(self, db: AsyncSession, q: str, filters: Optional[Dict[str, Any]] = None,
+               limit: int = 100, after: Optional[List[Any]] = None) -> Optional[List[Tuple[str, List[Any]]]]:
+        """
+        返回按相关度排序的 (模板ID, 排序键)，索引不可用或关键词为空时返回None
+
+        Args:
+            q: 空格分隔的关键词，全部命中才返回（AND）
+            filters: template_items 列名到取值的等值筛选
+            after: 上一页最后一条的排序键（keyset 分页）
+        """
+        terms = [term for term in q.split() if term]
+        if not self.available or not terms:
+            return None
+
+        indexed_terms = [term for term in terms if len(term) >= MIN_INDEXED_TERM_LENGTH]
+        short_terms = [term for term in terms if len(term) < MIN_INDEXED_TERM_LENGTH]
+
+        clauses = []
+        params: Dict[str, Any] = {"limit": limit}
+        if indexed_terms:
+            clauses.append(f"{FTS_TABLE} MATCH :match")
+            params["match"] = " AND ".join(_quote(term) for term in indexed_terms)
+        for i, term in enumerate(short_terms):
+            clauses.append(
+                f"(f.name LIKE :short{i} ESCAPE '\\' OR f.description LIKE :short{i} ESCAPE '\\'"
+                f" OR f.tags LIKE :short{i} ESCAPE '\\' OR f.layer_names LIKE :short{i} ESCAPE '\\')"
+            )
+            params[f"short{i}"] = f"%{_escape_like(term)}%"
+        for i, (column, value) in enumerate((filters or {}).items()):
+            clauses.append(f"t.{column} = :filter{i}")
+            params[f"filter{i}"] = value
+
+        if indexed_terms:
+            # 排序键 (bm25, rowid)，bm25 越小越相关
+            score = f"bm25({FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)})"
+            sql = f"""
+                SELECT id, score, rid FROM (
+                    SELECT t.id AS id, {score} AS score, f.rowid AS rid FROM {FTS_TABLE} f
+                    JOIN template_items t ON t.rowid = f.rowid
+                    WHERE {' AND '.join(clauses)}
+                )
+                {"WHERE (score, rid) > (:after_score, :after_rid)" if after else ""}
+                ORDER BY score, rid
+                LIMIT :limit
+            """
+            if after:
+                params["after_score"], params["after_rid"] = after
+            return [(row[0], [row[1], row[2]]) for row in await db.execute(text(sql), params)]
+
+        # 只有短关键词时逐行匹配，按插入顺序倒序以便命中足够结果后提前结束扫描
+        if after:
+            clauses.append("f.rowid < :after_rid")
+            params["after_rid"] = after[0]
+        sql = f"""
+            SELECT t.id, f.rowid FROM {FTS_TABLE} f
+            JOIN template_items t ON t.rowid = f.rowid
+            WHERE {' AND '.join(clauses)}
+            ORDER BY f.rowid DESC
+            LIMIT :limit
+        """
+        return [(row[0], [row[1]]) for row in await db.execute(text(sql), params)]
@@ -0,0 +1,169 @@
+"""
+模板缩略图
+上传的图片按内容哈希命名（相同文件只存一份），多尺寸 WebP 缩略图由后台线程池生成，
+命名为 thumbs/{hash}_{宽度}.webp，可直接拼成 srcset。请求未生成的尺寸时等待或补生成。
+"""
+
+import asyncio
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+from PIL import Image
+
+from services.config_service import USER_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# 缩略图宽度（像素），等比缩放，不放大
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_FORMAT = "webp"
+THUMBNAIL_QUALITY = int(os.environ.get("TEMPLATE_THUMBNAIL_QUALITY", 80))
+THUMBNAIL_WORKERS = int(os.environ.get("TEMPLATE_THUMBNAIL_WORKERS", max(1, min(4, (os.cpu_count() or 2) // 2))))
+
+TEMPLATE_UPLOAD_DIR = os.path.join(USER_DATA_DIR, "template_uploads")
+TEMPLATE_UPLOAD_URL = "http://localhost:3000/api/templates/uploads"
+THUMBS_SUBFOLDER = "thumbs"
+_CHUNK_SIZE = 1024 * 1024
+_DIGEST_LENGTH = 64
+
+
+def upload_url(subfolder: str, filename: str) -> str:
+    return f"{TEMPLATE_UPLOAD_URL}/{subfolder}/{filename}"
+
+
+def is_content_digest(value: str) -> bool:
+    return len(value) == _DIGEST_LENGTH and all(c in "0123456789abcdef" for c in value)
+
+
+def _render_thumbnails(source_path: str, target_dir: str, digest: str) -> List[str]:
+    """生成全部尺寸，已存在的跳过；先写临时文件再改名，避免读到半个文件"""
+    written = []
+    with Image.open(source_path) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "P") else "RGB")
+        for width in THUMBNAIL_WIDTHS:
+            path = os.path.join(target_dir, f"{digest}_{width}.{THUMBNAIL_FORMAT}")
+            if os.path.exists(path):
+                continue
+            thumb = img.copy()
+            thumb.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+            fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                thumb.save(f, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=4)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+            written.append(path)
+    return written
+
+
+class TemplateThumbnailService:
+    """上传存储与后台缩略图生成"""
+
+    def __init__(self, upload_dir: str = TEMPLATE_UPLOAD_DIR, workers: int = THUMBNAIL_WORKERS):
+        self.upload_dir = upload_dir
+        self.thumbs_dir = os.path.join(upload_dir, THUMBS_SUBFOLDER)
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="template-thumb")
+        self._jobs: Dict[str, Future] = {}
+
+    def store_upload(self, file: UploadFile, subfolder: str) -> Tuple[str, str]:
+        """
+        分块写入并计算SHA-256，按内容哈希命名，返回 (文件路径, 哈希)。
+        同步方法，在线程池中调用。
+        """
+        extension = os.path.splitext(file.filename)[1].lower() if file.filename else ".jpg"
+        folder_path = os.path.join(self.upload_dir, subfolder)
+        os.makedirs(folder_path, exist_ok=True)
+
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=folder_path, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                while True:
+                    chunk = file.file.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    buffer.write(chunk)
+            digest = hasher.hexdigest()
+            file_path = os.path.join(folder_path, f"{digest}{extension}")
+            if os.path.exists(file_path):
+                os.remove(tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return file_path, digest
+
+    def submit(self, digest: str, source_path: str) -> Future:
+        """提交后台生成（同一图片只生成一次），不等待结果"""
+        job = self._jobs.get(digest)
+        if job is not None:
+            return job
+        job = self._executor.submit(_render_thumbnails, source_path, self.thumbs_dir, digest)
+        self._jobs[digest] = job
+
+        def _done(future: Future):
+            self._jobs.pop(digest, None)
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(f"缩略图生成失败 {source_path}: {future.exception()}")
+
+        job.add_done_callback(_done)
+        return job
+
+    def _find_source(self, digest: str) -> Optional[str]:
+        for path in glob.glob(os.path.join(self.upload_dir, "*", f"{digest}.*")):
+            if os.path.dirname(path) != self.thumbs_dir:
+                return path
+        return None
+
+    async def ensure(self, digest: str, width: int) -> Optional[str]:
+        """返回缩略图路径，尚未生成时等待后台任务或补生成，原图不存在时返回None"""
+        path = self.thumbnail_path(digest, width)
+        if os.path.exists(path):
+            return path
+        job = self._jobs.get(digest)
+        if job is None:
+            source_path = self._find_source(digest)
+            if source_path is None:
+                return None
+            job = self.submit(digest, source_path)
+        try:
+            await asyncio.wrap_future(job)
+        except Exception:
+            return None
+        return path if os.path.exists(path) else None
+
+    def thumbnail_path(self, digest: str, width: int) -> str:
+        return os.path.join(self.thumbs_dir, f"{digest}_{width}.{THUMBNAIL_FORMAT}")
+
+    def srcset(self, image_url: Optional[str]) -> Optional[str]:
+        """按内容哈希命名的上传图片返回 srcset，其他来源（如PSD缩略图接口）返回None"""
+        if not image_url or image_url.count("/") < 2:
+            return None
+        # 上传图片URL形如 {前缀}/{子目录}/{哈希}{扩展名}，缩略图在同一前缀下的 thumbs 子目录
+        prefix, _, filename = image_url.rsplit("/", 2)
+        digest = os.path.splitext(filename)[0]
+        if not is_content_digest(digest):
+            return None
+        return ", ".join(
+            f"{prefix}/{THUMBS_SUBFOLDER}/{digest}_{width}.{THUMBNAIL_FORMAT} {width}w"
+            for width in THUMBNAIL_WIDTHS
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局实例
+template_thumbnail_service = TemplateThumbnailService()
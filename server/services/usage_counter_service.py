@@ -0,0 +1,84 @@
+"""
+模板 / 字体使用次数缓冲
+使用次数先累加在内存里，后台任务定期用一条批量 UPDATE 写回，
+避免每次应用模板都单独占用一次 SQLite 写锁。读接口返回值叠加尚未写回的增量，关闭服务时写回剩余部分。
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from services.library_db_service import LibraryDatabase, template_db, font_db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("LIBRARY_USAGE_FLUSH_SECONDS", 5))
+
+
+class UsageCounterBuffer:
+    """一张表的 usage_count 写合并缓冲"""
+
+    def __init__(self, database: LibraryDatabase, table: str, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.database = database
+        self.table = table
+        self.interval = interval
+        self._pending: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, item_id: str, delta: int = 1):
+        self._pending[item_id] = self._pending.get(item_id, 0) + delta
+
+    def count(self, item_id: str, stored: Optional[int]) -> int:
+        """数据库中的值加上尚未写回的增量"""
+        return (stored or 0) + self._pending.get(item_id, 0)
+
+    async def flush(self) -> int:
+        """写回全部增量，返回更新的行数；失败时增量放回缓冲等待下次写回"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            now = datetime.utcnow()
+            try:
+                async with self.database.engine.begin() as conn:
+                    await conn.execute(
+                        text(f"UPDATE {self.table} SET usage_count = COALESCE(usage_count, 0) + :delta, "
+                             f"updated_at = :now WHERE id = :id"),
+                        [{"id": item_id, "delta": delta, "now": now} for item_id, delta in pending.items()]
+                    )
+            except Exception as e:
+                for item_id, delta in pending.items():
+                    self.add(item_id, delta)
+                logger.warning(f"{self.table} 使用次数写回失败，稍后重试: {e}")
+                return 0
+            return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写回剩余增量"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# 全局实例
+template_usage = UsageCounterBuffer(template_db, "template_items")
+font_usage = UsageCounterBuffer(font_db, "font_items")
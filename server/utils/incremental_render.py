@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+縮放結果的增量重渲染
+手動微調少量圖層後，只重新合成被移動/縮放圖層覆蓋的髒矩形區域，
+縮放後的圖層位圖在內存中緩存，重複編輯時無需再次合成和插值
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+from psd_tools import PSDImage
+
+from utils.resampling import DEFAULT_RESAMPLING_TIER
+from utils.resize_psd import collect_layers, position_from_item, render_resized_layer
+from utils.stored_layers import StoredLayerSource, open_stored_layers
+
+# 緩存的縮放圖層位圖總大小上限
+LAYER_BITMAP_CACHE_BYTES = int(os.environ.get("PSD_LAYER_BITMAP_CACHE_MB", 256)) * 1024 * 1024
+# 同時保持打開的PSD數量
+OPEN_PSD_CACHE_SIZE = 2
+
+Rect = Tuple[int, int, int, int]
+
+
+class LayerBitmapCache:
+    """
+    縮放後圖層位圖的LRU緩存
+
+    鍵為 (PSD路徑, PSD修改時間, 圖層ID, 寬, 高, 重採樣檔位, 已保存圖層圖像的修改時間)，
+    位置變化不影響緩存，只有尺寸變化或圖層圖像被編輯後才需要重新插值
+    """
+
+    def __init__(self, max_bytes: int = LAYER_BITMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._bitmaps: "OrderedDict[tuple, Optional[Image.Image]]" = OrderedDict()
+        self._bytes = 0
+        self._psds: "OrderedDict[tuple, Tuple[PSDImage, Dict[int, Any], List[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open_psd(self, psd_file_path: str) -> Tuple[Dict[int, Any], List[int]]:
+        """返回 (ID到圖層的映射, 按合成順序排列的圖層ID)"""
+        key = (psd_file_path, os.path.getmtime(psd_file_path))
+        with self._lock:
+            if key in self._psds:
+                self._psds.move_to_end(key)
+                _, layers_by_id, order = self._psds[key]
+                return layers_by_id, order
+
+        psd = PSDImage.open(psd_file_path)
+        all_layers = collect_layers(psd)
+        entry = (psd, dict(all_layers), [layer_id for layer_id, _ in all_layers])
+
+        with self._lock:
+            self._psds[key] = entry
+            while len(self._psds) > OPEN_PSD_CACHE_SIZE:
+                self._psds.popitem(last=False)
+        return entry[1], entry[2]
+
+    def get_bitmap(self,
+                   psd_file_path: str,
+                   layer_id: int,
+                   layer,
+                   new_pos: Dict[str, Any],
+                   target_width: int,
+                   target_height: int,
+                   resampling: str = DEFAULT_RESAMPLING_TIER,
+                   source: Optional[StoredLayerSource] = None) -> Optional[Image.Image]:
+        """獲取縮放後的圖層位圖，圖層在完整渲染中會被跳過時返回None"""
+        key = (psd_file_path, os.path.getmtime(psd_file_path), layer_id,
+               new_pos['width'], new_pos['height'], resampling,
+               source.version(layer_id) if source is not None else None)
+        with self._lock:
+            if key in self._bitmaps:
+                self._bitmaps.move_to_end(key)
+                return self._bitmaps[key]
+
+        # 跳過規則與完整渲染一致（不可見、圖層組、超出畫布等）
+        rendered = render_resized_layer(layer_id, layer, new_pos, target_width, target_height, resampling, source)
+        bitmap = rendered[0] if rendered else None
+
+        with self._lock:
+            self._bitmaps[key] = bitmap
+            self._bytes += bitmap.width * bitmap.height * 4 if bitmap else 0
+            while self._bytes > self.max_bytes and len(self._bitmaps) > 1:
+                _, evicted = self._bitmaps.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * 4 if evicted else 0
+        return bitmap
+
+
+def _box(new_pos: Dict[str, Any]) -> Rect:
+    return new_pos['left'], new_pos['top'], new_pos['right'], new_pos['bottom']
+
+
+def _intersect(a: Rect, b: Rect) -> Optional[Rect]:
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def _merge_rects(rects: List[Rect]) -> List[Rect]:
+    """合併相交的髒矩形，避免重疊區域被重複合成"""
+    merged: List[Rect] = []
+    for rect in rects:
+        while True:
+            for index, other in enumerate(merged):
+                if _intersect(rect, other):
+                    rect = (min(rect[0], other[0]), min(rect[1], other[1]),
+                            max(rect[2], other[2]), max(rect[3], other[3]))
+                    merged.pop(index)
+                    break
+            else:
+                break
+        merged.append(rect)
+    return merged
+
+
+def compute_dirty_rects(old_positions: Dict[int, Dict[str, Any]],
+                        new_positions: Dict[int, Dict[str, Any]],
+                        changed_ids: List[int],
+                        target_width: int,
+                        target_height: int) -> List[Rect]:
+    """髒矩形 = 變化圖層的舊框與新框，裁剪到畫布並合併"""
+    canvas = (0, 0, target_width, target_height)
+    rects = []
+    for layer_id in changed_ids:
+        for positions in (old_positions, new_positions):
+            pos = positions.get(layer_id)
+            if pos is None:
+                continue
+            rect = _intersect(_box(pos), canvas)
+            if rect:
+                rects.append(rect)
+    return _merge_rects(rects)
+
+
+def rerender_dirty_regions(psd_file_path: str,
+                           base_image: Image.Image,
+                           old_items: List[Dict[str, Any]],
+                           new_items: List[Dict[str, Any]],
+                           changed_ids: List[int],
+                           bitmap_cache: LayerBitmapCache,
+                           resampling: str = DEFAULT_RESAMPLING_TIER) -> Tuple[Image.Image, List[Rect]]:
+    """
+    在上一次的輸出圖像上只重繪髒矩形
+
+    每個髒矩形先清空，再按圖層順序合成所有與之相交的圖層在該矩形內的部分，
+    結果與完整重新渲染一致。
+
+    參數:
+        psd_file_path: 原始PSD文件路徑
+        base_image: 上一次的輸出圖像（目標尺寸）
+        old_items: 上一次的調整方案
+        new_items: 應用修改後的完整調整方案
+        changed_ids: 發生變化的圖層ID
+        bitmap_cache: 縮放圖層位圖緩存
+        resampling: 重採樣檔位，應與生成base_image時一致
+
+    返回:
+        (新圖像, 重繪的髒矩形列表)
+    """
+    target_width, target_height = base_image.size
+    old_positions = {item['id']: position_from_item(item) for item in old_items}
+    new_positions = {item['id']: position_from_item(item) for item in new_items}
+
+    dirty_rects = compute_dirty_rects(old_positions, new_positions, changed_ids, target_width, target_height)
+    canvas = base_image.convert('RGBA') if base_image.mode != 'RGBA' else base_image.copy()
+    if not dirty_rects:
+        return canvas, []
+
+    layers_by_id, order = bitmap_cache.open_psd(psd_file_path)
+    source = open_stored_layers(psd_file_path)
+
+    for rect in dirty_rects:
+        canvas.paste((0, 0, 0, 0), rect)
+
+        for layer_id in order:
+            new_pos = new_positions.get(layer_id)
+            if new_pos is None or layer_id not in layers_by_id:
+                continue
+            if _intersect(_box(new_pos), rect) is None:
+                continue
+            bitmap = bitmap_cache.get_bitmap(
+                psd_file_path, layer_id, layers_by_id[layer_id], new_pos, target_width, target_height,
+                resampling, source
+            )
+            if bitmap is None:
+                continue
+            # 以位圖實際大小為準（未縮放的圖層保持原始合成尺寸）
+            bitmap_rect = (new_pos['left'], new_pos['top'],
+                           new_pos['left'] + bitmap.width, new_pos['top'] + bitmap.height)
+            overlap = _intersect(bitmap_rect, rect)
+            if overlap is None:
+                continue
+            crop_box = (overlap[0] - new_pos['left'], overlap[1] - new_pos['top'],
+                        overlap[2] - new_pos['left'], overlap[3] - new_pos['top'])
+            canvas.alpha_composite(bitmap, dest=overlap[:2], source=crop_box)
+
+    print(f"增量重渲染 {len(changed_ids)} 個圖層，{len(dirty_rects)} 個髒矩形")
+    return canvas, dirty_rects
+
+
+# 自檢：所有圖層平移後，增量結果應與完整重新渲染逐像素一致（需至少2個圖層才能覆蓋多圖層重繪）
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import json
+
+    from utils.resize_psd import resize_psd_with_new_positions
+
+    if len(sys.argv) < 2:
+        print("使用方法: python -m utils.incremental_render <PSD文件> [平移像素]")
+        sys.exit(1)
+
+    psd_file = sys.argv[1]
+    offset = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    psd = PSDImage.open(psd_file)
+    layer_ids = [layer_id for layer_id, _ in collect_layers(psd)]
+    if len(layer_ids) < 2:
+        print(f"PSD只有 {len(layer_ids)} 個圖層，至少需要2個")
+        sys.exit(1)
+
+    def _item(layer_id: int, layer, shift: int) -> Dict[str, Any]:
+        return {'id': layer_id, 'new_coords': {
+            'left': layer.left + shift, 'top': layer.top + shift,
+            'right': layer.right + shift, 'bottom': layer.bottom + shift,
+        }}
+
+    layers = dict(collect_layers(psd))
+    old_items = [_item(layer_id, layers[layer_id], 0) for layer_id in layer_ids]
+    new_items = [_item(layer_id, layers[layer_id], offset) for layer_id in layer_ids]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        def _full_render(items: List[Dict[str, Any]], name: str) -> Image.Image:
+            positions_path = os.path.join(temp_dir, f"{name}.json")
+            with open(positions_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f)
+            return resize_psd_with_new_positions(psd_file, positions_path, os.path.join(temp_dir, f"{name}.png"),
+                                                 psd.width, psd.height)
+
+        base_image = _full_render(old_items, "old")
+        expected = _full_render(new_items, "new")
+        result, _ = rerender_dirty_regions(psd_file, base_image, old_items, new_items, layer_ids,
+                                           LayerBitmapCache())
+
+    if result.tobytes() != expected.tobytes():
+        print("❌ 增量重渲染結果與完整渲染不一致")
+        sys.exit(1)
+    print(f"✅ {len(layer_ids)} 個圖層增量重渲染結果與完整渲染一致")
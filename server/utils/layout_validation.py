@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+PSD縮放布局校驗與本地修復
+一次性用NumPy數組檢查模型給出的所有圖層框，能在本地修正的直接修正，
+只把無法修正的圖層交回給模型重新生成
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 寬高比偏差超過該比例時視為變形
+DEFAULT_ASPECT_TOLERANCE = 0.02
+
+
+@dataclass
+class LayoutValidationResult:
+    positions: List[Dict[str, Any]]
+    # 模型沒有返回、已按比例縮放補全的圖層
+    missing_ids: List[int] = field(default_factory=list)
+    # 坐標無法解析或框退化（寬高<=0）、暫時按比例縮放補全的圖層，可交回模型重新生成
+    unresolved_ids: List[int] = field(default_factory=list)
+    # 寬高比被修正的圖層
+    aspect_fixed_ids: List[int] = field(default_factory=list)
+    # 超出畫布被縮小/平移的圖層
+    clamped_ids: List[int] = field(default_factory=list)
+    # 模型返回但原始圖層中不存在的ID（已丟棄）
+    unknown_ids: List[Any] = field(default_factory=list)
+
+    @property
+    def repaired_count(self) -> int:
+        return (len(self.missing_ids) + len(self.unresolved_ids)
+                + len(self.aspect_fixed_ids) + len(self.clamped_ids))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "missing": len(self.missing_ids),
+            "unresolved": len(self.unresolved_ids),
+            "aspect_fixed": len(self.aspect_fixed_ids),
+            "clamped": len(self.clamped_ids),
+            "unknown": len(self.unknown_ids),
+        }
+
+
+def _coords_array(items: List[Optional[Dict[str, Any]]]) -> np.ndarray:
+    """把new_coords轉為 (N, 4) 浮點數組，缺失或非數字的坐標為NaN"""
+    boxes = np.full((len(items), 4), np.nan, dtype=np.float64)
+    for row, item in enumerate(items):
+        coords = item.get('new_coords') if item else None
+        if not isinstance(coords, dict):
+            continue
+        for col, key in enumerate(('left', 'top', 'right', 'bottom')):
+            value = coords.get(key)
+            if isinstance(value, bool):
+                continue
+            try:
+                boxes[row, col] = float(value)
+            except (TypeError, ValueError):
+                pass
+    return boxes
+
+
+def proportional_boxes(original: np.ndarray,
+                       original_width: int,
+                       original_height: int,
+                       target_width: int,
+                       target_height: int) -> np.ndarray:
+    """等比縮放原始框並在目標畫布中居中，作為模型結果不可用時的兜底方案"""
+    scale = min(target_width / original_width, target_height / original_height)
+    offset_x = (target_width - original_width * scale) / 2
+    offset_y = (target_height - original_height * scale) / 2
+    return original * scale + np.array([offset_x, offset_y, offset_x, offset_y])
+
+
+def validate_layout(new_positions: List[Dict[str, Any]],
+                    layers_info: List[Dict[str, Any]],
+                    original_width: int,
+                    original_height: int,
+                    target_width: int,
+                    target_height: int,
+                    fill_missing: bool = True,
+                    aspect_tolerance: float = DEFAULT_ASPECT_TOLERANCE) -> LayoutValidationResult:
+    """
+    校驗並修復模型生成的圖層布局
+
+    - 缺失的圖層：按原始位置等比縮放補全（fill_missing為False時不補，用於流式逐個校驗）
+    - 坐標非數字或框退化：無法在本地推斷，先按比例兜底並記錄在unresolved_ids中
+    - 寬高比變形：在模型給出的框內按原始比例居中重新擬合
+    - 超出畫布：先等比縮小到畫布內，再平移回邊界內
+
+    Args:
+        new_positions: 模型輸出（已回填圖層字段）
+        layers_info: 原始圖層信息
+        original_width: 原始寬度
+        original_height: 原始高度
+        target_width: 目標寬度
+        target_height: 目標高度
+        fill_missing: 是否補全模型未返回的圖層
+        aspect_tolerance: 允許的寬高比相對偏差
+
+    Returns:
+        LayoutValidationResult，positions中的坐標均為畫布內的整數
+    """
+    layers_by_id = {info['id']: info for info in layers_info}
+    items_by_id: Dict[int, Dict[str, Any]] = {}
+    unknown_ids = []
+    for item in new_positions:
+        layer_id = item.get('id') if isinstance(item, dict) else None
+        if layer_id in layers_by_id:
+            items_by_id[layer_id] = item
+        else:
+            unknown_ids.append(layer_id)
+
+    if fill_missing:
+        checked_infos = layers_info
+    else:
+        checked_infos = [layers_by_id[layer_id] for layer_id in items_by_id]
+
+    result = LayoutValidationResult(positions=[], unknown_ids=unknown_ids)
+    if not checked_infos:
+        return result
+
+    ids = np.array([info['id'] for info in checked_infos])
+    original = np.array(
+        [[info['left'], info['top'], info['right'], info['bottom']] for info in checked_infos],
+        dtype=np.float64
+    )
+    items = [items_by_id.get(info['id']) for info in checked_infos]
+    boxes = _coords_array(items)
+
+    present = np.array([item is not None for item in items])
+    orig_w = original[:, 2] - original[:, 0]
+    orig_h = original[:, 3] - original[:, 1]
+    has_area = (orig_w > 0) & (orig_h > 0)
+
+    # 1. 缺失與無效的框
+    new_w = boxes[:, 2] - boxes[:, 0]
+    new_h = boxes[:, 3] - boxes[:, 1]
+    finite = np.isfinite(boxes).all(axis=1)
+    degenerate = finite & has_area & ((new_w <= 0) | (new_h <= 0))
+    missing = ~present
+    unresolved = present & (~finite | degenerate)
+
+    fallback = missing | unresolved
+    if fallback.any():
+        boxes[fallback] = proportional_boxes(
+            original[fallback], original_width, original_height, target_width, target_height
+        )
+
+    # 2. 寬高比修正：背景等鋪滿原始畫布的圖層允許拉伸
+    new_w = boxes[:, 2] - boxes[:, 0]
+    new_h = boxes[:, 3] - boxes[:, 1]
+    full_canvas = (orig_w >= original_width) & (orig_h >= original_height)
+    checkable = has_area & ~fallback & ~full_canvas & (new_w > 0) & (new_h > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect_ratio = (new_w / new_h) / (orig_w / orig_h)
+    distorted = checkable & (np.abs(aspect_ratio - 1) > aspect_tolerance)
+    if distorted.any():
+        fit = np.minimum(new_w[distorted] / orig_w[distorted], new_h[distorted] / orig_h[distorted])
+        fit_w = orig_w[distorted] * fit
+        fit_h = orig_h[distorted] * fit
+        center_x = (boxes[distorted, 0] + boxes[distorted, 2]) / 2
+        center_y = (boxes[distorted, 1] + boxes[distorted, 3]) / 2
+        boxes[distorted] = np.stack([
+            center_x - fit_w / 2, center_y - fit_h / 2,
+            center_x + fit_w / 2, center_y + fit_h / 2
+        ], axis=1)
+
+    # 3. 超出畫布：過大的框先等比縮小，再平移進畫布
+    new_w = boxes[:, 2] - boxes[:, 0]
+    new_h = boxes[:, 3] - boxes[:, 1]
+    out_of_bounds = has_area & (
+        (boxes[:, 0] < 0) | (boxes[:, 1] < 0)
+        | (boxes[:, 2] > target_width) | (boxes[:, 3] > target_height)
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shrink = np.minimum(1.0, np.minimum(target_width / new_w, target_height / new_h))
+    shrink = np.where(out_of_bounds & np.isfinite(shrink), shrink, 1.0)
+    # 鋪滿畫布的圖層各軸獨立裁到畫布大小，不強制等比
+    new_w = np.where(full_canvas, np.minimum(new_w, target_width), new_w * shrink)
+    new_h = np.where(full_canvas, np.minimum(new_h, target_height), new_h * shrink)
+    center_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    center_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    left = np.clip(center_x - new_w / 2, 0, np.maximum(target_width - new_w, 0))
+    top = np.clip(center_y - new_h / 2, 0, np.maximum(target_height - new_h, 0))
+
+    # 4. 取整並保證取整後仍在畫布內
+    width_int = np.clip(np.rint(new_w), 0, target_width).astype(np.int64)
+    height_int = np.clip(np.rint(new_h), 0, target_height).astype(np.int64)
+    left_int = np.clip(np.rint(left), 0, target_width - width_int).astype(np.int64)
+    top_int = np.clip(np.rint(top), 0, target_height - height_int).astype(np.int64)
+
+    for row, info in enumerate(checked_infos):
+        item = items[row]
+        if item is None:
+            item = {
+                'id': info['id'],
+                'name': info['name'],
+                'type': info['type'],
+                'level': info.get('level', 0),
+                'visible': info.get('visible', True),
+                'original_coords': {
+                    'left': info['left'],
+                    'top': info['top'],
+                    'right': info['right'],
+                    'bottom': info['bottom'],
+                },
+                'adjustment_reason': '模型未返回該圖層，按原始位置等比縮放',
+            }
+        item['new_coords'] = {
+            'left': int(left_int[row]),
+            'top': int(top_int[row]),
+            'right': int(left_int[row] + width_int[row]),
+            'bottom': int(top_int[row] + height_int[row]),
+        }
+        result.positions.append(item)
+
+    result.missing_ids = ids[missing].tolist()
+    result.unresolved_ids = ids[unresolved].tolist()
+    result.aspect_fixed_ids = ids[distorted].tolist()
+    result.clamped_ids = ids[out_of_bounds & ~fallback].tolist()
+
+    if result.repaired_count or unknown_ids:
+        logger.info(f"布局校驗修復: {result.summary()}")
+    return result
+
+
+def resolve_cross_cluster_overlaps(positions: List[Dict[str, Any]],
+                                   cluster_of: Dict[int, int],
+                                   layers_info: List[Dict[str, Any]],
+                                   original_width: int,
+                                   original_height: int,
+                                   target_width: int,
+                                   target_height: int) -> List[int]:
+    """
+    消除分簇布局在簇邊界上產生的新重疊
+
+    只處理來自不同簇、原始布局中不重疊而新布局中重疊的前景圖層對；
+    沿穿透深度較小的軸把較小的圖層推開，並保持在畫布內。原地修改positions。
+
+    Returns:
+        被移動的圖層ID
+    """
+    layers_by_id = {info['id']: info for info in layers_info}
+    candidates = [
+        item for item in positions
+        if item['id'] in cluster_of and item.get('visible', True) and item.get('type') != 'group'
+        and not _covers_canvas(layers_by_id.get(item['id']), original_width, original_height)
+    ]
+    if len(candidates) < 2:
+        return []
+
+    ids = np.array([item['id'] for item in candidates])
+    clusters = np.array([cluster_of[layer_id] for layer_id in ids])
+    new = np.array([[item['new_coords'][key] for key in ('left', 'top', 'right', 'bottom')]
+                    for item in candidates], dtype=np.float64)
+    original = np.array([[layers_by_id[layer_id][key] for key in ('left', 'top', 'right', 'bottom')]
+                         for layer_id in ids], dtype=np.float64)
+
+    def overlap_matrix(boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        dx = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+        dy = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+        return dx, dy
+
+    orig_dx, orig_dy = overlap_matrix(original)
+    originally_overlapping = (orig_dx > 0) & (orig_dy > 0)
+    cross_cluster = clusters[:, None] != clusters[None, :]
+    area = (new[:, 2] - new[:, 0]) * (new[:, 3] - new[:, 1])
+
+    moved = []
+    new_dx, new_dy = overlap_matrix(new)
+    conflicts = np.argwhere(np.triu(
+        cross_cluster & ~originally_overlapping & (new_dx > 0) & (new_dy > 0), k=1
+    ))
+    for i, j in conflicts:
+        # 前面的推開可能已經消除了本對重疊，重新計算
+        dx = min(new[i, 2], new[j, 2]) - max(new[i, 0], new[j, 0])
+        dy = min(new[i, 3], new[j, 3]) - max(new[i, 1], new[j, 1])
+        if dx <= 0 or dy <= 0:
+            continue
+        mover, anchor = (i, j) if area[i] <= area[j] else (j, i)
+        width = new[mover, 2] - new[mover, 0]
+        height = new[mover, 3] - new[mover, 1]
+        if dx <= dy:
+            shift = dx if (new[mover, 0] + new[mover, 2]) >= (new[anchor, 0] + new[anchor, 2]) else -dx
+            left = np.clip(new[mover, 0] + shift, 0, max(target_width - width, 0))
+            new[mover, [0, 2]] = [left, left + width]
+        else:
+            shift = dy if (new[mover, 1] + new[mover, 3]) >= (new[anchor, 1] + new[anchor, 3]) else -dy
+            top = np.clip(new[mover, 1] + shift, 0, max(target_height - height, 0))
+            new[mover, [1, 3]] = [top, top + height]
+        moved.append(int(ids[mover]))
+
+    moved_set = set(moved)
+    for row, item in enumerate(candidates):
+        if int(ids[row]) in moved_set:
+            item['new_coords'] = {
+                'left': int(new[row, 0]),
+                'top': int(new[row, 1]),
+                'right': int(new[row, 2]),
+                'bottom': int(new[row, 3]),
+            }
+
+    if moved_set:
+        logger.info(f"消除跨簇重疊: 移動 {len(moved_set)} 個圖層")
+    return sorted(moved_set)
+
+
+def _covers_canvas(info: Optional[Dict[str, Any]], original_width: int, original_height: int) -> bool:
+    """鋪滿原始畫布的圖層（背景）與任何圖層重疊都是正常的"""
+    if info is None:
+        return False
+    return (info['right'] - info['left'] >= original_width
+            and info['bottom'] - info['top'] >= original_height)
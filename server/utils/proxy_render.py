@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+PSD低分辨率代理渲染
+每個PSD只做一次全部圖層的合成並縮小到代理尺寸，之後任意布局的預覽都只在小圖上合成
+已上傳的PSD與完整渲染一樣優先使用導出的圖層圖像，預覽包含通過 /update_layer 所做的修改
+"""
+
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image
+from psd_tools import PSDImage
+
+from utils.resampling import resample_layer
+from utils.resize_psd import collect_layers, position_from_item
+from utils.stored_layers import open_stored_layers
+
+# 代理圖層與預覽畫布的最長邊
+PROXY_MAX_EDGE = int(os.environ.get("PSD_PROXY_MAX_EDGE", 512))
+
+
+@dataclass
+class ProxyLayerSet:
+    """單個PSD的代理圖層集合"""
+    width: int
+    height: int
+    scale: float
+    # 按圖層順序排列的 (layer_id, 代理圖像)
+    layers: List[Tuple[int, Image.Image]] = field(default_factory=list)
+    build_seconds: float = 0.0
+
+
+def build_proxy_layers(psd_file_path: str, max_edge: int = PROXY_MAX_EDGE) -> ProxyLayerSet:
+    """
+    合成所有可渲染圖層並按原始畫布最長邊縮小到max_edge
+
+    只保留渲染時會用到的圖層（可見、非圖層組、面積不為0），ID與get_psd_layers_info一致
+    """
+    start = time.perf_counter()
+    psd = PSDImage.open(psd_file_path)
+    source = open_stored_layers(psd_file_path)
+    scale = min(1.0, max_edge / max(psd.width, psd.height))
+    proxy = ProxyLayerSet(width=psd.width, height=psd.height, scale=scale)
+
+    for layer_id, layer in collect_layers(psd):
+        if layer.kind == 'group' or not layer.visible:
+            continue
+        left, top, right, bottom = layer.bbox
+        if right - left <= 0 or bottom - top <= 0:
+            continue
+        try:
+            layer_image = source.load(layer_id) if source is not None else None
+            if layer_image is None:
+                layer_image = layer.composite()
+        except Exception as e:
+            print(f"ID {layer_id}: {layer.name} - 代理渲染失敗: {e}")
+            continue
+        if layer_image is None or layer_image.width == 0 or layer_image.height == 0:
+            continue
+        if layer_image.mode != 'RGBA':
+            layer_image = layer_image.convert('RGBA')
+
+        proxy_size = (
+            max(1, round(layer_image.width * scale)),
+            max(1, round(layer_image.height * scale))
+        )
+        layer_image = resample_layer(layer_image, proxy_size, "balanced")
+        proxy.layers.append((layer_id, layer_image))
+
+    proxy.build_seconds = time.perf_counter() - start
+    return proxy
+
+
+def stored_layers_version(psd_file_path: str, layer_ids: List[int]) -> str:
+    """代理圖層所用的已保存圖層圖像的版本摘要，圖層被替換後改變；沒有導出圖層時為空字符串"""
+    source = open_stored_layers(psd_file_path)
+    if source is None:
+        return ""
+    versions = [source.version(layer_id) for layer_id in layer_ids]
+    return hashlib.sha1(repr(versions).encode('ascii')).hexdigest()[:16]
+
+
+def render_proxy_preview(proxy: ProxyLayerSet,
+                         new_positions: List[Dict[str, Any]],
+                         target_width: int,
+                         target_height: int,
+                         max_edge: int = PROXY_MAX_EDGE) -> Image.Image:
+    """
+    用代理圖層按給定布局合成預覽圖
+
+    預覽畫布等比縮小到最長邊max_edge，坐標仍使用目標畫布坐標
+    """
+    preview_scale = min(1.0, max_edge / max(target_width, target_height))
+    canvas_size = (
+        max(1, round(target_width * preview_scale)),
+        max(1, round(target_height * preview_scale))
+    )
+    canvas = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+
+    pos_map: Dict[int, Dict[str, Any]] = {}
+    for item in new_positions:
+        try:
+            pos_map[item['id']] = position_from_item(item)
+        except (KeyError, TypeError):
+            continue
+
+    for layer_id, layer_image in proxy.layers:
+        new_pos = pos_map.get(layer_id)
+        if new_pos is None or not new_pos['visible'] or new_pos['type'] == 'group':
+            continue
+        left = round(new_pos['left'] * preview_scale)
+        top = round(new_pos['top'] * preview_scale)
+        width = round(new_pos['width'] * preview_scale)
+        height = round(new_pos['height'] * preview_scale)
+        if width <= 0 or height <= 0:
+            continue
+
+        if layer_image.size != (width, height):
+            layer_image = layer_image.resize((width, height), Image.Resampling.BILINEAR)
+
+        # 裁掉超出畫布的部分，alpha_composite要求目標區域在畫布內
+        crop_left = max(0, -left)
+        crop_top = max(0, -top)
+        crop_right = min(width, canvas_size[0] - left)
+        crop_bottom = min(height, canvas_size[1] - top)
+        if crop_right <= crop_left or crop_bottom <= crop_top:
+            continue
+        canvas.alpha_composite(
+            layer_image,
+            dest=(left + crop_left, top + crop_top),
+            source=(crop_left, crop_top, crop_right, crop_bottom)
+        )
+
+    return canvas
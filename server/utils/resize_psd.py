@@ -5,17 +5,159 @@ PSD圖層縮放和重建工具
 """
 
 from psd_tools import PSDImage
+from psd_tools.api.layers import PixelLayer
 from PIL import Image
 import json
+import os
 import sys
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils.resampling import DEFAULT_RESAMPLING_TIER, resample_layer
+from utils.stored_layers import StoredLayerSource, open_stored_layers
+
+
+def position_from_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """將模型輸出的圖層項轉換為渲染使用的位置信息"""
+    new_coord = item['new_coords']
+    return {
+        'id': item['id'],
+        'name': item.get('name', ''),
+        'type': item.get('type', 'unknown'),
+        'level': item.get('level', 0),
+        'left': new_coord['left'],
+        'top': new_coord['top'],
+        'right': new_coord['right'],
+        'bottom': new_coord['bottom'],
+        'width': new_coord['right'] - new_coord['left'],
+        'height': new_coord['bottom'] - new_coord['top'],
+        'visible': item.get('visible', True)  # 默認可見
+    }
+
+
+def collect_layers(psd: PSDImage) -> List[Tuple[int, Any]]:
+    """按深度優先順序收集所有圖層，ID與get_psd_layers_info一致"""
+    all_layers = []
+    layer_id = 0
+
+    def visit(layer):
+        """遞歸收集所有圖層"""
+        nonlocal layer_id
+        all_layers.append((layer_id, layer))
+        layer_id += 1
+
+        if hasattr(layer, '__iter__'):
+            for child in layer:
+                visit(child)
+
+    for layer in psd:
+        visit(layer)
+
+    return all_layers
+
+
+def render_resized_layer(layer_id: int,
+                         layer,
+                         new_pos: Dict[str, Any],
+                         target_width: int,
+                         target_height: int,
+                         resampling: str = DEFAULT_RESAMPLING_TIER,
+                         source: Optional[StoredLayerSource] = None) -> Optional[Tuple[Image.Image, int, int]]:
+    """
+    渲染並縮放單個圖層，resampling為重採樣檔位（quality / balanced / draft），
+    提供source時優先使用上傳時導出的圖層圖像
+
+    返回:
+        (圖層圖像, left, top)，圖層被跳過時返回None
+    """
+    # 跳過不可見的圖層
+    if not new_pos['visible']:
+        print(f"ID {layer_id}: {layer.name} - 跳過（不可見）")
+        return None
+
+    # 跳過無效尺寸的圖層
+    if new_pos['width'] == 0 or new_pos['height'] == 0:
+        print(f"ID {layer_id}: {layer.name} - 跳過（尺寸為0）")
+        return None
+
+    # 跳過圖層組，只處理實際的圖層（避免重複渲染）
+    if new_pos['type'] == 'group':
+        print(f"ID {layer_id}: {layer.name} - 跳過（圖層組）")
+        return None
+
+    try:
+        # 已保存且未過期的圖層圖像直接使用，否則渲染當前圖層為圖像（使用最大質量）
+        layer_image = source.load(layer_id) if source is not None else None
+        if layer_image is None:
+            layer_image = layer.composite()
+
+        if layer_image is None or layer_image.size[0] == 0 or layer_image.size[1] == 0:
+            print(f"ID {layer_id}: {layer.name} - 跳過（無法渲染）")
+            return None
+
+        # 確保圖像是RGBA模式
+        if layer_image.mode != 'RGBA':
+            layer_image = layer_image.convert('RGBA')
+
+        old_bbox = layer.bbox
+        old_width = old_bbox[2] - old_bbox[0]
+        old_height = old_bbox[3] - old_bbox[1]
+
+        new_left = new_pos['left']
+        new_top = new_pos['top']
+        new_width = new_pos['width']
+        new_height = new_pos['height']
+
+        # 如果尺寸發生變化（或已保存的圖層圖像與原始框尺寸不同），使用高質量插值進行resize
+        if layer_image.size != (new_width, new_height):
+            if new_width > 0 and new_height > 0:
+                layer_image = resample_layer(layer_image, (new_width, new_height), resampling)
+
+                print(f"ID {layer_id}: {layer.name}")
+                print(f"  原始尺寸: {old_width}x{old_height}")
+                print(f"  新尺寸: {new_width}x{new_height}")
+                print(f"  新位置: ({new_left}, {new_top})")
+        else:
+            print(f"ID {layer_id}: {layer.name} - 尺寸未變化，位置: ({new_left}, {new_top})")
+
+        # 確保新位置在畫布範圍內
+        if (new_left >= 0 and new_top >= 0 and
+            new_left + new_width <= target_width and
+            new_top + new_height <= target_height):
+            return layer_image, new_left, new_top
+
+        print(f"ID {layer_id}: {layer.name} - 位置超出畫布範圍，跳過")
+        return None
+
+    except Exception as e:
+        print(f"ID {layer_id}: {layer.name} - 處理失敗: {e}")
+        return None
+
+
+def _composite_onto(canvas: Image.Image, layer_image: Image.Image, left: int, top: int) -> None:
+    """粘貼到新畫布上（使用alpha通道進行合成）"""
+    if layer_image.mode == 'RGBA':
+        canvas.alpha_composite(layer_image, (left, top))
+    else:
+        canvas.paste(layer_image, (left, top), layer_image)
+
+
+def save_output(new_canvas: Image.Image, output_path: str) -> str:
+    """保存為高質量PNG，返回實際輸出路徑"""
+    output_png = output_path.rsplit('.', 1)[0] + '.png'
+    new_canvas.save(output_png, 'PNG', optimize=False, compress_level=0, dpi=(300, 300))
+
+    print(f"\n輸出圖像已保存到: {output_png}")
+    print(f"最終尺寸: {new_canvas.width} x {new_canvas.height}")
+    return output_png
 
 
-def resize_psd_with_new_positions(psd_file_path: str, 
-                                 new_pos_json_path: str, 
+def resize_psd_with_new_positions(psd_file_path: str,
+                                 new_pos_json_path: str,
                                  output_path: str,
                                  target_width: int,
-                                 target_height: int) -> Image.Image:
+                                 target_height: int,
+                                 resampling: str = DEFAULT_RESAMPLING_TIER) -> Image.Image:
     """
     根據新的位置信息對每個圖層進行resize和repositioning
 
@@ -25,6 +167,7 @@ def resize_psd_with_new_positions(psd_file_path: str,
         output_path: 輸出文件路徑
         target_width: 目標寬度
         target_height: 目標高度
+        resampling: 重採樣檔位
     """
     # 讀取PSD文件
     psd = PSDImage.open(psd_file_path)
@@ -35,22 +178,9 @@ def resize_psd_with_new_positions(psd_file_path: str,
 
     # 創建ID到新位置的映射，轉換新的JSON格式
     pos_map = {}
-    
+
     for item in new_positions:
-        new_coord = item['new_coords']
-        pos_map[item['id']] = {
-            'id': item['id'],
-            'name': item['name'],
-            'type': item.get('type', 'unknown'),
-            'level': item.get('level', 0),
-            'left': new_coord['left'],
-            'top': new_coord['top'],
-            'right': new_coord['right'],
-            'bottom': new_coord['bottom'],
-            'width': new_coord['right'] - new_coord['left'],
-            'height': new_coord['bottom'] - new_coord['top'],
-            'visible': item.get('visible', True)  # 默認可見
-        }
+        pos_map[item['id']] = position_from_item(item)
 
     print(f"原始畫布尺寸: {psd.width} x {psd.height}")
     print(f"目標畫布尺寸: {target_width} x {target_height}")
@@ -60,21 +190,8 @@ def resize_psd_with_new_positions(psd_file_path: str,
     new_canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
 
     # 收集所有圖層
-    all_layers = []
-    layer_id = 0
-
-    def collect_layers(layer):
-        """遞歸收集所有圖層"""
-        nonlocal layer_id
-        all_layers.append((layer_id, layer))
-        layer_id += 1
-
-        if hasattr(layer, '__iter__'):
-            for child in layer:
-                collect_layers(child)
-
-    for layer in psd:
-        collect_layers(layer)
+    all_layers = collect_layers(psd)
+    source = open_stored_layers(psd_file_path)
 
     print(f"收集到 {len(all_layers)} 個圖層\n")
 
@@ -84,87 +201,167 @@ def resize_psd_with_new_positions(psd_file_path: str,
         if layer_id not in pos_map:
             continue
 
-        new_pos = pos_map[layer_id]
-
-        # 跳過不可見的圖層
-        if not new_pos['visible']:
-            print(f"ID {layer_id}: {layer.name} - 跳過（不可見）")
+        rendered = render_resized_layer(layer_id, layer, pos_map[layer_id], target_width, target_height,
+                                        resampling, source)
+        if rendered is None:
             continue
 
-        # 跳過無效尺寸的圖層
-        if new_pos['width'] == 0 or new_pos['height'] == 0:
-            print(f"ID {layer_id}: {layer.name} - 跳過（尺寸為0）")
-            continue
+        layer_image, new_left, new_top = rendered
+        _composite_onto(new_canvas, layer_image, new_left, new_top)
+        processed_count += 1
 
-        # 跳過圖層組，只處理實際的圖層（避免重複渲染）
-        if new_pos['type'] == 'group':
-            print(f"ID {layer_id}: {layer.name} - 跳過（圖層組）")
-            continue
+    print(f"\n成功處理 {processed_count} 個圖層")
 
-        try:
-            # 渲染當前圖層為圖像（使用最大質量）
-            layer_image = layer.composite()
+    save_output(new_canvas, output_path)
 
-            if layer_image is None or layer_image.size[0] == 0 or layer_image.size[1] == 0:
-                print(f"ID {layer_id}: {layer.name} - 跳過（無法渲染）")
-                continue
+    return new_canvas
 
-            # 確保圖像是RGBA模式
-            if layer_image.mode != 'RGBA':
-                layer_image = layer_image.convert('RGBA')
-
-            old_bbox = layer.bbox
-            old_width = old_bbox[2] - old_bbox[0]
-            old_height = old_bbox[3] - old_bbox[1]
-
-            new_left = new_pos['left']
-            new_top = new_pos['top']
-            new_width = new_pos['width']
-            new_height = new_pos['height']
-
-            # 如果尺寸發生變化，使用高質量插值進行resize
-            if old_width != new_width or old_height != new_height:
-                if new_width > 0 and new_height > 0:
-                    # 使用LANCZOS插值進行高質量縮放
-                    layer_image = layer_image.resize(
-                        (new_width, new_height),
-                        Image.Resampling.LANCZOS
-                    )
-
-                    print(f"ID {layer_id}: {layer.name}")
-                    print(f"  原始尺寸: {old_width}x{old_height}")
-                    print(f"  新尺寸: {new_width}x{new_height}")
-                    print(f"  新位置: ({new_left}, {new_top})")
-            else:
-                print(f"ID {layer_id}: {layer.name} - 尺寸未變化，位置: ({new_left}, {new_top})")
-
-            # 確保新位置在畫布範圍內
-            if (new_left >= 0 and new_top >= 0 and 
-                new_left + new_width <= target_width and 
-                new_top + new_height <= target_height):
-                
-                # 粘貼到新畫布上（使用alpha通道進行合成）
-                if layer_image.mode == 'RGBA':
-                    new_canvas.alpha_composite(layer_image, (new_left, new_top))
-                else:
-                    new_canvas.paste(layer_image, (new_left, new_top), layer_image)
-                processed_count += 1
-            else:
-                print(f"ID {layer_id}: {layer.name} - 位置超出畫布範圍，跳過")
-
-        except Exception as e:
-            print(f"ID {layer_id}: {layer.name} - 處理失敗: {e}")
 
-    print(f"\n成功處理 {processed_count} 個圖層")
+class IncrementalLayerRenderer:
+    """
+    增量渲染器
 
-    # 保存為高質量PNG
-    output_png = output_path.rsplit('.', 1)[0] + '.png'
-    new_canvas.save(output_png, 'PNG', optimize=False, compress_level=0, dpi=(300, 300))
+    模型流式輸出時每收到一個圖層就調用render_layer進行縮放，
+    全部圖層到達後finalize按原始圖層順序合成畫布。
+    render_layer可在工作線程中調用，與模型生成並行。
+    """
 
-    print(f"\n輸出圖像已保存到: {output_png}")
-    print(f"最終尺寸: {new_canvas.width} x {new_canvas.height}")
+    def __init__(self,
+                 psd_file_path: str,
+                 target_width: int,
+                 target_height: int,
+                 resampling: str = DEFAULT_RESAMPLING_TIER):
+        self.psd = PSDImage.open(psd_file_path)
+        self.target_width = target_width
+        self.target_height = target_height
+        self.resampling = resampling
+        self.all_layers = collect_layers(self.psd)
+        self.layers_by_id = dict(self.all_layers)
+        self.source = open_stored_layers(psd_file_path)
+        self.rendered: Dict[int, Tuple[Image.Image, int, int]] = {}
+        self._lock = threading.Lock()
+
+        print(f"原始畫布尺寸: {self.psd.width} x {self.psd.height}")
+        print(f"目標畫布尺寸: {target_width} x {target_height}")
+        print(f"收集到 {len(self.all_layers)} 個圖層\n")
+
+    def render_layer(self, item: Dict[str, Any]) -> bool:
+        """渲染單個圖層，返回是否成功生成圖像"""
+        try:
+            new_pos = position_from_item(item)
+        except (KeyError, TypeError) as e:
+            print(f"圖層數據無效，跳過: {item} ({e})")
+            return False
+
+        layer_id = new_pos['id']
+        layer = self.layers_by_id.get(layer_id)
+        if layer is None:
+            print(f"ID {layer_id}: 圖層不存在，跳過")
+            return False
+
+        rendered = render_resized_layer(layer_id, layer, new_pos, self.target_width, self.target_height,
+                                        self.resampling, self.source)
+        if rendered is None:
+            return False
+
+        with self._lock:
+            self.rendered[layer_id] = rendered
+        return True
+
+    def finalize(self, output_path: str) -> Image.Image:
+        """按圖層順序合成並保存輸出圖像"""
+        new_canvas = Image.new('RGBA', (self.target_width, self.target_height), (0, 0, 0, 0))
+
+        processed_count = 0
+        for layer_id, _ in self.all_layers:
+            rendered = self.rendered.get(layer_id)
+            if rendered is None:
+                continue
+            layer_image, new_left, new_top = rendered
+            _composite_onto(new_canvas, layer_image, new_left, new_top)
+            processed_count += 1
+
+        print(f"\n成功處理 {processed_count} 個圖層")
+
+        save_output(new_canvas, output_path)
+
+        return new_canvas
+
+    def render_all(self, new_positions: List[Dict[str, Any]]) -> int:
+        """渲染完整的調整方案，返回成功渲染的圖層數"""
+        return sum(1 for item in new_positions if self.render_layer(item))
+
+    def _ordered_layers(self):
+        """按合成順序（自底向上）返回已渲染的圖層"""
+        for layer_id, layer in self.all_layers:
+            rendered = self.rendered.get(layer_id)
+            if rendered is not None:
+                yield layer_id, layer, rendered
+
+    def export_layers(self, output_dir: str) -> List[Dict[str, Any]]:
+        """
+        將每個已渲染圖層裁掉透明邊緣後單獨保存為PNG
+
+        返回:
+            按合成順序排列的圖層放置信息，可直接加載到畫布
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        placements = []
+        for z_index, (layer_id, layer, (layer_image, left, top)) in enumerate(self._ordered_layers()):
+            trimmed, trim_left, trim_top = _trim_transparent(layer_image)
+            if trimmed is None:
+                continue
+            filename = f"{layer_id}.png"
+            trimmed.save(os.path.join(output_dir, filename), 'PNG', compress_level=1)
+            placements.append({
+                'id': layer_id,
+                'name': layer.name,
+                'type': layer.kind,
+                'z_index': z_index,
+                'left': left + trim_left,
+                'top': top + trim_top,
+                'width': trimmed.width,
+                'height': trimmed.height,
+                'visible': True,
+                'file': filename,
+            })
+
+        print(f"導出 {len(placements)} 個圖層到: {output_dir}")
+        return placements
+
+    def save_psd(self, output_path: str) -> str:
+        """
+        將已渲染圖層寫為分層PSD（每個圖層一個像素圖層，圖層組被展平）
+
+        圖層直接複用已渲染的圖像按合成順序追加；psd-tools 需在記憶體中構建完整PSD後一次寫出
+        """
+        new_psd = PSDImage.new('RGBA', (self.target_width, self.target_height))
+        count = 0
+        for layer_id, layer, (layer_image, left, top) in self._ordered_layers():
+            trimmed, trim_left, trim_top = _trim_transparent(layer_image)
+            if trimmed is None:
+                continue
+            new_psd.append(PixelLayer.frompil(
+                trimmed, new_psd, layer.name or f"Layer {layer_id}",
+                top=top + trim_top, left=left + trim_left
+            ))
+            count += 1
 
-    return new_canvas
+        with open(output_path, 'wb') as f:
+            new_psd.save(f)
+
+        print(f"分層PSD已保存到: {output_path}（{count} 個圖層）")
+        return output_path
+
+
+def _trim_transparent(image: Image.Image) -> Tuple[Optional[Image.Image], int, int]:
+    """裁掉完全透明的邊緣，返回 (裁剪後圖像, 左偏移, 上偏移)，全透明時圖像為None"""
+    bbox = image.getchannel('A').getbbox()
+    if bbox is None:
+        return None, 0, 0
+    if bbox == (0, 0, image.width, image.height):
+        return image, 0, 0
+    return image.crop(bbox), bbox[0], bbox[1]
 
 
 # 使用示例
@@ -181,4 +378,3 @@ if __name__ == "__main__":
     target_height = int(sys.argv[5])
 
     resize_psd_with_new_positions(psd_file, new_pos_file, output_file, target_width, target_height)
-
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+已上傳PSD的圖層圖像來源
+上傳時每個圖層已導出為 {file_id}_layer_{idx}.png，縮放渲染時直接讀取，
+省去psd-tools重新合成，同時包含通過 /update_layer 所做的修改
+"""
+
+import os
+from typing import Optional
+
+from PIL import Image
+
+
+class StoredLayerSource:
+    """
+    按圖層ID讀取上傳時導出的圖層圖像
+
+    圖層索引與collect_layers的深度優先ID一致。圖像覆蓋圖層原始框，
+    尺寸與原始框不同時（例如編輯後）由渲染器縮放到新框
+    """
+
+    def __init__(self, psd_file_path: str):
+        self.prefix = os.path.splitext(psd_file_path)[0]
+        self.psd_mtime = os.path.getmtime(psd_file_path)
+
+    def _path(self, layer_id: int) -> str:
+        return f"{self.prefix}_layer_{layer_id}.png"
+
+    def version(self, layer_id: int) -> Optional[float]:
+        """圖層圖像的修改時間，不存在或比PSD舊（已過期）時返回None"""
+        try:
+            mtime = os.path.getmtime(self._path(layer_id))
+        except OSError:
+            return None
+        return mtime if mtime >= self.psd_mtime else None
+
+    def load(self, layer_id: int) -> Optional[Image.Image]:
+        """讀取RGBA圖層圖像，未命中時返回None，由調用方回退到composite"""
+        if self.version(layer_id) is None:
+            return None
+        try:
+            with Image.open(self._path(layer_id)) as image:
+                return image.convert('RGBA')
+        except (OSError, ValueError) as e:
+            print(f"ID {layer_id}: 讀取已保存的圖層圖像失敗，回退到重新合成: {e}")
+            return None
+
+
+def open_stored_layers(psd_file_path: str) -> Optional[StoredLayerSource]:
+    """只有經 /api/psd/upload 上傳的PSD（存在元數據文件）才有導出的圖層圖像"""
+    if not os.path.exists(f"{os.path.splitext(psd_file_path)[0]}_metadata.json"):
+        return None
+    return StoredLayerSource(psd_file_path)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试布局流式解析（不调用模型）
+说明文字里的方括号不能被当成JSON数组的开始
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加server目录到Python路径
+server_path = Path(__file__).parent / "server"
+sys.path.insert(0, str(server_path))
+
+from PIL import Image
+
+from services.gemini_psd_resize_service import GeminiPSDResizeService, IncrementalJSONArrayParser
+from services.layout_providers import LayoutProviderBase, LayoutRequest
+
+LAYERS = [
+    {"id": 0, "name": "背景", "type": "pixel", "level": 0, "visible": True,
+     "left": 0, "top": 0, "right": 200, "bottom": 100},
+    {"id": 1, "name": "标题", "type": "type", "level": 0, "visible": True,
+     "left": 20, "top": 10, "right": 120, "bottom": 40},
+]
+
+MODEL_COORDS = {
+    0: {"left": 0, "top": 0, "right": 100, "bottom": 100},
+    1: {"left": 30, "top": 60, "right": 80, "bottom": 75},
+}
+
+RESPONSE = "Note [see below]: 以下是新布局\n```json\n" + json.dumps(
+    [{"id": layer_id, "new_coords": coords} for layer_id, coords in MODEL_COORDS.items()]
+) + "\n```"
+
+
+class ScriptedProvider(LayoutProviderBase):
+    """按固定大小分块返回预设响应"""
+
+    name = "scripted"
+
+    def __init__(self, text: str, chunk_size: int = 7):
+        self.text = text
+        self.chunk_size = chunk_size
+
+    async def complete(self, request: LayoutRequest, max_retries: int = 3) -> str:
+        return self.text
+
+    async def stream(self, request: LayoutRequest, max_retries: int = 3):
+        for start in range(0, len(self.text), self.chunk_size):
+            yield self.text[start:start + self.chunk_size]
+
+
+def test_parser_skips_preamble_brackets():
+    """说明文字中的 [see below] 不是数组开始，逐字符输入也一样"""
+    print("=" * 60)
+    print("测试1: 增量解析器跳过说明文字中的方括号")
+    print("=" * 60)
+
+    for chunk_size in (1, 3, len(RESPONSE)):
+        parser = IncrementalJSONArrayParser()
+        objects = []
+        for start in range(0, len(RESPONSE), chunk_size):
+            objects.extend(parser.feed(RESPONSE[start:start + chunk_size]))
+        assert parser.finished, f"分块 {chunk_size}: 未读到数组结束"
+        assert [obj["id"] for obj in objects] == [0, 1], f"分块 {chunk_size}: {objects}"
+        assert parser.object_count == 2
+    print("✅ 解析出 2 个图层对象")
+
+
+def test_stream_uses_model_layout_after_preamble():
+    """流式缩放应使用模型给出的坐标，而不是回退到等比布局"""
+    print("\n" + "=" * 60)
+    print("测试2: 带说明文字的流式响应")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, "detection.png")
+        Image.new("RGB", (200, 100), "white").save(image_path)
+
+        service = GeminiPSDResizeService(provider=ScriptedProvider(RESPONSE))
+
+        async def collect():
+            return [item async for item in service.stream_resize_psd_layers(
+                LAYERS, image_path, 200, 100, 100, 100, compact=True
+            )]
+
+        items = {item["id"]: item for item in asyncio.run(collect())}
+
+    assert set(items) == {0, 1}, items
+    for layer_id, coords in MODEL_COORDS.items():
+        assert items[layer_id]["new_coords"] == coords, f"图层 {layer_id}: {items[layer_id]['new_coords']}"
+    print("✅ 2 个图层均使用模型返回的坐标")
+
+
+def main():
+    """主测试函数"""
+    tests = [test_parser_skips_preamble_brackets, test_stream_uses_model_layout_after_preamble]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__} 失败: {e}")
+    print("\n" + ("🎉 全部通过" if not failed else f"❌ {failed} 个测试失败"))
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)